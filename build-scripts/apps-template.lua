@@ -20,6 +20,12 @@ help([[${HELP}]])
 
 if (mode() == "load") then
     io.stderr:write("[" .. current_datetime .. "] Loading module " .. app_full_name .. "\n")
+    -- Usage log for ./manager.py --usage and --evict (skipped if logs/usage is not writable)
+    local usage_log = io.open(pathJoin(module_root, "logs", "usage", (os.getenv("USER") or "unknown") .. ".tsv"), "a")
+    if (usage_log) then
+        usage_log:write(os.time() .. "\t" .. app_full_name .. "\n")
+        usage_log:close()
+    end
 elseif (mode() == "unload") then
 end
 
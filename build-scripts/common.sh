@@ -46,8 +46,28 @@ script_base_dir="${modules_root}/${target}_modulefiles/${app_name}"      # modul
 script_path="${modules_root}/${target}_modulefiles/${app_name_version}"  # modulefiles/name/version or modulefiles/ref/assembly/data-type/version
 
 tmp_dir="${modules_root}/tmp/${app_name_version}" # tmp directory
+lock_file="${modules_root}/.locks/${app_name_version}.lock" # per-module install lock (shared with manager.py)
+lock_fd=""
+checkpoint_dir="${modules_root}/tmp/${app_name_version}/.checkpoints" # completed phase markers (see phase)
+resume_mode=0 # 1: keep completed phases of a previous failed build (-r)
+
+# Node-local scratch staging (off by default)
+# MODULES_SCRATCH: unset/no = build in $tmp_dir on the shared filesystem, auto = first usable candidate, or a directory
+# MODULES_SCRATCH_DIRS: candidates for auto, colon-separated (default: $TMPDIR:/local:/local/scratch:/tmp)
+# MODULES_SCRATCH_MIN_GB: required free space on the scratch directory (default: 50)
+scratch_dir=""        # selected scratch directory, empty if not staging
+stage_root=""         # scratch/modules-staging-$USER/name/version
+final_target_dir=""   # real target directory when $target_dir is staged on scratch
+build_stats_path="${modules_root}/logs/build-stats.tsv" # I/O statistics of completed builds
+inputs_dir="${modules_root}/.cache/inputs/${app_name_version}" # #INPUT: files fetched by manager.py --fetch-only
+offline=${MODULES_OFFLINE:-0} # 1: fetch_input never downloads (manager.py -i --offline)
 manager_script="${modules_root}/manager.py" # manager script path
-dependencies=$("$manager_script" --print-dependencies "${app_name_version}")
+# Internal manager.py queries. Imported as a module, manager.py is compiled once into __pycache__
+# instead of on every run as a script (see ./manager.py --benchmark-startup).
+manager_query() {
+    python3 -c 'import sys; sys.path.insert(0, sys.argv.pop(1)); import manager; manager.main()' "$modules_root" "$@"
+}
+dependencies=$(manager_query --print-dependencies "${app_name_version}")
 #endregion
 
 #region OPTION_FUNCTIONS
@@ -58,44 +78,75 @@ help_message() {
     echo "  -l  List the dependencies of the target module." 1>&2
     echo "  -d  Delete the target module." 1>&2
     echo "  -u  Update the target module." 1>&2
+    echo "  -r  Resume an interrupted install, skipping completed phases." 1>&2
+    echo "  -m  Write the modulefile of an existing target (e.g. received by manager.py --sync)." 1>&2
     echo "  -h  Help message." 1>&2
 }
 
 install() {
+    # take the install lock before setting traps, so a CTRL+C while waiting does not clean up another process's build
+    acquire_install_lock
+    if [[ -f "$script_path" ]]; then
+        print_stderr "🔗 ${YELLOW}${app_name_version}${NC} was installed by another process."
+        exit 0
+    fi
+
+    print_stderr "Installing the target module: ${YELLOW}${app_name_version}${NC}"
+    print_stderr "🎯 Target directory: $target_dir"
+    print_stderr "📜 Modulefile path: $script_path"
+    # before the traps: clean_up would remove the tmp dir and checkpoints of the build to resume
+    if [[ $resume_mode -eq 1 && -d "$target_dir" ]] && has_checkpoints; then
+        print_stderr "⏯️  Resuming from completed phases: $(ls "$checkpoint_dir" | sed 's/\.done$//' | tr '\n' ' ')"
+    else
+        # if target directory exists, exit 1
+        if [ -d "$target_dir" ]; then
+            print_stderr "${RED}ERROR${NC}: Target app dir exists!"
+            if has_checkpoints; then
+                print_stderr "An interrupted build was found. Use ${YELLOW}-r${NC} to resume it or ${YELLOW}-d${NC} to remove it."
+            fi
+            print_stderr "Exit Installing"
+            exit 1
+        fi
+        # stale markers without a target directory cannot be resumed
+        rm -rf "$checkpoint_dir"
+    fi
+
     # set traps for cleanup when installation ends or errors occur
     # For ERR and INT, run clean_up then either `exit` (if this script is executed)
     # or `return` (if this file was sourced) so we don't remain in any blocking `read`.
     trap 'echo "❌ Command failed: $BASH_COMMAND"; clean_up 1; if [[ $__COMMON_SOURCED -eq 0 ]]; then exit 1; else return 1; fi' ERR
     trap 'echo "🛑 CTRL+C detected. Exiting..."; clean_up 1; if [[ $__COMMON_SOURCED -eq 0 ]]; then exit 130; else return 130; fi' INT
+    # TERM is sent by SLURM on preemption or time limit
+    trap 'echo "🛑 SIGTERM received. Exiting..."; clean_up 1; if [[ $__COMMON_SOURCED -eq 0 ]]; then exit 143; else return 143; fi' TERM
     # EXIT trap should only perform cleanup; don't call exit/return here (it would re-trigger EXIT)
     trap 'clean_up 0' EXIT
-    
-    print_stderr "Installing the target module: ${YELLOW}${app_name_version}${NC}"
-    print_stderr "🎯 Target directory: $target_dir"
-    print_stderr "📜 Modulefile path: $script_path"
-    # if target directory exists, exit 1
-    if [ -d "$target_dir" ]; then
-        print_stderr "${RED}ERROR${NC}: Target app dir exists!"
-        print_stderr "Exit Installing"
-        exit 1
-    fi
 
     print_stderr "Checking dependencies for ${YELLOW}${app_name_version}${NC}"
     install_dependencies
     load_dependencies
 
+    setup_staging
+    build_start=$SECONDS
     mkdir -p "$target_dir"
     mkdir -p "$tmp_dir"
     cd "$tmp_dir"
     install_app
+    finalize_staging
     copy_modulefile
+    write_ref_manifest
+    record_build_stats
     print_stderr "✅ Installation completed. ${YELLOW}${app_name_version}${NC} is ready to use."
 }
 
 remove_target_directory() {
     print_stderr "Removing target directory: $target_dir"
+    if [[ -n "$stage_root" && "$target_dir" == "$stage_root"/* ]]; then
+        # staged target is removed with the staging directory
+        remove_tmp_directory
+        return 0
+    fi
     if [[ -d "$target_dir" ]]; then
-        rm -rf "$target_dir"
+        move_to_trash "$target_dir" "$app_name_version"
         del_dir="$(dirname "$target_dir")"
         while [[ "$del_dir" != "$modules_root" ]]; do
             if [[ -z "$(ls -A "$del_dir")" ]]; then
@@ -138,9 +189,14 @@ delete() {
         print_stderr "Exit Removing"
         exit 1
     fi
+    if ! acquire_install_lock -n; then
+        print_stderr "${RED}ERROR${NC}: ${YELLOW}${app_name_version}${NC} is being installed by another process. Try again later."
+        exit 1
+    fi
 
     remove_target_directory
     remove_modulefile
+    remove_tmp_directory
     print_stderr "Deletion completed. ${YELLOW}${app_name_version}${NC} is removed."
     exit
 }
@@ -153,6 +209,7 @@ update() {
         print_stderr "Exit Updating"
         exit 1
     fi
+    acquire_install_lock
 
     remove_target_directory
     remove_modulefile
@@ -162,6 +219,17 @@ update() {
     exit
 }
 
+write_modulefile() {
+    print_stderr "Writing the modulefile of ${YELLOW}${app_name_version}${NC}"
+    if [ ! -d "$target_dir" ]; then
+        print_stderr "${RED}ERROR${NC}: Target app does not exist!"
+        exit 1
+    fi
+    copy_modulefile
+    write_ref_manifest
+    exit
+}
+
 is_installed() {
     if [ -d "${modules_root}/${target}/${1}" ]; then
         echo 0
@@ -254,6 +322,15 @@ copy_modulefile() {
     sed -i "s|\${HELP}|WEBSITE: ${url}|" "${script_path}.lua"
     special_modulefiles
 }
+
+write_ref_manifest() {
+    # ref/<module>/.module.json: exported variables, files and provenance (read by manager.py --print-ref-env)
+    if [[ "$target" != "ref" ]]; then
+        return 0
+    fi
+    print_stderr "Writing ${BLUE}.module.json${NC}"
+    manager_query --write-ref-manifest "$app_name_version" || print_stderr "${RED}WARNING${NC}: failed to write .module.json"
+}
 #endregion
 
 #region UTILITIES
@@ -285,6 +362,130 @@ tar_xf_pigz() {
     fi
 }
 
+# Get an input declared in the script header: fetch_input <name> [dest (default: ./<name>)]
+#   #INPUT:<name> <url> [sha256:<hex>]
+# Inputs fetched beforehand by `manager.py --fetch-only` are copied (reflinked if the filesystem
+# supports it) from $inputs_dir, others are downloaded unless offline. The sha256 is checked if given.
+# Not hardlinked: gzip/pigz refuse files with other links, and in-place edits would change the cache.
+fetch_input() {
+    local name="$1"
+    local dest="${2:-$1}"
+    local url sha256
+    read -r url sha256 < <(awk -v n="#INPUT:$1" '$1 == n { print $2, $3; exit }' "$install_script_path") || true
+    if [[ -z "$url" ]]; then
+        print_stderr "${RED}No #INPUT:${name} line in ${install_script_path}${NC}"
+        return 1
+    fi
+    sha256="${sha256#sha256:}"
+    if [[ -f "${inputs_dir}/${name}" ]]; then
+        print_stderr "Using fetched ${YELLOW}${name}${NC}"
+        cp --reflink=auto "${inputs_dir}/${name}" "${dest}.partial"
+        mv "${dest}.partial" "$dest"
+    elif [[ "$offline" == "1" ]]; then
+        print_stderr "${RED}${name} was not fetched.${NC} Run ${YELLOW}./manager.py --fetch-only ${app_name_version}${NC} on a node with network."
+        return 1
+    else
+        print_stderr "Downloading ${YELLOW}${name}${NC}"
+        wget -nv -O "${dest}.partial" "$url"
+        mv "${dest}.partial" "$dest"
+    fi
+    if [[ -n "$sha256" ]] && ! echo "${sha256}  ${dest}" | sha256sum -c --status; then
+        print_stderr "${RED}sha256 of ${name} does not match ${sha256}${NC}"
+        rm -f "$dest"
+        return 1
+    fi
+}
+
+is_bgzf() {
+    # BGZF is gzip with a "BC" extra field in every block, which makes it randomly accessible
+    [[ "$(head -c 14 "$1" | od -An -tx1 | tr -d ' \n')" =~ ^1f8b0804[0-9a-f]{16}4243$ ]]
+}
+
+bgzip_fasta() {
+    # Stream a FASTA (plain or .gz) into a BGZF file indexed with .fai and .gzi
+    # Usage: bgzip_fasta <input.fa[.gz]> <output.fa.gz>
+    local input="$1" output="$2"
+    if ! command -v bgzip &> /dev/null; then
+        print_stderr "${RED}ERROR${NC}: bgzip (htslib) not found."
+        return 1
+    fi
+    rm -f "$output" "${output}.fai" "${output}.gzi" "${output}.partial"
+    if [[ "$input" == *.gz ]]; then
+        pigz_or_gunzip_pipe "$input"
+    else
+        cat "$input"
+    fi | bgzip -@ "$ncpu" -c > "${output}.partial"
+    mv "${output}.partial" "$output"
+    samtools faidx "$output"
+}
+
+check_bgzf_fasta() {
+    # Check a BGZF FASTA and its indexes. With the .fai of the plain FASTA, also check that both have the same sequences.
+    # Usage: check_bgzf_fasta <fasta.gz> [plain.fa.fai]
+    local fasta_bgz="$1" plain_fai="${2:-}"
+    if ! is_bgzf "$fasta_bgz"; then
+        print_stderr "${RED}ERROR${NC}: $fasta_bgz is not BGZF compressed."
+        return 1
+    fi
+    if [[ ! -s "${fasta_bgz}.fai" || ! -s "${fasta_bgz}.gzi" ]]; then
+        print_stderr "${RED}ERROR${NC}: ${fasta_bgz}.fai or ${fasta_bgz}.gzi is missing."
+        return 1
+    fi
+    if [[ -n "$plain_fai" ]] && ! cmp -s <(cut -f1,2 "$plain_fai") <(cut -f1,2 "${fasta_bgz}.fai"); then
+        print_stderr "${RED}ERROR${NC}: sequences of $fasta_bgz differ from $plain_fai."
+        return 1
+    fi
+    print_stderr "✅ $fasta_bgz is BGZF compressed and indexed."
+}
+
+index_gtf() {
+    # Sort, bgzip and tabix-index a GTF, and write gene and transcript tables (bgzip TSV, tabix-indexed by coordinates)
+    # Usage: index_gtf <annotation.gtf.gz> <output prefix>
+    # Output: <prefix>.sorted.gtf.gz, <prefix>.genes.tsv.gz, <prefix>.transcripts.tsv.gz (each with .tbi)
+    local gtf_gz="$1" prefix="$2" tool
+    for tool in bgzip tabix; do
+        if ! command -v "$tool" &> /dev/null; then
+            print_stderr "${RED}ERROR${NC}: $tool (htslib) not found."
+            return 1
+        fi
+    done
+    rm -f "${prefix}".{sorted.gtf,genes.tsv,transcripts.tsv}.gz{,.tbi,.partial}
+
+    print_stderr "Sorting and indexing ${BLUE}${gtf_gz}${NC}"
+    {
+        pigz_or_gunzip_pipe "$gtf_gz" | grep '^#' || true
+        pigz_or_gunzip_pipe "$gtf_gz" | grep -v '^#' | LC_ALL=C sort -t $'\t' -k1,1 -k4,4n -k5,5n --parallel="$ncpu" -T "$tmp_dir"
+    } | bgzip -@ "$ncpu" -c > "${prefix}.sorted.gtf.gz.partial"
+    mv "${prefix}.sorted.gtf.gz.partial" "${prefix}.sorted.gtf.gz"
+    tabix -p gff "${prefix}.sorted.gtf.gz"
+
+    print_stderr "Writing gene and transcript tables of ${BLUE}${gtf_gz}${NC}"
+    pigz_or_gunzip_pipe "${prefix}.sorted.gtf.gz" | awk -F '\t' -v OFS='\t' \
+        -v genes="${tmp_dir}/genes.tsv" -v transcripts="${tmp_dir}/transcripts.tsv" '
+        function attr(name) {
+            if (match($9, name " \"[^\"]*\"")) return substr($9, RSTART + length(name) + 2, RLENGTH - length(name) - 3)
+            return "NA"
+        }
+        BEGIN {
+            print "#chrom", "start", "end", "strand", "gene_id", "gene_name", "gene_type" > genes
+            print "#chrom", "start", "end", "strand", "transcript_id", "transcript_name", "transcript_type", "gene_id", "gene_name" > transcripts
+        }
+        $3 == "gene" {
+            type = attr("gene_type"); if (type == "NA") type = attr("gene_biotype")
+            print $1, $4, $5, $7, attr("gene_id"), attr("gene_name"), type > genes
+        }
+        $3 == "transcript" {
+            type = attr("transcript_type"); if (type == "NA") type = attr("transcript_biotype")
+            print $1, $4, $5, $7, attr("transcript_id"), attr("transcript_name"), type, attr("gene_id"), attr("gene_name") > transcripts
+        }'
+    local table
+    for table in genes transcripts; do
+        bgzip -@ "$ncpu" -c "${tmp_dir}/${table}.tsv" > "${prefix}.${table}.tsv.gz"
+        tabix -s 1 -b 2 -e 3 "${prefix}.${table}.tsv.gz"
+        rm -f "${tmp_dir}/${table}.tsv"
+    done
+}
+
 remove_default_dependencies() {
     dep_name="$1"
 
@@ -306,6 +507,62 @@ remove_default_dependencies() {
 }
 
 
+# Print a string as a JSON string literal
+json_string() {
+    local s="${1//\\/\\\\}"
+    s="${s//\"/\\\"}"
+    s="${s//$'\n'/\\n}"
+    s="${s//$'\r'/\\r}"
+    s="${s//$'\t'/\\t}"
+    printf '"%s"' "$s"
+}
+
+# Rename a directory into the trash (instant on the same filesystem) and let a background
+# `manager.py --empty-trash` worker delete it. Falls back to rm -rf on another filesystem.
+# Usage: move_to_trash <dir> <label>
+move_to_trash() {
+    local trash_dir="${modules_root}/.trash"
+    local entry="${trash_dir}/$(date +%Y%m%d-%H%M%S)-$$-${RANDOM}-${2//\//_}"
+    mkdir -p "$trash_dir"
+    if [[ "$(stat -c %d "$1")" != "$(stat -c %d "$trash_dir")" ]] || ! mv -T "$1" "$entry" 2>/dev/null; then
+        rm -rf "$1"
+        return 0
+    fi
+    printf '{"label": %s, "origin": %s, "trashed_at": "%s"}\n' "$(json_string "$2")" "$(json_string "$1")" "$(date +"%Y-%m-%d %T")" > "${entry}.json"
+    mkdir -p "${modules_root}/logs"
+    # The worker must not inherit the install lock, or the module stays locked until the trash is empty
+    if [[ -n "$lock_fd" ]]; then
+        setsid nohup "$manager_script" --empty-trash >> "${modules_root}/logs/trash.log" 2>&1 < /dev/null {lock_fd}>&- &
+    else
+        setsid nohup "$manager_script" --empty-trash >> "${modules_root}/logs/trash.log" 2>&1 < /dev/null &
+    fi
+}
+
+# Take the per-module install lock (same lock file as manager.py). Waits if another process holds it.
+# -n: do not wait, return 1 if the lock is held
+acquire_install_lock() {
+    # manager.py already holds the lock when it runs this script
+    if [[ "${MODULES_LOCK_HELD:-}" == "$app_name_version" || -n "$lock_fd" ]]; then
+        return 0
+    fi
+    if ! command -v flock &> /dev/null; then
+        print_stderr "${RED}WARNING${NC}: flock not found. Concurrent installs of ${YELLOW}${app_name_version}${NC} are not protected."
+        return 0
+    fi
+    mkdir -p "$(dirname "$lock_file")"
+    exec {lock_fd}>>"$lock_file"
+    if ! flock -n "$lock_fd"; then
+        if [[ "$1" == "-n" ]]; then
+            exec {lock_fd}>&-
+            lock_fd=""
+            return 1
+        fi
+        print_stderr "⏳ ${YELLOW}${app_name_version}${NC} is being installed by another process ($(cat "$lock_file" 2>/dev/null)). Waiting..."
+        flock "$lock_fd"
+    fi
+    echo "pid=$$ host=$(hostname) since=$(date +"%Y-%m-%d %T")" > "$lock_file"
+}
+
 # Function to clean up the temporary directory
 clean_up () {
     [[ $cleanup_called -eq 1 ]] && return 0
@@ -315,14 +572,39 @@ clean_up () {
     sleep 1
     cd "$modules_root"
 
-    if [[ "$status" == "1" ]]; then
+    if [[ "$status" == "1" && -z "$stage_root" ]] && has_checkpoints; then
+        print_error_message
+        print_stderr "Keeping completed phases ($(ls "$checkpoint_dir" | sed 's/\.done$//' | tr '\n' ' ')) and ${tmp_dir}."
+        print_stderr "Resume with: ${YELLOW}bash ${install_script_path#${modules_root}/} -r${NC} or ${YELLOW}./manager.py -i ${app_name_version} --resume${NC}"
+        remove_modulefile
+    elif [[ "$status" == "1" ]]; then
         print_stderr "Removing incomplete installation."
         print_error_message
         remove_target_directory
         remove_modulefile
-    elif [[ -d "$tmp_dir" ]]; then
+        if [[ -n "$stage_root" ]]; then
+            remove_tmp_directory
+        fi
+    else
+        remove_tmp_directory
+    fi
+}
+
+remove_tmp_directory() {
+    if [[ -n "$stage_root" ]]; then
+        if [[ -d "$stage_root" ]]; then
+            print_stderr "Removing staging directory: $stage_root"
+            rm -rf "$stage_root"
+        fi
+        del_dir="$(dirname "$stage_root")"
+        while [[ "$del_dir" != "$scratch_dir" ]] && rmdir "$del_dir" 2>/dev/null; do
+            del_dir="$(dirname "$del_dir")"
+        done
+        return 0
+    fi
+    if [[ -d "$tmp_dir" ]]; then
         print_stderr "Removing temporary directory: $tmp_dir"
-        rm -rf "$tmp_dir"
+        move_to_trash "$tmp_dir" "tmp/$app_name_version"
         del_dir="$(dirname "$tmp_dir")"
         while [[ "$del_dir" != "$modules_root" ]]; do
             if [[ -z "$(ls -A "$del_dir")" ]]; then
@@ -336,6 +618,119 @@ clean_up () {
     fi
 }
 
+# Run a named build phase once: phase <name> <command> [args...]
+# Each phase starts in $tmp_dir. When it succeeds, a marker is written to $checkpoint_dir.
+# If the build fails later, $target_dir and $tmp_dir are kept, and a resumed build (-r)
+# skips the completed phases. A phase must be safe to re-run from the start.
+phase() {
+    local name="$1"
+    shift
+    if [[ -f "${checkpoint_dir}/${name}.done" ]]; then
+        print_stderr "⏭️  Skipping completed phase: ${BLUE}${name}${NC}"
+        return 0
+    fi
+    print_stderr "▶️  Phase: ${BLUE}${name}${NC}"
+    mkdir -p "$checkpoint_dir"
+    cd "$tmp_dir"
+    "$@"
+    cd "$tmp_dir"
+    date +"%Y-%m-%d %T" > "${checkpoint_dir}/${name}.done"
+}
+
+# Select a node-local scratch directory (see MODULES_SCRATCH) and move $tmp_dir there.
+# For ref modules the target is also built on scratch and moved into place by finalize_staging.
+# App targets stay in place, because conda prefixes and compiled apps embed their install path.
+setup_staging() {
+    local request="${MODULES_SCRATCH:-}"
+    if [[ -z "$request" || "$request" =~ ^(no|NO|0|false|FALSE)$ ]]; then
+        return 0
+    fi
+    if [[ $resume_mode -eq 1 ]] && has_checkpoints; then
+        print_stderr "Resuming on the shared filesystem; scratch staging is disabled for this build."
+        return 0
+    fi
+
+    local min_kb=$(( ${MODULES_SCRATCH_MIN_GB:-50} * 1024 * 1024 ))
+    local candidates
+    if [[ "$request" == "auto" ]]; then
+        candidates="${MODULES_SCRATCH_DIRS:-${TMPDIR:-}:/local:/local/scratch:/tmp}"
+    else
+        candidates="$request"
+    fi
+
+    local dir avail_kb
+    IFS=':' read -ra dirs <<< "$candidates"
+    for dir in "${dirs[@]}"; do
+        [[ -n "$dir" && -d "$dir" && -w "$dir" ]] || continue
+        avail_kb=$(df -Pk "$dir" 2>/dev/null | awk 'NR==2 {print $4}')
+        if [[ -z "$avail_kb" || "$avail_kb" -lt "$min_kb" ]]; then
+            print_stderr "Scratch candidate $dir has $(( ${avail_kb:-0} / 1024 / 1024 )) GB free (need ${MODULES_SCRATCH_MIN_GB:-50} GB). Skipping."
+            continue
+        fi
+        scratch_dir="$(realpath "$dir")"
+        break
+    done
+    if [[ -z "$scratch_dir" ]]; then
+        print_stderr "${RED}WARNING${NC}: No usable scratch directory in ${candidates}. Building on the shared filesystem."
+        return 0
+    fi
+
+    stage_root="${scratch_dir}/modules-staging-${USER:-$(id -un)}/${app_name_version}"
+    rm -rf "$stage_root" # leftover of a killed build on this node
+    tmp_dir="${stage_root}/tmp"
+    # phase markers only make sense where the phase outputs are
+    checkpoint_dir="${stage_root}/.checkpoints"
+    if [[ "$target" == "ref" ]]; then
+        final_target_dir="$target_dir"
+        target_dir="${stage_root}/target"
+    fi
+    print_stderr "💽 Staging on node-local scratch: $stage_root"
+}
+
+# Move a target built on scratch into place: one copy to a hidden sibling, then an atomic rename
+finalize_staging() {
+    cd "$modules_root"
+    if [[ -z "$final_target_dir" ]]; then
+        return 0
+    fi
+    local partial_dir
+    partial_dir="$(dirname "$final_target_dir")/.$(basename "$final_target_dir").staging.$$"
+    print_stderr "Moving staged target to $final_target_dir"
+    mkdir -p "$(dirname "$final_target_dir")"
+    rm -rf "$partial_dir"
+    # resumed or failed earlier builds may have created an empty target directory
+    rmdir "$final_target_dir" 2>/dev/null || true
+    mv "$target_dir" "$partial_dir"
+    mv "$partial_dir" "$final_target_dir"
+    target_dir="$final_target_dir"
+    final_target_dir=""
+}
+
+# Append wall time and I/O counters of this build to logs/build-stats.tsv
+# /proc/$$/io includes the children this shell has waited for.
+record_build_stats() {
+    local elapsed=$(( SECONDS - build_start ))
+    local rchar=0 wchar=0 read_bytes=0 write_bytes=0 target_bytes
+    if [[ -r /proc/$$/io ]]; then
+        rchar=$(awk '/^rchar:/ {print $2}' /proc/$$/io)
+        wchar=$(awk '/^wchar:/ {print $2}' /proc/$$/io)
+        read_bytes=$(awk '/^read_bytes:/ {print $2}' /proc/$$/io)
+        write_bytes=$(awk '/^write_bytes:/ {print $2}' /proc/$$/io)
+    fi
+    target_bytes=$(du -sb "$target_dir" 2>/dev/null | cut -f1)
+    mkdir -p "$(dirname "$build_stats_path")"
+    if [[ ! -f "$build_stats_path" ]]; then
+        printf "date\tmodule\tmode\tscratch\telapsed_s\trchar\twchar\tread_bytes\twrite_bytes\ttarget_bytes\tncpu\thost\n" > "$build_stats_path"
+    fi
+    printf "%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n" \
+        "$(date +"%Y-%m-%d %T")" "$app_name_version" "$([[ -n "$scratch_dir" ]] && echo scratch || echo shared)" "${scratch_dir:-NA}" \
+        "$elapsed" "$rchar" "$wchar" "$read_bytes" "$write_bytes" "${target_bytes:-0}" "$ncpu" "$(hostname)" >> "$build_stats_path" || true
+}
+
+has_checkpoints() {
+    [[ -d "$checkpoint_dir" && -n "$(ls -A "$checkpoint_dir" 2>/dev/null)" ]]
+}
+
 print_error_message() {
     # Custom error message can be defined in the build script
     # print_stderr "Possible Reason: Missing dependencies or Expired links"
@@ -352,13 +747,15 @@ main() {
     fi
 
     # Parse the parameters
-    while getopts ":hdilu" opt; do
+    while getopts ":hdilurm" opt; do
         case ${opt} in
             h ) help_message ; exit;;
             i ) install ;;
             l ) print_dependencies ;;
             d ) delete ;;
+            r ) resume_mode=1 ; install ;;
             u ) update ;;
+            m ) write_modulefile ;;
             \? )
                 print_stderr "${RED}ERROR${NC}: Invalid option: $OPTARG"
                 help_message
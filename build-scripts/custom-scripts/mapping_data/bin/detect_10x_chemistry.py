@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Detect the 10x chemistry of sampled reads in one pass (used by starsolo_10x_auto.sh).
+
+R1 is read once: the 16 bp and 14 bp barcode prefixes are counted and the read lengths
+collected. With the packed whitelists of data-utils/cellranger/9.0.1-barcodes (BARCODE_TABLE),
+each distinct prefix is looked up once in the memory-mapped membership table of all lists.
+Otherwise each text whitelist is streamed once and its barcodes looked up in the prefix
+counts, so no whitelist is held in memory. The result is printed as shell assignments:
+
+    eval "$(detect_10x_chemistry.py test.R1.fastq test.R2.fastq)"
+"""
+import os
+import sys
+import gzip
+import shlex
+import argparse
+from collections import Counter
+from typing import Dict, List, Optional
+
+# (name in BARCODE_<name>, count variable, barcode length, chemistry), in the order they are tried
+CHEMISTRIES = [
+    ("3PV3",  "NBC3", 16, "3 prime v3"),
+    ("3PV2",  "NBC2", 16, "3 prime v2"),
+    ("ARCV1", "NBCA", 16, "ATAC + RNA"),
+    ("3PV1",  "NBC1", 14, "3 prime v1"),
+    ("3PV4",  "NBC4", 16, "3 prime v4"),
+    ("5PV3",  "NBC5", 16, "5 prime v3"),
+]
+
+def open_text(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt")
+    return open(path, "r")
+
+def read_lengths(path: str, prefixes: Optional[Dict[int, Counter]] = None) -> Counter:
+    """Return {read length: count} of a FASTQ file, counting barcode prefixes into prefixes."""
+    lengths: Counter = Counter()
+    with open_text(path) as f:
+        for i, line in enumerate(f):
+            if i % 4 != 1:
+                continue
+            seq = line.rstrip("\n")
+            lengths[len(seq)] += 1
+            if prefixes is not None:
+                for n, counter in prefixes.items():
+                    counter[seq[:n]] += 1
+    return lengths
+
+def count_matches(whitelist: str, counter: Counter) -> int:
+    """Number of reads whose barcode prefix is in the whitelist (one barcode per line)."""
+    total = 0
+    with open_text(whitelist) as f:
+        for line in f:
+            total += counter.get(line.rstrip("\n"), 0)
+    return total
+
+def count_packed(table_path: str, prefixes: Dict[int, Counter]) -> Dict[str, int]:
+    """
+    Matches per list (by BARCODE_<name>) from a membership table. 14 bp and 16 bp barcodes
+    have distinct keys, so each prefix only matches lists of its own length.
+    """
+    sys.path.insert(0, os.environ.get("BARCODE_PACKED_DIR") or os.path.dirname(table_path))
+    from barcode_pack import MembershipTable
+    table = MembershipTable(table_path)
+    counts = {name: 0 for name in table.names}
+    for counter in prefixes.values():
+        for prefix, count in counter.items():
+            mask = table.lookup(prefix)
+            while mask:
+                bit = mask & -mask
+                counts[table.names[bit.bit_length() - 1]] += count
+                mask ^= bit
+    return counts
+
+def mean_length(lengths: Counter) -> int:
+    """Mean read length rounded half up, like awk's printf "%d", sum/NR+0.5."""
+    n = sum(lengths.values())
+    return int(sum(k * v for k, v in lengths.items()) / n + 0.5) if n else 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Detect the 10x chemistry of sampled R1/R2 reads and print shell variables")
+    parser.add_argument("r1", help="Sampled barcode reads (FASTQ, may be gzipped)")
+    parser.add_argument("r2", help="Sampled biological reads (FASTQ, may be gzipped)")
+    parser.add_argument("--min-matches", type=int, default=50000, help="Matching reads needed to accept a whitelist (default: 50000)")
+    args = parser.parse_args()
+
+    whitelists = {}
+    for name, _, _, _ in CHEMISTRIES:
+        path = os.environ.get(f"BARCODE_{name}")
+        if not path:
+            sys.exit(f"ERROR: BARCODE_{name} is not set. Load data-utils/cellranger/9.0.1-barcodes first.")
+        whitelists[name] = path
+
+    prefixes = {n: Counter() for n in sorted({n for _, _, n, _ in CHEMISTRIES})}
+    r1_lengths = read_lengths(args.r1, prefixes)
+    r2_lengths = read_lengths(args.r2)
+
+    packed: Dict[str, int] = {}
+    table_path = os.environ.get("BARCODE_TABLE")
+    if table_path and os.path.exists(table_path):
+        packed = count_packed(table_path, prefixes)
+
+    result: Dict[str, str] = {}
+    chosen: List[str] = []
+    for name, var, n, chemistry in CHEMISTRIES:
+        count = packed[name] if name in packed else count_matches(whitelists[name], prefixes[n])
+        result[var] = str(count)
+        if not chosen and count > args.min_matches:
+            chosen = [whitelists[name], chemistry]
+    result["BC"] = chosen[0] if chosen else ""
+    result["CHEM"] = chosen[1] if chosen else ""
+    result["R1LEN"] = str(mean_length(r1_lengths))
+    result["R2LEN"] = str(mean_length(r2_lengths))
+    result["R1DIS"] = str(len(r1_lengths))
+    result["NREADS"] = str(sum(r1_lengths.values()))
+    for var, value in result.items():
+        print(f"{var}={shlex.quote(value)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Find the FASTQ files of samples in one directory walk, and draw a paired random sample of reads.
+
+Files are classified by name into sample, mate (R1/R2, I1/I2), lane and naming convention:
+  ena        <sample>_1.fastq.gz / <sample>_2.fastq.gz
+  regular    <sample>.R1.fastq.gz / <sample>_R1.fastq.gz
+  cellranger <sample>_S1_L001_R1_001.fastq.gz
+  hra        <sample>_f1.fastq.gz / <sample>_r2.fastq.gz
+A file also belongs to a sample if it is in a directory named after the sample.
+
+The sample is a bottom-k sample: every read pair gets a seeded random key and the pairs with the
+k smallest keys are kept. Each file pair is read (and decompressed with pigz if available) in
+its own process, and the per-file samples are merged, so the result is a uniform sample over
+all reads of all files, and the same for the same seed.
+
+    fastq_discover.py list <fastq_dir> [--sample S]               # TSV listing
+    eval "$(fastq_discover.py files <fastq_dir> <sample>)"        # R1, R2, GZIP, ZCMD for starsolo_10x_auto.sh
+    fastq_discover.py sample <fastq_dir> <sample> -n 200000 --seed 100 -o test   # test.R1.fastq, test.R2.fastq
+"""
+import os
+import re
+import sys
+import gzip
+import bz2
+import heapq
+import shlex
+import random
+import shutil
+import argparse
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+# (convention, pattern) in the order starsolo_10x_auto.sh prefers them when a sample matches several
+CONVENTIONS = [
+    ("ena",        re.compile(r"^(?P<sample>.+?)_(?P<mate>[12])\.f(?:ast)?q(?P<ext>\.gz|\.bz2)?$")),
+    ("regular",    re.compile(r"^(?P<sample>.+?)[._](?P<mate>R[12])\.f(?:ast)?q(?P<ext>\.gz|\.bz2)?$")),
+    ("cellranger", re.compile(r"^(?P<sample>.+?)(?:_S\d+)?(?:_L(?P<lane>\d{3}))?_(?P<mate>[RI][12])_(?P<chunk>\d{3})\.f(?:ast)?q(?P<ext>\.gz|\.bz2)?$")),
+    ("hra",        re.compile(r"^(?P<sample>.+?)_(?P<mate>f1|r2)\.f(?:ast)?q(?P<ext>\.gz|\.bz2)?$")),
+]
+MATES = {"1": "R1", "2": "R2", "R1": "R1", "R2": "R2", "f1": "R1", "r2": "R2", "I1": "I1", "I2": "I2"}
+
+def classify(name: str) -> Optional[Dict[str, str]]:
+    for convention, pattern in CONVENTIONS:
+        match = pattern.match(name)
+        if match:
+            return {"sample": match.group("sample"), "mate": MATES[match.group("mate")], "convention": convention,
+                    "lane": match.groupdict().get("lane") or "", "chunk": match.groupdict().get("chunk") or "",
+                    "compression": (match.group("ext") or "").lstrip(".")}
+    return None
+
+def scan(fastq_dir: str) -> List[Dict[str, str]]:
+    """All FASTQ files under fastq_dir, classified, sorted by path."""
+    entries = []
+    fastq_dir = os.path.abspath(fastq_dir)
+    for root, dirs, names in os.walk(fastq_dir):
+        dirs.sort()
+        parents = os.path.relpath(root, fastq_dir).split(os.sep)
+        for name in names:
+            entry = classify(name)
+            if entry:
+                entry["path"] = os.path.join(root, name)
+                entry["dirs"] = parents
+                entries.append(entry)
+    return sorted(entries, key=lambda e: e["path"])
+
+def sample_files(entries: List[Dict[str, str]], sample: str) -> Dict[str, List[str]]:
+    """
+    {"R1": [...], "R2": [...]} of a sample: files named after it, or in a directory named after it,
+    of the first naming convention that has any.
+    """
+    matched = [e for e in entries if e["sample"] == sample or sample in e["dirs"]]
+    for convention, _ in CONVENTIONS:
+        files = [e for e in matched if e["convention"] == convention]
+        if any(e["mate"] == "R1" for e in files):
+            return {mate: [e["path"] for e in files if e["mate"] == mate] for mate in ("R1", "R2")}
+    return {"R1": [], "R2": []}
+
+def open_fastq(path: str, threads: int):
+    """Text stream of a (compressed) FASTQ file; gzip is decompressed by pigz in a separate process if available."""
+    if path.endswith(".gz") and shutil.which("pigz"):
+        proc = subprocess.Popen(["pigz", "-dc", "-p", str(threads), path], stdout=subprocess.PIPE)
+        return proc.stdout, proc
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb"), None
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb"), None
+    return open(path, "rb"), None
+
+def bottom_k(r1: str, r2: str, k: int, seed: int, index: int, threads: int) -> List[tuple]:
+    """
+    The k read pairs of one file pair with the smallest seeded random keys: [(-key, r1 record, r2 record)].
+    The keys are seeded by the index of the pair, not the file name: files of the same name in
+    different folders (e.g. from bamtofastq) must not pick the same read positions.
+    """
+    rng = random.Random(f"{seed}:{index}")
+    heap: List[tuple] = []  # max-heap of the kept keys (negated)
+    f1, p1 = open_fastq(r1, threads)
+    f2, p2 = open_fastq(r2, threads)
+    try:
+        while True:
+            rec1 = [f1.readline(), f1.readline(), f1.readline(), f1.readline()]
+            rec2 = [f2.readline(), f2.readline(), f2.readline(), f2.readline()]
+            if not rec1[0] or not rec2[0]:
+                if rec1[0] or rec2[0]:
+                    raise ValueError(f"{r1} and {r2} have different numbers of reads")
+                break
+            key = rng.random()
+            if len(heap) < k:
+                heapq.heappush(heap, (-key, b"".join(rec1), b"".join(rec2)))
+            elif key < -heap[0][0]:
+                heapq.heapreplace(heap, (-key, b"".join(rec1), b"".join(rec2)))
+    finally:
+        for f, p in ((f1, p1), (f2, p2)):
+            f.close()
+            if p:
+                p.kill()
+                p.wait()
+    return heap
+
+def write_sample(files: Dict[str, List[str]], n: int, seed: int, prefix: str, jobs: int):
+    """Write <prefix>.R1.fastq and <prefix>.R2.fastq with n read pairs drawn from all files."""
+    if len(files["R1"]) != len(files["R2"]):
+        raise ValueError(f"{len(files['R1'])} R1 files but {len(files['R2'])} R2 files")
+    pairs = list(zip(files["R1"], files["R2"]))
+    workers = max(1, min(jobs, len(pairs)))
+    threads = max(1, jobs // workers)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        heaps = list(pool.map(bottom_k, *zip(*pairs), [n] * len(pairs), [seed] * len(pairs), range(len(pairs)), [threads] * len(pairs)))
+    kept = heapq.nsmallest(n, (item for heap in heaps for item in heap), key=lambda item: -item[0])
+    with open(f"{prefix}.R1.fastq", "wb") as out1, open(f"{prefix}.R2.fastq", "wb") as out2:
+        for _, rec1, rec2 in kept:
+            out1.write(rec1)
+            out2.write(rec2)
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the FASTQ files of samples and draw paired random read samples")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("list", help="List classified FASTQ files as TSV")
+    p.add_argument("fastq_dir")
+    p.add_argument("--sample", help="Only this sample")
+    p = sub.add_parser("files", help="Print R1, R2, GZIP and ZCMD of a sample as shell assignments")
+    p.add_argument("fastq_dir")
+    p.add_argument("sample")
+    p = sub.add_parser("sample", help="Write a paired random sample of reads")
+    p.add_argument("fastq_dir")
+    p.add_argument("sample")
+    p.add_argument("-n", type=int, default=200000, help="Read pairs (default: 200000)")
+    p.add_argument("--seed", type=int, default=100, help="Random seed (default: 100)")
+    p.add_argument("-o", "--prefix", default="test", help="Output prefix (default: test)")
+    p.add_argument("-j", "--jobs", type=int, default=int(os.environ.get("SLURM_CPUS_PER_TASK") or os.cpu_count() or 4),
+                   help="Processes and decompression threads (default: SLURM_CPUS_PER_TASK or all cores)")
+    args = parser.parse_args()
+
+    entries = scan(args.fastq_dir)
+    if args.command == "list":
+        print("sample\tmate\tlane\tchunk\tconvention\tcompression\tpath")
+        for e in entries:
+            if not args.sample or e["sample"] == args.sample or args.sample in e["dirs"]:
+                print("\t".join(e[c] for c in ("sample", "mate", "lane", "chunk", "convention", "compression", "path")))
+        return
+
+    files = sample_files(entries, args.sample)
+    if not files["R1"]:
+        sys.exit(f"ERROR: No FASTQ files of {args.sample} found in {args.fastq_dir}.")
+    if args.command == "files":
+        compression = {os.path.splitext(path)[1] for path in files["R1"] + files["R2"]}
+        zcmd = "zcat" if ".gz" in compression else "bzcat" if ".bz2" in compression else "cat"
+        print(f"R1={shlex.quote(','.join(files['R1']))}")
+        print(f"R2={shlex.quote(','.join(files['R2']))}")
+        print(f"ZCMD={zcmd}")
+        print(f"GZIP={shlex.quote('' if zcmd == 'cat' else '--readFilesCommand ' + zcmd)}")
+    else:
+        write_sample(files, args.n, args.seed, args.prefix, args.jobs)
+
+if __name__ == "__main__":
+    main()
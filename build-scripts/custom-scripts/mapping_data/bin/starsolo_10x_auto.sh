@@ -6,7 +6,7 @@
 ## in STARsolo which on by default; the extra matrix can be found in /raw subdir
 
 print_help() {
-  echo "Usage: $0 -i <fastq_dir> -s <sample_id> -r <reference_dir> [-t <threads>] [-o <output_dir>] [-n]"
+  echo "Usage: $0 -i <fastq_dir> -s <sample_id> -r <reference_dir> [-t <threads>] [-o <output_dir>] [-n] [-g <genome_load>]"
   echo ""
   echo "This script automatically detects 10x chemistry version and runs STARsolo accordingly."
   echo "The output will be in the <output_dir>/<sample_id>/ directory."
@@ -18,13 +18,16 @@ print_help() {
   echo "  -t    number of threads (default: 16)"
   echo "  -o    output directory (default: current directory)"
   echo "  -n    no BAM output (default: output)"
+  echo "  -g    STAR --genomeLoad of the final run (default: LoadAndRemove; LoadAndKeep when the genome"
+  echo "        is kept in shared memory for several samples, e.g. by starsolo_batch.py)"
   echo "  -h    display this help message"
 }
 
 NO_BAM=false
 OUTPUT_DIR="."
+GENOME_LOAD=LoadAndRemove
 
-while getopts i:s:r:t:o:n:h flag; do
+while getopts i:s:r:t:o:g:nh flag; do
     case "${flag}" in
         i) FQDIR=${OPTARG};;   # input fastq dir
         s) TAG=${OPTARG};;     # sample id
@@ -32,6 +35,7 @@ while getopts i:s:r:t:o:n:h flag; do
         t) CPUS=${OPTARG};;    # number of threads
         o) OUTPUT_DIR=${OPTARG};; # output directory
         n) NO_BAM=true;;    # no BAM output
+        g) GENOME_LOAD=${OPTARG};; # genome shared memory mode of the final run
         h) 
            print_help
            exit 0;;
@@ -49,6 +53,7 @@ fi
 # absolute path for FQDIR and REF
 FQDIR=$(readlink -f "$FQDIR")
 REF=$(readlink -f "$REF")
+BIN_DIR=$(dirname "$(readlink -f "$0")") # helper scripts shipped next to this one
 
 # Check if barcode files are available in environment variables; if not exit with error
 module load data-utils/cellranger/9.0.1-barcodes
@@ -58,7 +63,7 @@ if [[ -z "$BARCODE_3PV1" || -z "$BARCODE_3PV2" || -z "$BARCODE_3PV3" || -z "$BAR
     exit 1
 fi
 
-for app in seqtk STAR samtools; do
+for app in STAR samtools python3; do
   if ! command -v $app &> /dev/null; then
     echo "ERROR: $app not found in PATH. Please load the appropriate module, use conda env, or singularity."
     exit 1
@@ -77,36 +82,19 @@ mkdir -p $OUTPUT_DIR && cd $OUTPUT_DIR
 mkdir -p $TAG && cd $TAG
 
 ## four popular cases: ENA - <sample>_1.fastq/<sample>_2.fastq, regular - <sample>.R1.fastq/<sample>.R2.fastq
-## Cell Ranger - <sample>_L001_R1_S001.fastq/<sample>_L001_R2_S001.fastq, and HRA - <sample>_f1.fastq/<sample>_r2.fastq
-## the command below will generate a comma-separated list for each read if there are >1 file for each mate
-## archives (gzip/bzip2) are considered below; both .fastq and .fq should work, too. 
+## Cell Ranger - <sample>_S1_L001_R1_001.fastq/<sample>_S1_L001_R2_001.fastq, and HRA - <sample>_f1.fastq/<sample>_r2.fastq
+## fastq_discover.py walks FQDIR once and sets R1 and R2 (comma-separated lists if there are >1 file for each mate),
+## and GZIP/ZCMD for archives (gzip/bzip2); both .fastq and .fq should work, too. 
 echo [`date +"%Y-%m-%d %T"`] Deteriming input FASTQ files naming convention...
-R1=""
-R2=""
-if [[ `find $FQDIR/* | grep -P "\/$TAG[\/\._]" | grep "_1\.f.*q"` != "" ]]
+if ! FILES=$(python3 "$BIN_DIR/fastq_discover.py" files "$FQDIR" "$TAG")
 then 
-  R1=`find $FQDIR/* | grep -P "\/$TAG[\/\._]" | grep "_1\.f.*q" | sort | tr '\n' ',' | sed "s/,$//g"`
-  R2=`find $FQDIR/* | grep -P "\/$TAG[\/\._]" | grep "_2\.f.*q" | sort | tr '\n' ',' | sed "s/,$//g"`
-elif [[ `find $FQDIR/* | grep -P "\/$TAG[\/\._]" | grep "R1\.f.*q"` != "" ]]
-then
-  R1=`find $FQDIR/* | grep -P "\/$TAG[\/\._]" | grep "R1\.f.*q" | sort | tr '\n' ',' | sed "s/,$//g"`
-  R2=`find $FQDIR/* | grep -P "\/$TAG[\/\._]" | grep "R2\.f.*q" | sort | tr '\n' ',' | sed "s/,$//g"`
-elif [[ `find $FQDIR/* | grep -P "\/$TAG[\/\._]" | grep "_R1_.*\.f.*q"` != "" ]]
-then
-  R1=`find $FQDIR/* | grep -P "\/$TAG[\/\._]" | grep "_R1_.*\.f.*q" | sort | tr '\n' ',' | sed "s/,$//g"`
-  R2=`find $FQDIR/* | grep -P "\/$TAG[\/\._]" | grep "_R2_.*\.f.*q" | sort | tr '\n' ',' | sed "s/,$//g"`
-elif [[ `find $FQDIR/* | grep -P "\/$TAG[\/\._]" | grep "_f1\.f.*q"` != "" ]]
-then
-  R1=`find $FQDIR/* | grep -P "\/$TAG[\/\._]" | grep "_f1\.f.*q" | sort | tr '\n' ',' | sed "s/,$//g"`
-  R2=`find $FQDIR/* | grep -P "\/$TAG[\/\._]" | grep "_r2\.f.*q" | sort | tr '\n' ',' | sed "s/,$//g"`
-else 
   >&2 echo "ERROR: No appropriate fastq files were found! Please check file formatting, and check if you have set the right FQDIR."
   exit 1
 fi 
+eval "$FILES"
 
-## define some key variables, in order to evaluate reads for being 1) gzipped/bzipped/un-archived; 
-## 2) having barcodes from the whitelist, and which; 3) having consistent length; 4) being single- or paired-end. 
-GZIP=""
+## define some key variables, in order to evaluate reads for being 1) having barcodes from the whitelist, and which;
+## 2) having consistent length; 3) being single- or paired-end. 
 BC=""
 NBC1=""
 NBC2=""
@@ -115,77 +103,23 @@ NBCA=""
 R1LEN=""
 R2LEN=""
 R1DIS=""
-ZCMD="cat"
-
-## see if the original fastq files are archived: 
-if [[ `find $FQDIR/* | grep -P "$TAG[\/\._]" | grep "\.gz$"` != "" ]]
-then  
-  GZIP="--readFilesCommand zcat"
-  ZCMD="zcat"
-elif [[ `find $FQDIR/* | grep -P "$TAG[\/\._]" | grep "\.bz2$"` != "" ]]
-then
-  GZIP="--readFilesCommand bzcat"
-  ZCMD="bzcat"
-fi
 
-## we need a small and random selection of reads. the solution below is a result of much trial and error.
-## in the end, we select 200k reads that represent all of the files present in the FASTQ dir for this sample.
-## have to use numbers because bamtofastq likes to make files with identical names in different folders..
+## we need a small and random selection of reads. 200k read pairs are drawn uniformly from all of the files
+## present in the FASTQ dir for this sample (all reads, not only the start of each file), files are read in parallel.
+## the same random seed makes sure the same reads are selected from R1 and R2, and in every run
 echo [`date +"%Y-%m-%d %T"`] Generating test FASTQ files for chemistry detection...
-COUNT=0
-for i in `echo $R1 | tr ',' ' '`
-do
-  $ZCMD $i | head -4000000 > $COUNT.R1_head &
-  COUNT=$((COUNT+1))
-done
-wait 
-
-COUNT=0
-for i in `echo $R2 | tr ',' ' ' `                                                
-do 
-  $ZCMD $i | head -4000000 > $COUNT.R2_head &
-  COUNT=$((COUNT+1))
-done
-wait
+python3 "$BIN_DIR/fastq_discover.py" sample "$FQDIR" "$TAG" -n 200000 --seed 100 -o test -j $CPUS
 
-## same random seed makes sure you select same reads from R1 and R2
-cat *.R1_head | $CMD seqtk sample -s100 - 200000 > test.R1.fastq &
-cat *.R2_head | $CMD seqtk sample -s100 - 200000 > test.R2.fastq &
-wait 
-rm *.R1_head *.R2_head
-
-## elucidate the right barcode whitelist to use. Grepping out N saves us some trouble. Note the special list for multiome experiments (737K-arc-v1.txt):
+## elucidate the right barcode whitelist to use. Note the special list for multiome experiments (737K-arc-v1.txt):
 ## 50k (out of 200,000) is a modified empirical number - matching only first 14-16 nt makes this more specific
+## the detector reads test.R1.fastq and test.R2.fastq once, checks all whitelists together (packed BARCODE_TABLE if available), and sets
+## NBC1 NBC2 NBC3 NBC4 NBC5 NBCA (matches), BC and CHEM (first whitelist with > 50k matches), R1LEN R2LEN R1DIS
 echo [`date +"%Y-%m-%d %T"`] Detecting 10X chemistry version...
-NBC1=`cat test.R1.fastq | awk 'NR%4==2' | cut -c-14 | grep -F -f $BARCODE_3PV1 | wc -l`
-NBC2=`cat test.R1.fastq | awk 'NR%4==2' | cut -c-16 | grep -F -f $BARCODE_3PV2 | wc -l`
-NBC3=`cat test.R1.fastq | awk 'NR%4==2' | cut -c-16 | grep -F -f $BARCODE_3PV3 | wc -l`
-NBC4=`cat test.R1.fastq | awk 'NR%4==2' | cut -c-16 | grep -F -f $BARCODE_3PV4 | wc -l`
-NBC5=`cat test.R1.fastq | awk 'NR%4==2' | cut -c-16 | grep -F -f $BARCODE_5PV3 | wc -l`
-NBCA=`cat test.R1.fastq | awk 'NR%4==2' | cut -c-16 | grep -F -f $BARCODE_ARCV1 | wc -l`
-R1LEN=`cat test.R1.fastq | awk 'NR%4==2' | awk '{sum+=length($0)} END {printf "%d\n",sum/NR+0.5}'`
-R2LEN=`cat test.R2.fastq | awk 'NR%4==2' | awk '{sum+=length($0)} END {printf "%d\n",sum/NR+0.5}'`
-R1DIS=`cat test.R1.fastq | awk 'NR%4==2' | awk '{print length($0)}' | sort | uniq -c | wc -l`
-
-if (( $NBC3 > 50000 )) 
+DETECTED=$(python3 "$BIN_DIR/detect_10x_chemistry.py" test.R1.fastq test.R2.fastq --min-matches 50000)
+eval "$DETECTED"
+
+if [[ -z "$BC" ]]
 then 
-  BC=$BARCODE_3PV3
-elif (( $NBC2 > 50000 ))
-then
-  BC=$BARCODE_3PV2
-elif (( $NBCA > 50000 ))
-then
-  BC=$BARCODE_ARCV1
-elif (( $NBC1 > 50000 )) 
-then
-  BC=$BARCODE_3PV1
-elif (( $NBC4 > 50000 )) 
-then
-  BC=$BARCODE_3PV4
-elif (( $NBC5 > 50000 )) 
-then
-  BC=$BARCODE_5PV3
-else 
   >&2 echo "ERROR: No whitelist has matched a random selection of 200,000 barcodes! Match counts: $NBC1 (v1), $NBC2 (v2), $NBC3 (v3), $NBC4 (v4-3p), $NBC5 (v3-5p), $NBCA (multiome)."
   exit 1
 fi 
@@ -230,15 +164,6 @@ then
   UMILEN=10
 fi
 
-case $BC in
-  "$BARCODE_3PV1")  CHEM="3 prime v1";;
-  "$BARCODE_3PV2")  CHEM="3 prime v2";;
-  "$BARCODE_3PV3")  CHEM="3 prime v3";;
-  "$BARCODE_3PV4")  CHEM="3 prime v4";;
-  "$BARCODE_5PV3")  CHEM="5 prime v3";;
-  "$BARCODE_ARCV1") CHEM="ATAC + RNA";;
-esac
-
 echo [`date +"%Y-%m-%d %T"`] Detected chemistry: $CHEM
 
 ## yet another failsafe! Some geniuses managed to sequence v3 10x with a 26bp R1, which also causes STARsolo grief. This fixes it.
@@ -343,13 +268,13 @@ then
   $CMD STAR --runThreadN $CPUS --genomeDir $REF --readFilesIn $R1 $R2 --runDirPerm All_RWX $GZIP $BAM --soloBarcodeMate 1 --clip5pNbases 39 0 \
      --soloType CB_UMI_Simple --soloCBwhitelist $BC --soloCBstart 1 --soloCBlen $CBLEN --soloUMIstart $((CBLEN+1)) --soloUMIlen $UMILEN --soloStrand Forward \
      --soloUMIdedup 1MM_CR --soloCBmatchWLtype 1MM_multi_Nbase_pseudocounts --soloUMIfiltering MultiGeneUMI_CR \
-     --soloCellFilter EmptyDrops_CR --outFilterScoreMin 30 --genomeLoad LoadAndRemove \
+     --soloCellFilter EmptyDrops_CR --outFilterScoreMin 30 --genomeLoad $GENOME_LOAD \
      --soloFeatures Gene GeneFull Velocyto SJ --soloOutFileNames output/ features.tsv barcodes.tsv matrix.mtx --soloMultiMappers EM
 else 
   $CMD STAR --runThreadN $CPUS --genomeDir $REF --readFilesIn $R2 $R1 --runDirPerm All_RWX $GZIP $BAM \
      --soloType CB_UMI_Simple --soloCBwhitelist $BC --soloBarcodeReadLength 0 --soloCBlen $CBLEN --soloUMIstart $((CBLEN+1)) --soloUMIlen $UMILEN --soloStrand $STRAND \
      --soloUMIdedup 1MM_CR --soloCBmatchWLtype 1MM_multi_Nbase_pseudocounts --soloUMIfiltering MultiGeneUMI_CR \
-     --soloCellFilter EmptyDrops_CR --clipAdapterType CellRanger4 --outFilterScoreMin 30 --genomeLoad LoadAndRemove \
+     --soloCellFilter EmptyDrops_CR --clipAdapterType CellRanger4 --outFilterScoreMin 30 --genomeLoad $GENOME_LOAD \
      --soloFeatures Gene GeneFull Velocyto SJ --soloOutFileNames output/ features.tsv barcodes.tsv matrix.mtx --soloMultiMappers EM
 fi
 
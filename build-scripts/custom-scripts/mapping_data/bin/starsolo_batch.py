@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Run starsolo_10x_auto.sh for many samples with one shared copy of each STAR genome.
+
+Samples come from a sample sheet (columns: sample, fastq_dir, optional reference) or from the
+FASTQ file names in a directory. For each reference the genome is loaded into shared memory once
+(STAR --genomeLoad LoadAndExit), the samples are run concurrently with --genomeLoad LoadAndKeep
+as far as the thread and memory limits allow, and the genome is removed afterwards. Each sample
+detects its own chemistry and strand. Logs go to <output>/logs/<sample>.log, and a summary
+grouped by reference and chemistry to <output>/batch_summary.tsv.
+
+    starsolo_batch.py -r $STAR_INDEX_DIR -i fastqs/ -o results/ -t 64 --mem 400
+    starsolo_batch.py --sheet samples.tsv -r $STAR_INDEX_DIR -o results/
+"""
+import os
+import sys
+import csv
+import time
+import fnmatch
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+BIN_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, BIN_DIR)
+from fastq_discover import scan
+
+def print_stderr(message: str):
+    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {message}", file=sys.stderr, flush=True)
+
+def read_sheet(path: str, default_reference: Optional[str]) -> List[Dict[str, str]]:
+    with open(path, "r", encoding="utf-8") as f:
+        header = f.readline()
+        f.seek(0)
+        rows = list(csv.DictReader(f, delimiter="\t" if "\t" in header else ","))
+    samples = []
+    for row in rows:
+        row = {k.strip().lower(): (v or "").strip() for k, v in row.items() if k}
+        reference = row.get("reference") or default_reference
+        if not row.get("sample") or not row.get("fastq_dir") or not reference:
+            raise ValueError(f"{path}: every row needs sample, fastq_dir and reference (or -r): {row}")
+        samples.append({"sample": row["sample"], "fastq_dir": row["fastq_dir"], "reference": reference})
+    return samples
+
+def discover_samples(fastq_dir: str, pattern: str) -> List[str]:
+    """Sample names of the mate 1 files under fastq_dir whose name matches the glob pattern."""
+    return sorted({e["sample"] for e in scan(fastq_dir) if e["mate"] == "R1" and fnmatch.fnmatch(os.path.basename(e["path"]), pattern)})
+
+def genome_bytes(reference: str) -> int:
+    """Shared memory needed by a STAR index (Genome, SA and SAindex)."""
+    return sum(os.path.getsize(os.path.join(reference, name)) for name in ("Genome", "SA", "SAindex")
+               if os.path.exists(os.path.join(reference, name)))
+
+def total_memory() -> int:
+    """Memory of the job (SLURM) or the available memory of the node, in bytes."""
+    if os.environ.get("SLURM_MEM_PER_NODE"):
+        return int(os.environ["SLURM_MEM_PER_NODE"]) * 1024**2
+    with open("/proc/meminfo", "r", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+def star_genome(reference: str, mode: str, workdir: str) -> bool:
+    """Load (LoadAndExit) or remove (Remove) a genome in shared memory."""
+    prefix = os.path.join(workdir, f"genome_{mode}_")
+    result = subprocess.run(["STAR", "--genomeDir", reference, "--genomeLoad", mode, "--outSAMtype", "None",
+                             "--outFileNamePrefix", prefix], stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    return result.returncode == 0
+
+def read_strand_txt(path: str) -> Dict[str, str]:
+    """Chemistry, strand and paired-end mode recorded by starsolo_10x_auto.sh."""
+    info = {}
+    keys = {"Detected Chemistry": "chemistry", "Strand (Forward = 3', Reverse = 5')": "strand", "Paired-end mode": "paired"}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key.strip() in keys:
+                    info[keys[key.strip()]] = value.strip()
+    return info
+
+def run_sample(sample: Dict[str, str], args, genome_load: str) -> Dict[str, str]:
+    log_path = os.path.join(args.output, "logs", f"{sample['sample']}.log")
+    command = ["bash", os.path.join(BIN_DIR, "starsolo_10x_auto.sh"), "-i", sample["fastq_dir"], "-s", sample["sample"],
+               "-r", sample["reference"], "-t", str(args.sample_threads), "-o", args.output, "-g", genome_load]
+    if args.no_bam:
+        command.append("-n")
+    print_stderr(f"Starting {sample['sample']}")
+    start = time.time()
+    with open(log_path, "w", encoding="utf-8") as log:
+        returncode = subprocess.call(command, stdout=log, stderr=subprocess.STDOUT)
+    elapsed = time.time() - start
+    print_stderr(f"{'Finished' if returncode == 0 else 'FAILED'} {sample['sample']} in {elapsed / 60:.1f} min")
+    row = {"sample": sample["sample"], "reference": sample["reference"], "status": "ok" if returncode == 0 else f"failed ({returncode})",
+           "chemistry": "", "strand": "", "paired": "", "minutes": f"{elapsed / 60:.1f}", "log": log_path}
+    row.update(read_strand_txt(os.path.join(args.output, sample["sample"], "strand.txt")))
+    return row
+
+def run_group(reference: str, samples: List[Dict[str, str]], args) -> List[Dict[str, str]]:
+    """Run the samples of one reference sharing its genome."""
+    genome = genome_bytes(reference)
+    sample_mem = int(args.sample_mem * 1024**3)
+    by_threads = max(1, args.threads // args.sample_threads)
+    by_memory = max(1, (args.mem - genome) // sample_mem) if args.mem else by_threads
+    slots = min(by_threads, by_memory, len(samples))
+    print_stderr(f"Reference {reference}: {len(samples)} samples, genome {genome / 1024**3:.1f} GB, "
+                 f"{slots} at a time ({args.sample_threads} threads and {args.sample_mem:g} GB each)")
+
+    genome_load = "LoadAndKeep"
+    workdir = os.path.join(args.output, "logs")
+    if not star_genome(reference, "LoadAndExit", workdir):
+        print_stderr(f"WARNING: could not load {reference} into shared memory (see {workdir}); each sample loads its own copy")
+        genome_load = "LoadAndRemove"
+        slots = min(slots, max(1, args.mem // (genome + sample_mem)) if args.mem else slots)
+    try:
+        with ThreadPoolExecutor(max_workers=slots) as pool:
+            return list(pool.map(lambda sample: run_sample(sample, args, genome_load), samples))
+    finally:
+        if genome_load == "LoadAndKeep" and not star_genome(reference, "Remove", workdir):
+            print_stderr(f"WARNING: could not remove {reference} from shared memory; run STAR --genomeDir {reference} --genomeLoad Remove")
+
+def print_summary(rows: List[Dict[str, str]], path: str):
+    columns = ["sample", "reference", "chemistry", "strand", "paired", "status", "minutes", "log"]
+    rows = sorted(rows, key=lambda r: (r["reference"], r["chemistry"], r["sample"]))
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns, delimiter="\t", extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+    shown = columns[:-1]
+    widths = [max(len(c), *(len(r.get(c, "")) for r in rows)) for c in shown]
+    print("  ".join(c.ljust(w) for c, w in zip(shown, widths)).rstrip())
+    for r in rows:
+        print("  ".join(r.get(c, "").ljust(w) for c, w in zip(shown, widths)).rstrip())
+    failed = sum(not r["status"].startswith("ok") for r in rows)
+    print(f"{len(rows) - failed} of {len(rows)} samples succeeded. Summary: {path}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run starsolo_10x_auto.sh for many samples with a shared in-memory STAR genome")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--sheet", help="Sample sheet (TSV or CSV) with columns sample, fastq_dir and optionally reference")
+    source.add_argument("-i", "--fastq-dir", help="Run every sample found in this FASTQ directory")
+    parser.add_argument("--glob", default="*", help="With -i: only FASTQ files matching this pattern, e.g. 'PBMC*' (default: all)")
+    parser.add_argument("-r", "--reference", help="STAR index directory (default for rows of the sheet without one)")
+    parser.add_argument("-o", "--output", default=".", help="Output directory (default: current directory)")
+    parser.add_argument("-t", "--threads", type=int, default=int(os.environ.get("SLURM_CPUS_PER_TASK") or os.cpu_count() or 16),
+                        help="Total threads (default: SLURM_CPUS_PER_TASK or all cores)")
+    parser.add_argument("--mem", type=float, help="Total memory in GB (default: SLURM_MEM_PER_NODE or available memory)")
+    parser.add_argument("--sample-threads", type=int, default=16, help="Threads per sample (default: 16)")
+    parser.add_argument("--sample-mem", type=float, help="Memory per sample in GB, without the shared genome (default: 64, or 16 with -n)")
+    parser.add_argument("-n", "--no-bam", action="store_true", help="No BAM output")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the samples and how they would be scheduled")
+    args = parser.parse_args()
+
+    if args.sheet:
+        samples = read_sheet(args.sheet, args.reference)
+    else:
+        if not args.reference:
+            parser.error("-i needs -r")
+        samples = [{"sample": name, "fastq_dir": args.fastq_dir, "reference": args.reference}
+                   for name in discover_samples(args.fastq_dir, args.glob)]
+    if not samples:
+        sys.exit("ERROR: no samples found.")
+    for sample in samples:
+        sample["fastq_dir"] = os.path.abspath(sample["fastq_dir"])
+        sample["reference"] = os.path.realpath(sample["reference"])
+    args.output = os.path.abspath(args.output)
+    args.mem = int(args.mem * 1024**3) if args.mem else total_memory()
+    if args.sample_mem is None:
+        args.sample_mem = 16 if args.no_bam else 64
+    args.sample_threads = min(args.sample_threads, args.threads)
+
+    groups: Dict[str, List[Dict[str, str]]] = {}
+    for sample in samples:
+        groups.setdefault(sample["reference"], []).append(sample)
+    if args.dry_run:
+        for reference, group in groups.items():
+            print(f"{reference}\t{genome_bytes(reference) / 1024**3:.1f} GB\t{' '.join(s['sample'] for s in group)}")
+        return
+
+    os.makedirs(os.path.join(args.output, "logs"), exist_ok=True)
+    rows = []
+    for reference, group in groups.items():
+        rows.extend(run_group(reference, group, args))
+    print_summary(rows, os.path.join(args.output, "batch_summary.tsv"))
+    if any(not r["status"].startswith("ok") for r in rows):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Packed 10x barcode whitelists: sorted, 2-bit encoded uint64 arrays that are mmap'ed and
+binary searched, so jobs check membership without parsing the text lists and concurrent
+jobs share the pages through the page cache.
+
+Whitelist (.u64):      16-byte header (magic b"BCW1", barcode length u32, count u64),
+                       then count sorted little-endian uint64 keys.
+Membership table:      16-byte header (magic b"BCM1", number of lists u32, count u64),
+(.mask)                the list names (16 bytes each, NUL padded), count sorted uint64 keys
+                       of all lists, then count uint8 masks (bit i: in list i).
+
+A key is the barcode in 2 bits per base (A=0 C=1 G=2 T=3) below a leading 1 bit, so barcodes
+of different lengths (14 bp 3' v1, 16 bp others) never share a key, and keys sort like barcodes.
+
+    barcode_pack.py pack <whitelist.txt[.gz]> <out.u64>
+    barcode_pack.py table <out.mask> <NAME>=<whitelist.u64> ...
+    barcode_pack.py lookup <file.u64|file.mask> <barcode> ...
+"""
+import os
+import sys
+import gzip
+import mmap
+import heapq
+import struct
+import argparse
+from array import array
+from bisect import bisect_left
+from typing import Iterator, List, Optional
+
+HEADER = struct.Struct("<4sIQ")
+WHITELIST_MAGIC = b"BCW1"
+TABLE_MAGIC = b"BCM1"
+NAME_SIZE = 16
+ENCODE = str.maketrans("ACGT", "0123")
+
+def encode(barcode: str) -> Optional[int]:
+    """Key of a barcode, or None if it has other bases than ACGT (e.g. N)."""
+    try:
+        return int("1" + barcode.translate(ENCODE), 4)
+    except ValueError:
+        return None
+
+def decode(key: int) -> str:
+    digits = []
+    while key > 1:
+        digits.append("ACGT"[key & 3])
+        key >>= 2
+    return "".join(reversed(digits))
+
+def to_little_endian(values: array) -> array:
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+def map_file(path: str):
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+class PackedWhitelist:
+    """A .u64 whitelist; `barcode in whitelist` is a binary search in the mapped file."""
+    def __init__(self, path: str):
+        self.path = path
+        self.map = map_file(path)
+        magic, self.length, self.count = HEADER.unpack_from(self.map)
+        if magic != WHITELIST_MAGIC:
+            raise ValueError(f"{path} is not a packed whitelist")
+        self.keys = memoryview(self.map)[HEADER.size:HEADER.size + 8 * self.count].cast("Q")
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, barcode: str) -> bool:
+        key = encode(barcode)
+        if key is None:
+            return False
+        i = bisect_left(self.keys, key)
+        return i < self.count and self.keys[i] == key
+
+class MembershipTable:
+    """A .mask table; lookup(barcode) returns the bit mask of the lists containing it."""
+    def __init__(self, path: str):
+        self.path = path
+        self.map = map_file(path)
+        magic, n_lists, self.count = HEADER.unpack_from(self.map)
+        if magic != TABLE_MAGIC:
+            raise ValueError(f"{path} is not a barcode membership table")
+        offset = HEADER.size
+        self.names = [self.map[offset + i * NAME_SIZE:offset + (i + 1) * NAME_SIZE].rstrip(b"\0").decode() for i in range(n_lists)]
+        offset += n_lists * NAME_SIZE
+        self.keys = memoryview(self.map)[offset:offset + 8 * self.count].cast("Q")
+        self.masks = memoryview(self.map)[offset + 8 * self.count:offset + 9 * self.count]
+
+    def lookup(self, barcode: str) -> int:
+        key = encode(barcode)
+        if key is None:
+            return 0
+        i = bisect_left(self.keys, key)
+        return self.masks[i] if i < self.count and self.keys[i] == key else 0
+
+    def lists(self, barcode: str) -> List[str]:
+        mask = self.lookup(barcode)
+        return [name for i, name in enumerate(self.names) if mask >> i & 1]
+
+def read_whitelist(path: str) -> Iterator[str]:
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt") as f:
+        for line in f:
+            fields = line.split()
+            if fields:
+                yield fields[0]  # translation lists have a second column
+
+def pack(src: str, dest: str):
+    keys = sorted({encode(bc) for bc in read_whitelist(src)} - {None})
+    if not keys:
+        raise ValueError(f"No barcodes in {src}")
+    length = keys[0].bit_length() // 2
+    if any(key.bit_length() // 2 != length for key in keys):
+        raise ValueError(f"{src} has barcodes of different lengths")
+    tmp = f"{dest}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(WHITELIST_MAGIC, length, len(keys)))
+        to_little_endian(array("Q", keys)).tofile(f)
+    os.replace(tmp, dest)
+
+def table(dest: str, lists: List[tuple]):
+    """Merge packed whitelists [(name, path)] into one membership table."""
+    if len(lists) > 8:
+        raise ValueError("A membership table holds at most 8 lists")
+    whitelists = [PackedWhitelist(path) for _, path in lists]
+    keys = array("Q")
+    masks = array("B")
+    def tagged(wl: PackedWhitelist, i: int) -> Iterator[tuple]:
+        for key in wl.keys:
+            yield key, i
+    for key, i in heapq.merge(*(tagged(wl, i) for i, wl in enumerate(whitelists))):
+        if keys and keys[-1] == key:
+            masks[-1] |= 1 << i
+        else:
+            keys.append(key)
+            masks.append(1 << i)
+    tmp = f"{dest}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(TABLE_MAGIC, len(lists), len(keys)))
+        for name, _ in lists:
+            f.write(name.encode()[:NAME_SIZE].ljust(NAME_SIZE, b"\0"))
+        to_little_endian(keys).tofile(f)
+        masks.tofile(f)
+    os.replace(tmp, dest)
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack 10x barcode whitelists into sorted 2-bit uint64 arrays")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("pack", help="Pack a text whitelist")
+    p.add_argument("src")
+    p.add_argument("dest")
+    p = sub.add_parser("table", help="Merge packed whitelists into a membership table")
+    p.add_argument("dest")
+    p.add_argument("lists", nargs="+", metavar="NAME=PATH")
+    p = sub.add_parser("lookup", help="Check barcodes against a packed whitelist or membership table")
+    p.add_argument("path")
+    p.add_argument("barcodes", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        pack(args.src, args.dest)
+    elif args.command == "table":
+        table(args.dest, [tuple(item.split("=", 1)) for item in args.lists])
+    else:
+        with open(args.path, "rb") as f:
+            magic = f.read(4)
+        if magic == TABLE_MAGIC:
+            membership = MembershipTable(args.path)
+            for barcode in args.barcodes:
+                print(f"{barcode}\t{','.join(membership.lists(barcode)) or '-'}")
+        else:
+            whitelist = PackedWhitelist(args.path)
+            for barcode in args.barcodes:
+                print(f"{barcode}\t{'yes' if barcode in whitelist else 'no'}")
+
+if __name__ == "__main__":
+    main()
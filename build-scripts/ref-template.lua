@@ -12,11 +12,48 @@ end    -- abs path of modules, /somewhere/modules
 local ref_root = pathJoin(module_root, "ref", ref_full_name) -- abs path of target ref
 local current_datetime = os.date("%Y-%m-%d %H:%M:%S") -- Record current datetime
 
+-- Node-local copy made by ./manager.py --stage (see MODULES_LOCAL_CACHE), used if complete and current
+local function read_file(path)
+    local f = io.open(path, "r")
+    if (not f) then return nil end
+    local content = f:read("*a")
+    f:close()
+    return content
+end
+local function local_copy_is_current(local_dir, shared_dir)
+    if (not isFile(pathJoin(local_dir, ".staged"))) then return false end
+    local shared_info = read_file(pathJoin(shared_dir, ".module.json"))
+    return shared_info ~= nil and shared_info == read_file(pathJoin(local_dir, ".module.json"))
+end
+local local_cache = os.getenv("MODULES_LOCAL_CACHE")
+if (local_cache and local_cache ~= "") then
+    local local_ref_root = pathJoin(local_cache, "ref", ref_full_name)
+    if (mode() == "load" and os.getenv("MODULES_STAGE_ON_LOAD") == "1" and not local_copy_is_current(local_ref_root, ref_root)) then
+        os.execute("'" .. pathJoin(module_root, "manager.py") .. "' --stage '" .. ref_full_name .. "' 1>&2")
+    end
+    if (local_copy_is_current(local_ref_root, ref_root)) then
+        ref_root = local_ref_root
+        if (mode() == "load") then
+            local last_used = io.open(pathJoin(local_ref_root, ".last_used"), "w")
+            if (last_used) then
+                last_used:write(os.time() .. "\n")
+                last_used:close()
+            end
+        end
+    end
+end
+
 whatis("Loads " .. ref_full_name)
 help("Assembly: " .. assembly .. "\tData type: " .. data_type .. "\tVersion: " .. version .. "")
 
 if (mode() == "load") then
     io.stderr:write("[" .. current_datetime .. "] Loading module " .. ref_full_name .. "\n")
+    -- Usage log for ./manager.py --usage and --evict (skipped if logs/usage is not writable)
+    local usage_log = io.open(pathJoin(module_root, "logs", "usage", (os.getenv("USER") or "unknown") .. ".tsv"), "a")
+    if (usage_log) then
+        usage_log:write(os.time() .. "\t" .. ref_full_name .. "\n")
+        usage_log:close()
+    end
 end
 
 local env_var_name = string.upper(ref_full_name:gsub("[-%./]", "_")) .. "_HOME"
@@ -1,35 +1,106 @@
 #!/usr/bin/env python3
 import os
-import platform
 import sys
-import urllib.request
 import stat
-import subprocess
-import json
 import re
-import csv
-import shutil
-import argparse
 import time
+import fcntl
+import contextlib
 from typing import Dict, List, Optional
+# Everything else (subprocess, json, csv, shutil, socket, hashlib, argparse, urllib.request, ...) is
+# imported where it is used, so the internal queries of build scripts start fast (see --benchmark-startup)
+
+# Internal queries run by common.sh for every build, answered before the argument parser is built
+FAST_QUERIES = ("--print-package-version", "--print-dependencies")
 
 def main():
+    if len(sys.argv) == 3 and sys.argv[1] in FAST_QUERIES and not os.environ.get("MODULES_PROFILE"):
+        pm = PackageManager(Config.get_tsv_path(), lazy=True)
+        if sys.argv[1] == "--print-package-version":
+            pm.print_package_version(sys.argv[2])
+        else:
+            pm.print_dependencies(sys.argv[2])
+        return
+
+    import argparse
     parser = argparse.ArgumentParser(description="Package Manager")
     parser.add_argument("-i", "--install", type=str, help="<package>/<version> to install")
     parser.add_argument("-u", "--update-local", action="store_true", help="Update local packages from build-scripts")
     parser.add_argument("-U", "--update", action="store_true", help="Update package versions in the database")
     parser.add_argument("-a", "--add", type=str, help="Add a new <package> to the database")
+    parser.add_argument("--pypi", action="store_true", help="With -a: add the package from PyPI (installed into a venv on a python module)")
     parser.add_argument("-s", "--search", type=str, help="Search for <term> in package names and descriptions")
     parser.add_argument("-l", "--list", action="store_true", help="List all packages")
     # parser.add_argument("-li", "--list-installed", action="store_true", help="List installed packages (not implemented, please use ml av)")
     parser.add_argument("-I", "--info", type=str, help="<package> to show detailed info")
     parser.add_argument("-d", "--delete", type=str, help="<package>/<version> to delete")
     parser.add_argument("-y", "--yes", action="store_true", help="Automatic yes to prompts (use with caution)")
+    parser.add_argument("--resume", action="store_true", help="With -i: resume an interrupted local build, skipping completed phases")
+    parser.add_argument("--no-lock", action="store_true", help="With -i: solve conda (or PyPI) packages again instead of installing from the recorded lockfile")
+    parser.add_argument("--plan", nargs="+", metavar="TARGET", help="Show what installing targets (or files listing them) needs: modules to install, download size, disk use and time from previous builds")
+    parser.add_argument("--offline", action="store_true", help="With -i: install without network, from inputs and packages downloaded by --fetch-only or --prefetch")
+    parser.add_argument("--fetch-only", nargs="+", metavar="TARGET", help="Download the #INPUT: files and conda packages of targets and their dependencies for -i --offline")
+    parser.add_argument("--prefetch", nargs="+", metavar="TARGET", help="Solve and download the conda packages of <package>/<version> targets (or files listing them) for -i --offline")
+    parser.add_argument("--scratch", nargs="?", const="auto", metavar="DIR", help="With -i: build local packages on node-local scratch (DIR or auto: $TMPDIR, /local, ...)")
+    parser.add_argument("--build-stats", action="store_true", help="Summarize build time and I/O of local builds (shared vs scratch)")
+    parser.add_argument("--empty-trash", action="store_true", help="Remove deleted modules from the trash now, with progress (normally done in the background)")
+    parser.add_argument("--trash-status", action="store_true", help="Show deleted modules still waiting to be removed")
+    parser.add_argument("--export", nargs="+", metavar=("BUNDLE", "MODULE"), help="Pack installed modules (or prefixes like grch38) into a zstd bundle ('-' for stdout)")
+    parser.add_argument("--import", dest="import_bundle", metavar="BUNDLE", help="Unpack a bundle created by --export ('-' for stdin)")
+    parser.add_argument("--sync", nargs="+", metavar=("PEER", "MODULE"), help="Pull changed files of ref modules (all, or prefixes like grch38) from a mounted peer modules folder")
+    parser.add_argument("--dedup", nargs="*", metavar="MODULE", help="Replace identical files across installed modules (all, or prefixes like grch38) with reflinks or hardlinks")
+    parser.add_argument("--link", choices=["auto", "reflink", "hardlink"], default="auto", help="With --dedup: link type (auto: reflink if the filesystem supports it, else hardlink)")
+    parser.add_argument("--usage", action="store_true", help="Show size, install date and last use of installed modules")
+    parser.add_argument("--evict", action="store_true", help="Delete least recently used modules until they fit in --quota (see backup/pins.txt)")
+    parser.add_argument("--quota", type=str, help="With --evict: size the installed modules may use, e.g. 2T or 500G (with --stage: size of the node-local cache)")
+    parser.add_argument("--gc", action="store_true", help="Remove stale build directories, partial downloads and unused conda packages")
+    parser.add_argument("--dry-run", action="store_true", help="With --sync, --dedup, --evict or --gc: only show what would change")
+    parser.add_argument("--print-ref-env", nargs="+", metavar="MODULE", help="Print the environment variables of installed ref modules as shell exports, without loading them")
+    parser.add_argument("--stage", nargs="+", metavar="MODULE", help="Copy ref modules to the node-local cache $MODULES_LOCAL_CACHE, used by their modulefiles when current")
+    parser.add_argument("--json", action="store_true", help="With --print-ref-env: print JSON instead")
+    parser.add_argument("--write-ref-manifest", type=str, metavar="MODULE", help="Write ref/<MODULE>/.module.json (internal use)")
+    parser.add_argument("--benchmark-startup", nargs="?", type=float, const=100, metavar="MS", help="Time cold starts of the internal queries of build scripts, fail if the median exceeds MS (default: 100)")
+    parser.add_argument("--profile", nargs="?", const="", metavar="DIR", help="Write a time breakdown per stage and a cProfile dump to DIR (default: logs/profile), also for manager.py calls of build scripts (MODULES_PROFILE)")
     parser.add_argument("--print-package-version", type=str, help="INPUT: <package>/<version> or <package>, STDOUT: matched package/version (internal use)")
     parser.add_argument("--print-dependencies", type=str, help="<package>/<version> to print dependencies (internal use)")
     args = parser.parse_args()
 
+    if args.profile is not None or os.environ.get("MODULES_PROFILE"):
+        profile_dir = args.profile or os.environ.get("MODULES_PROFILE")
+        if profile_dir in ("", "1"):
+            profile_dir = os.path.join(Config.logs_root, "profile")
+        # Inherited by build scripts, so their manager.py calls are profiled too
+        os.environ["MODULES_PROFILE"] = os.path.abspath(profile_dir)
+        Profile.start(os.environ["MODULES_PROFILE"])
+
+    if args.scratch:
+        # Read by common.sh in the build scripts (and inherited by dependency installs)
+        os.environ["MODULES_SCRATCH"] = args.scratch
+
+    if args.print_ref_env:
+        # Answered from .module.json, without the package database
+        if not RefInfo.print_env(args.print_ref_env, as_json=args.json):
+            sys.exit(1)
+        return
+    if args.stage:
+        # Run from job scripts and modulefiles, also without the package database
+        if not Stage.run(args.stage, Utils.parse_size(args.quota) if args.quota else None):
+            sys.exit(1)
+        return
+    if args.empty_trash:
+        Trash.empty()
+        return
+    if args.trash_status:
+        Trash.print_status()
+        return
+
     pm = PackageManager(Config.get_tsv_path())
+    Usage.ensure_log_dir()
+
+    if args.benchmark_startup is not None:
+        if not Profile.benchmark_startup(pm, args.benchmark_startup):
+            sys.exit(1)
+        return
 
     if args.update:
         pm.update_local_packages()
@@ -42,28 +113,32 @@ def main():
         pm.sort_packages()
         pm.save_to_tsv()
         Utils.print_stderr("Local packages updated from build-scripts.")
+    elif args.plan:
+        if not Plan.run(pm, args.plan):
+            sys.exit(1)
+    elif args.fetch_only:
+        if not pm.fetch_only(args.fetch_only, use_lock=not args.no_lock):
+            sys.exit(1)
+    elif args.prefetch:
+        if not pm.prefetch(args.prefetch, use_lock=not args.no_lock):
+            sys.exit(1)
     elif args.add:
-        success = pm.add_entry_from_name(args.add)
+        success = pm.add_entry_from_name(args.add, pypi=args.pypi)
         if success:
             pm.save_to_tsv()
     elif args.install:
-        package_name = ""
-        version = ""
         try:
             package_name, version = pm.get_package_version(args.install)
-            success = pm.install_package(package_name, version, yes=args.yes)
+            # Incomplete installations are removed by install_package while it holds the install lock
+            success = pm.install_package(package_name, version, yes=args.yes, resume=args.resume, use_lock=not args.no_lock, offline=args.offline)
             if success:
                 Utils.print_stderr(f"Successfully installed {Colorize.yellow(args.install)}.")
             else:
                 Utils.print_stderr(f"Failed to install {Colorize.red(args.install)}.")
         except KeyboardInterrupt:
             Utils.print_stderr(f"Installation of {Colorize.red(args.install)} interrupted by user.")
-            if package_name and version:
-                pm.delete(package_name, version)
         except Exception as e:
             Utils.print_stderr(f"Error installing {Colorize.red(args.install)}: {e}")
-            if package_name and version:
-                pm.delete(package_name, version)
             Utils.print_stderr(f"For conda packages, make sure the {Colorize.yellow(args.install)} exists on Anaconda.org.")
             Utils.print_stderr(f"For local packages, run {Colorize.yellow('./manager.py -u')} to refresh the database.")
     elif args.delete:
@@ -74,7 +149,14 @@ def main():
                 if ready.lower() != 'y':
                     Utils.print_stderr("Deletion cancelled by user.")
                     sys.exit(0)
-            success = pm.delete(package_name, version)
+            lock = FileLock(Config.get_install_lock_path(package_name, version))
+            if not lock.acquire(blocking=False):
+                Utils.print_stderr(f"❌ {Colorize.yellow(package_name)}/{Colorize.yellow(version)} is being installed by another process ({lock.holder()}). Try again later.")
+                sys.exit(1)
+            try:
+                success = pm.delete(package_name, version)
+            finally:
+                lock.release()
             if success:
                 Utils.print_stderr(f"Successfully deleted {Colorize.yellow(args.delete)}.")
             else:
@@ -93,10 +175,50 @@ def main():
         pm.list_packages()
     elif args.info:
         pm.print_info(args.info)
+    elif args.export:
+        if len(args.export) < 2:
+            parser.error("--export needs a BUNDLE path and at least one MODULE")
+        try:
+            if not Bundle.export(args.export[0], args.export[1:], pm):
+                sys.exit(1)
+        except Exception as e:
+            Utils.print_stderr(f"Error exporting to {Colorize.red(args.export[0])}: {e}")
+            sys.exit(1)
+    elif args.import_bundle:
+        try:
+            if not Bundle.import_bundle(args.import_bundle, pm):
+                sys.exit(1)
+        except Exception as e:
+            Utils.print_stderr(f"Error importing {Colorize.red(args.import_bundle)}: {e}")
+            sys.exit(1)
+    elif args.sync:
+        try:
+            if not Sync.pull(args.sync[0], args.sync[1:], dry_run=args.dry_run):
+                sys.exit(1)
+        except Exception as e:
+            Utils.print_stderr(f"Error syncing from {Colorize.red(args.sync[0])}: {e}")
+            sys.exit(1)
+    elif args.dedup is not None:
+        if not Dedup.run(args.dedup, dry_run=args.dry_run, link=args.link):
+            sys.exit(1)
+    elif args.usage:
+        Usage.print_report()
+    elif args.evict:
+        if not args.quota:
+            parser.error("--evict needs --quota")
+        if not Usage.evict(pm, Utils.parse_size(args.quota), dry_run=args.dry_run, yes=args.yes):
+            sys.exit(1)
+    elif args.gc:
+        if not GC.run(dry_run=args.dry_run):
+            sys.exit(1)
+    elif args.build_stats:
+        pm.print_build_stats()
     elif args.print_package_version:
         pm.print_package_version(args.print_package_version)
     elif args.print_dependencies:
         pm.print_dependencies(args.print_dependencies)
+    elif args.write_ref_manifest:
+        RefInfo.write(pm, args.write_ref_manifest)
     
 class Config:
     # TSV fields: package | tags | whatis | url | conda | versions
@@ -110,20 +232,67 @@ class Config:
     apps_modulefiles_root   = os.path.join(script_dir, "apps_modulefiles")   # Default modulefiles path
     ref_modulefiles_root = os.path.join(script_dir, "ref_modulefiles")  # Default ref modulefiles path
     micromamba_root    = os.path.join(script_dir, "conda")         # Default micromamba root
+    conda_locks_root   = os.path.join(metadata_root, "conda-locks") # Explicit lockfiles of installed conda packages
+    pypi_locks_root    = os.path.join(metadata_root, "pypi-locks")  # Pinned requirements of installed PyPI packages
+    download_threads   = int(os.environ.get("MODULES_DOWNLOAD_THREADS", "8")) # Parallel downloads
+    io_threads         = int(os.environ.get("MODULES_IO_THREADS", "8"))       # Parallel file writes and hashing
+    lock_root          = os.path.join(script_dir, ".locks")        # Advisory lock files (database, installs)
+    tmp_root           = os.path.join(script_dir, "tmp")           # Build scripts temporary directories
+    logs_root          = os.path.join(script_dir, "logs")          # Build statistics and usage logs
+    trash_root         = os.path.join(script_dir, ".trash")        # Deleted modules waiting for background removal
+    cache_root         = os.path.join(script_dir, ".cache")        # Caches that can be deleted at any time
+    local_cache_root   = os.environ.get("MODULES_LOCAL_CACHE") or None       # Node-local copies of ref modules (--stage), off if unset
+    local_cache_size   = os.environ.get("MODULES_LOCAL_CACHE_SIZE") or None  # Size budget of the node-local cache, e.g. 500G
     
     @classmethod
     def get_tsv_path(cls) -> str:
         return os.path.join(cls.metadata_root, "packages.tsv")
 
     @classmethod
-    def get_micromamba_path(cls, version: str = None) -> str:
-        """Download micromamba if missing and return its path."""
-        os.makedirs(cls.executable_root, exist_ok=True)
-        micromamba_path = os.path.join(cls.executable_root, "micromamba")
+    def get_db_lock_path(cls, tsv_path: str) -> str:
+        return tsv_path + ".lock"
 
-        if os.path.exists(micromamba_path):
-            return micromamba_path
+    @classmethod
+    def get_install_lock_path(cls, package: str, version: str) -> str:
+        """Lock file for apps/<package>/<version> or ref/<assembly>/<data-type>/<version>."""
+        return os.path.join(cls.lock_root, package, version + ".lock")
+
+    @classmethod
+    def get_build_stats_path(cls) -> str:
+        """Per-build wall time and I/O counters appended by common.sh."""
+        return os.path.join(cls.logs_root, "build-stats.tsv")
+
+    @classmethod
+    def get_usage_dir(cls) -> str:
+        """Module loads appended by the modulefiles, one file per user."""
+        return os.path.join(cls.logs_root, "usage")
+
+    @classmethod
+    def get_pins_path(cls) -> str:
+        """Modules that --evict never deletes."""
+        return os.path.join(cls.metadata_root, "pins.txt")
+
+    @classmethod
+    def get_dedup_cache_path(cls) -> str:
+        """Full-file hashes of the last --dedup scan, by path, size and mtime."""
+        return os.path.join(cls.cache_root, "dedup-hashes.tsv")
+
+    @classmethod
+    def get_local_ref_dir(cls, module: str) -> Optional[str]:
+        """Node-local copy of ref/<module> made by --stage, or None if MODULES_LOCAL_CACHE is unset."""
+        if not cls.local_cache_root:
+            return None
+        return os.path.join(cls.local_cache_root, "ref", module)
+
+    @classmethod
+    def get_checkpoint_dir(cls, package: str, version: str) -> str:
+        """Completed phase markers of a local build (see phase in common.sh)."""
+        return os.path.join(cls.tmp_root, package, version, ".checkpoints")
 
+    @classmethod
+    def get_conda_platform(cls) -> str:
+        """Return the conda platform of this machine, e.g. linux-64."""
+        import platform
         # Detect platform
         system = platform.system()
         if system == "Linux":
@@ -148,6 +317,18 @@ class Config:
         combo = f"{PLATFORM}-{ARCH}"
         if combo not in supported:
             raise RuntimeError(f"Unsupported platform-arch combination: {combo}")
+        return combo
+
+    @classmethod
+    def get_micromamba_path(cls, version: str = None) -> str:
+        """Download micromamba if missing and return its path."""
+        os.makedirs(cls.executable_root, exist_ok=True)
+        micromamba_path = os.path.join(cls.executable_root, "micromamba")
+
+        if os.path.exists(micromamba_path):
+            return micromamba_path
+
+        combo = cls.get_conda_platform()
 
         # Determine URL
         if version is None:
@@ -156,6 +337,7 @@ class Config:
             release_url = f"https://github.com/mamba-org/micromamba-releases/releases/download/{version}/micromamba-{combo}"
 
         Utils.print_stderr(f"Downloading micromamba from {release_url} ...")
+        import urllib.request
         urllib.request.urlretrieve(release_url, micromamba_path)
 
         # Make executable
@@ -163,69 +345,2438 @@ class Config:
         os.chmod(micromamba_path, st.st_mode | stat.S_IEXEC)
         Utils.print_stderr(f"Micromamba downloaded and made executable at {Colorize.blue(micromamba_path)}")
 
-        # Create a help script
-        mm_path = os.path.join(os.path.abspath(cls.executable_root), "mm")
-        with open(mm_path, "w", encoding="utf-8") as f:
-            f.write(f"#!/bin/bash\n")
-            f.write(f'"{os.path.abspath(micromamba_path)}" --root-prefix "{os.path.abspath(cls.micromamba_root)}" "$@"\n')
-        st = os.stat(mm_path)
-        os.chmod(mm_path, st.st_mode | stat.S_IEXEC)
+        # Create a help script
+        mm_path = os.path.join(os.path.abspath(cls.executable_root), "mm")
+        with open(mm_path, "w", encoding="utf-8") as f:
+            f.write(f"#!/bin/bash\n")
+            f.write(f'"{os.path.abspath(micromamba_path)}" --root-prefix "{os.path.abspath(cls.micromamba_root)}" "$@"\n')
+        st = os.stat(mm_path)
+        os.chmod(mm_path, st.st_mode | stat.S_IEXEC)
+
+        mm_create_path = os.path.join(os.path.abspath(cls.executable_root), "mm-create")
+        with open(mm_create_path, "w", encoding="utf-8") as f:
+            f.write(f"#!/bin/bash\n")
+            f.write(f'"{os.path.abspath(micromamba_path)}" --root-prefix "{os.path.abspath(cls.micromamba_root)}" create -c conda-forge -c bioconda "$@"\n')
+        st = os.stat(mm_create_path)
+        os.chmod(mm_create_path, st.st_mode | stat.S_IEXEC)
+
+        mm_install_path = os.path.join(os.path.abspath(cls.executable_root), "mm-install")
+        with open(mm_install_path, "w", encoding="utf-8") as f:
+            f.write(f"#!/bin/bash\n")
+            f.write(f'"{os.path.abspath(micromamba_path)}" --root-prefix "{os.path.abspath(cls.micromamba_root)}" install -c conda-forge -c bioconda "$@"\n')
+        st = os.stat(mm_install_path)
+        os.chmod(mm_install_path, st.st_mode | stat.S_IEXEC)
+        Utils.print_stderr(f"Micromamba helper script created at {Colorize.blue(cls.executable_root)}/mm")
+
+        return micromamba_path
+
+    @classmethod
+    def get_conda_pkgs_dir(cls) -> str:
+        """Package cache shared by all micromamba environments."""
+        return os.path.join(cls.micromamba_root, "pkgs")
+
+    @classmethod
+    def get_conda_lock_path(cls, package: str, version: str, platform_name: str = None) -> str:
+        """Explicit lockfile (exact package URLs and md5) of apps/<package>/<version>."""
+        if platform_name is None:
+            platform_name = cls.get_conda_platform()
+        return os.path.join(cls.conda_locks_root, package, version, f"{platform_name}.txt")
+
+    @classmethod
+    def get_pypi_lock_path(cls, package: str, version: str) -> str:
+        """Pinned requirements (pip freeze) of the venv apps/<package>/<version>."""
+        return os.path.join(cls.pypi_locks_root, package, version, "requirements.txt")
+
+    @classmethod
+    def get_wheel_cache_dir(cls) -> str:
+        """Wheels downloaded for PyPI installs without uv (uv keeps its own cache in .cache/uv)."""
+        return os.path.join(cls.cache_root, "wheels")
+
+    @classmethod
+    def get_inputs_dir(cls, package: str, version: str) -> str:
+        """#INPUT: files of a build script fetched by --fetch-only (read by fetch_input in common.sh)."""
+        return os.path.join(cls.cache_root, "inputs", package, version)
+
+    @classmethod
+    def get_search_command(cls, package: str) -> List[str]:
+        return [
+            cls.get_micromamba_path(), "--root-prefix", os.path.abspath(cls.micromamba_root),
+            "search",
+            "-c", "conda-forge", "-c", "bioconda",
+            package,
+            "--json"
+        ]
+
+    @classmethod
+    def get_create_command(cls, package: str, version: str) -> List[str]:
+        return [
+            cls.get_micromamba_path(), "--root-prefix", os.path.abspath(cls.micromamba_root), 
+            "create", "--prefix", os.path.join(cls.apps_root, package, version),
+            "-c", "conda-forge", "-c", "bioconda", 
+            f"{package}={version}", "-q", "-y"
+        ]
+
+    @classmethod
+    def get_solve_command(cls, package: str, version: str) -> List[str]:
+        """Solve the environment of get_create_command without creating it (JSON on stdout)."""
+        return [
+            cls.get_micromamba_path(), "--root-prefix", os.path.abspath(cls.micromamba_root),
+            "create", "--prefix", os.path.join(cls.apps_root, package, version),
+            "-c", "conda-forge", "-c", "bioconda",
+            f"{package}={version}", "--dry-run", "--json", "-q", "-y"
+        ]
+
+    @classmethod
+    def get_create_from_lock_command(cls, package: str, version: str, lock_path: str, offline: bool = False) -> List[str]:
+        """Create the environment from an explicit lockfile, without solving (offline: only from the package cache)."""
+        return [
+            cls.get_micromamba_path(), "--root-prefix", os.path.abspath(cls.micromamba_root),
+            "create", "--prefix", os.path.join(cls.apps_root, package, version),
+            "--file", lock_path, "-q", "-y"
+        ] + (["--offline"] if offline else [])
+
+class Utils:
+    @staticmethod
+    def print_stderr(message: str):
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {message}", file=sys.stderr)
+
+    @staticmethod
+    def download(url: str, dest: str, md5: Optional[str] = None, sha256: Optional[str] = None):
+        """
+        Download url to dest through a temporary .partial file, verifying md5 or sha256 if given.
+        """
+        import hashlib
+        partial = f"{dest}.{os.getpid()}.partial"
+        import urllib.request
+        digest = hashlib.sha256() if sha256 else hashlib.md5()
+        try:
+            with urllib.request.urlopen(url) as resp, open(partial, "wb") as f:
+                while True:
+                    chunk = resp.read(1 << 20)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    f.write(chunk)
+            expected = sha256 or md5
+            if expected and digest.hexdigest() != expected:
+                raise ValueError(f"{'sha256' if sha256 else 'md5'} mismatch for {url}: expected {expected}, got {digest.hexdigest()}")
+            os.replace(partial, dest)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+
+    @staticmethod
+    def list_installed_modules(modules_root: str = None) -> List[tuple[str, str, str]]:
+        """
+        Return (kind, package, version) of the installed modules, i.e. those with a modulefile:
+        ("apps", app, version) and ("ref", assembly, "data-type/version").
+        modules_root defaults to this modules folder.
+        """
+        modules = []
+        if modules_root is None:
+            roots = (("apps", Config.apps_modulefiles_root, 2), ("ref", Config.ref_modulefiles_root, 3))
+        else:
+            roots = (("apps", os.path.join(modules_root, "apps_modulefiles"), 2), ("ref", os.path.join(modules_root, "ref_modulefiles"), 3))
+        for kind, root, depth in roots:
+            if not os.path.isdir(root):
+                continue
+            for dirpath, _, filenames in os.walk(root):
+                parts = os.path.relpath(dirpath, root).split(os.sep)
+                if len(parts) != depth - 1:
+                    continue
+                for name in sorted(filenames):
+                    if name.endswith(".lua") or name.startswith("."):
+                        continue
+                    modules.append((kind, parts[0], "/".join(parts[1:] + [name])))
+        return sorted(modules)
+
+    @staticmethod
+    def version_matches(version: str, specifiers: Optional[str]) -> bool:
+        """
+        Check a version against PEP 440 style specifiers like ">=3.8,!=3.9.*,<3.13" (as in
+        requires_python). Only numeric release parts are compared.
+        """
+        def release(text: str) -> tuple:
+            return tuple(int(x) for x in re.findall(r"\d+", text.split("+")[0])[:4])
+        current = release(version)
+        for spec in (specifiers or "").split(","):
+            match = re.match(r"\s*(~=|==|!=|<=|>=|<|>)\s*([\w.*]+)\s*$", spec)
+            if not match:
+                continue
+            op, target = match.groups()
+            if target.endswith(".*"):
+                prefix = release(target[:-2])
+                same = current[:len(prefix)] == prefix
+                if (op == "==" and not same) or (op == "!=" and same):
+                    return False
+                continue
+            wanted = release(target)
+            size = max(len(current), len(wanted))
+            a, b = current + (0,) * (size - len(current)), wanted + (0,) * (size - len(wanted))
+            ok = {"==": a == b, "!=": a != b, "<=": a <= b, ">=": a >= b, "<": a < b, ">": a > b,
+                  "~=": a >= b and current[:len(wanted) - 1] == wanted[:-1]}[op]
+            if not ok:
+                return False
+        return True
+
+    @staticmethod
+    def parse_size(text: str) -> int:
+        """Parse sizes like 500G, 2T, 1.5TB or 1024 (bytes) into bytes."""
+        match = re.fullmatch(r"\s*([\d.]+)\s*([KMGTP]?)i?B?\s*", text, re.IGNORECASE)
+        if not match:
+            raise ValueError(f"Invalid size: {text}")
+        return int(float(match.group(1)) * 1024 ** "BKMGTP".index(match.group(2).upper() or "B"))
+
+    @staticmethod
+    def rmdir_until_not_empty(path: str):
+        """Remove directories up to the first non-empty one."""
+        current_path = path
+        while True:
+            try:
+                os.rmdir(current_path)
+            except OSError:
+                break  # Directory not empty or other error
+            parent_path = os.path.dirname(current_path)
+            if parent_path == current_path:
+                break  # Reached root
+            current_path = parent_path
+    
+
+class Profile:
+    """
+    Wall and CPU time per stage of a manager.py run (--profile or MODULES_PROFILE), plus a
+    cProfile dump. Stages are recorded with `with Profile.stage(name):`; subprocess and urllib
+    calls are recorded by wrapping those functions while profiling. Each run writes
+    <dir>/<time>-<pid>.prof (cProfile, read with `python3 -m pstats`) and .txt (breakdown).
+    MODULES_PROFILE is inherited, so manager.py calls from build scripts are profiled too.
+    """
+    enabled = False
+    lock = None
+    stages: Dict[str, list] = {}  # name: [calls, wall seconds, cpu seconds]
+    profiler = None
+    started = (0.0, 0.0, 0.0)     # wall, process cpu, children cpu
+    prefix = ""
+
+    @staticmethod
+    def children_cpu() -> float:
+        times = os.times()
+        return times.children_user + times.children_system
+
+    @staticmethod
+    @contextlib.contextmanager
+    def stage(name: str):
+        """Record the time of the block as stage name (CPU: this thread and child processes)."""
+        if not Profile.enabled:
+            yield
+            return
+        wall, cpu, children = time.perf_counter(), time.thread_time(), Profile.children_cpu()
+        try:
+            yield
+        finally:
+            elapsed = [time.perf_counter() - wall, time.thread_time() - cpu + Profile.children_cpu() - children]
+            with Profile.lock:
+                entry = Profile.stages.setdefault(name, [0, 0.0, 0.0])
+                entry[0] += 1
+                entry[1] += elapsed[0]
+                entry[2] += elapsed[1]
+
+    @staticmethod
+    def command_label(command) -> str:
+        """Short name of a subprocess command: the build script, or the program and its subcommand."""
+        argv = [command] if isinstance(command, str) else [str(a) for a in command]
+        name = os.path.basename(argv[0].split()[0])
+        if name in ("bash", "sh") and len(argv) > 1:
+            return os.path.relpath(argv[1], Config.build_scripts_root) if argv[1].startswith(Config.build_scripts_root) else argv[1]
+        sub = next((a for a in argv[1:] if re.fullmatch(r"[a-z][\w-]*", a)), "")
+        return f"{name} {sub}".strip()
+
+    @staticmethod
+    def wrap(func, label):
+        def wrapper(*args, **kwargs):
+            with Profile.stage(label(args[0] if args else kwargs.get("args", kwargs.get("url", "")))):
+                return func(*args, **kwargs)
+        return wrapper
+
+    @staticmethod
+    def start(profile_dir: str):
+        import subprocess
+        import atexit
+        import cProfile
+        import threading
+        import urllib.request
+        Profile.enabled = True
+        Profile.lock = threading.Lock()
+        os.makedirs(profile_dir, exist_ok=True)
+        Profile.prefix = os.path.join(profile_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+        for name in ("run", "call", "check_output"):
+            setattr(subprocess, name, Profile.wrap(getattr(subprocess, name), lambda cmd: f"subprocess: {Profile.command_label(cmd)}"))
+        def host(url) -> str:
+            url = getattr(url, "full_url", url)
+            return "http: " + (url.split("/")[2] if "://" in url else url)
+        urllib.request.urlopen = Profile.wrap(urllib.request.urlopen, host)
+        urllib.request.urlretrieve = Profile.wrap(urllib.request.urlretrieve, host)
+        Profile.started = (time.perf_counter(), time.process_time(), Profile.children_cpu())
+        Profile.profiler = cProfile.Profile()
+        Profile.profiler.enable()
+        atexit.register(Profile.finish)
+
+    @staticmethod
+    def benchmark_startup(pm: 'PackageManager', budget_ms: float, runs: int = 10) -> bool:
+        """
+        Time cold starts of the internal queries build scripts run (as common.sh runs them: manager.py
+        imported, so its bytecode is cached) and of manager.py run directly. Return False if the median
+        of a query run by common.sh exceeds budget_ms.
+        """
+        import subprocess
+        import statistics
+        query = [sys.executable, "-c", "import sys; sys.path.insert(0, sys.argv.pop(1)); import manager; manager.main()", Config.script_dir]
+        package = next((name for name, pkg in pm.packages.items() if pkg.versions), None)
+        local = next((f"{name}/{pkg.versions[0]}" for name, pkg in pm.packages.items()
+                      if pkg.is_local() and pkg.versions and pm.get_local_dependencies(name, pkg.versions[0])), None)
+        commands = [("python3 -c pass (interpreter)", [sys.executable, "-c", "pass"], False),
+                    ("manager.py --print-package-version", [os.path.join(Config.script_dir, "manager.py"), "--print-package-version", package], False),
+                    ("common.sh --print-package-version", query + ["--print-package-version", package], True)]
+        if local:
+            commands.append(("common.sh --print-dependencies", query + ["--print-dependencies", local], True))
+        env = {k: v for k, v in os.environ.items() if k != "MODULES_PROFILE"}
+
+        ok = True
+        print(f"{'command':<40} {'min ms':>8} {'median ms':>10}")
+        for label, command, budgeted in commands:
+            subprocess.run(command, capture_output=True, env=env)  # warm up the page cache and __pycache__
+            times = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                result = subprocess.run(command, capture_output=True, env=env)
+                times.append((time.perf_counter() - start) * 1000)
+                if result.returncode != 0:
+                    Utils.print_stderr(f"❌ {label} failed: {result.stderr.decode().strip()}")
+                    return False
+            median = statistics.median(times)
+            over = budgeted and median > budget_ms
+            ok = ok and not over
+            print(f"{label:<40} {min(times):>8.1f} {median:>10.1f}" + (f"  {Colorize.red(f'over the budget of {budget_ms:g} ms')}" if over else ""))
+        if sys.dont_write_bytecode:
+            Utils.print_stderr("⚠️ PYTHONDONTWRITEBYTECODE is set, so manager.py is compiled on every start unless __pycache__ was written before.")
+        return ok
+
+    @staticmethod
+    def finish():
+        import socket
+        Profile.profiler.disable()
+        import io
+        import pstats
+        wall = time.perf_counter() - Profile.started[0]
+        cpu = time.process_time() - Profile.started[1]
+        children = Profile.children_cpu() - Profile.started[2]
+        Profile.profiler.dump_stats(Profile.prefix + ".prof")
+
+        lines = [f"manager.py {' '.join(sys.argv[1:])}",
+                 f"pid {os.getpid()} on {socket.gethostname()}, {time.strftime('%Y-%m-%d %H:%M:%S')}",
+                 f"total: {wall:.2f} s wall, {cpu:.2f} s CPU, {children:.2f} s CPU in child processes",
+                 "",
+                 f"{'stage':<50} {'calls':>6} {'wall s':>9} {'cpu s':>9} {'wall %':>7}"]
+        for name, (calls, stage_wall, stage_cpu) in sorted(Profile.stages.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{name[:50]:<50} {calls:>6} {stage_wall:>9.2f} {stage_cpu:>9.2f} {100 * stage_wall / wall if wall else 0:>6.1f}%")
+        lines.append("(stages may be nested or run in parallel threads, so they can add up to more than the total)")
+        stream = io.StringIO()
+        pstats.Stats(Profile.profiler, stream=stream).sort_stats("cumulative").print_stats(30)
+        with open(Profile.prefix + ".txt", "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n\n" + stream.getvalue())
+        print("\n".join(lines[2:-1]), file=sys.stderr)
+        Utils.print_stderr(f"Profile written to {Profile.prefix}.txt and {Profile.prefix}.prof")
+
+class FileLock:
+    """
+    Advisory lock (flock) on a lock file, shared between manager.py and common.sh.
+    The holder writes pid/host/time into the file so waiting processes can report who holds it.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.fd: Optional[int] = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """Acquire the lock. Return False if non-blocking and held by someone else."""
+        import socket
+        if self.fd is not None:
+            return True
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        except BaseException:
+            os.close(fd)
+            raise
+        self.fd = fd
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, f"pid={os.getpid()} host={socket.gethostname()} since={time.strftime('%Y-%m-%d %H:%M:%S')}\n".encode(), 0)
+        return True
+
+    def release(self):
+        if self.fd is None:
+            return
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self.fd = None
+
+    def holder(self) -> str:
+        """Return the holder info written by the current owner (best effort)."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return f.read().strip() or "unknown"
+        except OSError:
+            return "unknown"
+
+    def is_held(self) -> bool:
+        """Return True if another process currently holds the lock."""
+        if not os.path.exists(self.path):
+            return False
+        probe = FileLock(self.path)
+        if probe.acquire(blocking=False):
+            probe.release()
+            return False
+        return True
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+class Trash:
+    """
+    Deleted directories are renamed into Config.trash_root (same filesystem, so the rename is
+    atomic and the module disappears at once), then removed by a detached background worker.
+    Entries stay in the trash until they are fully removed, so an interrupted worker is
+    simply resumed by the next one.
+    """
+    @staticmethod
+    def move(path: str, label: str) -> bool:
+        """
+        Move path into the trash and start the background worker.
+        Return False if the path cannot be renamed into the trash (e.g. another filesystem).
+        """
+        os.makedirs(Config.trash_root, exist_ok=True)
+        entry = os.path.join(Config.trash_root, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{os.urandom(3).hex()}-{label.replace('/', '_')}")
+        try:
+            os.rename(path, entry)
+        except OSError as e:
+            Utils.print_stderr(f"Cannot move {path} to trash ({e}).")
+            return False
+        Trash.write_record(entry, {"label": label, "origin": path, "trashed_at": time.strftime('%Y-%m-%d %H:%M:%S')})
+        Trash.start_worker()
+        return True
+
+    @staticmethod
+    def remove(path: str, label: str):
+        """
+        Remove a directory: move it to the trash, or delete it synchronously if that fails.
+        """
+        import shutil
+        if not os.path.exists(path):
+            return
+        if not Trash.move(path, label):
+            Utils.print_stderr(f"Removing {path} synchronously...")
+            shutil.rmtree(path)
+
+    @staticmethod
+    def write_record(entry: str, record: dict):
+        import json
+        tmp_path = entry + ".json.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f)
+        os.replace(tmp_path, entry + ".json")
+
+    @staticmethod
+    def read_record(entry: str) -> dict:
+        import json
+        try:
+            with open(entry + ".json", "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"label": os.path.basename(entry)}
+
+    @staticmethod
+    def list_entries() -> List[str]:
+        if not os.path.isdir(Config.trash_root):
+            return []
+        return sorted(e.path for e in os.scandir(Config.trash_root) if e.is_dir(follow_symlinks=False))
+
+    @staticmethod
+    def start_worker():
+        """Start a detached `manager.py --empty-trash` that outlives this process."""
+        import subprocess
+        os.makedirs(Config.logs_root, exist_ok=True)
+        with open(os.path.join(Config.logs_root, "trash.log"), "a", encoding="utf-8") as log:
+            subprocess.Popen([sys.executable, os.path.abspath(__file__), "--empty-trash"],
+                             stdin=subprocess.DEVNULL, stdout=log, stderr=log, start_new_session=True)
+
+    @staticmethod
+    def empty():
+        """
+        Remove all trash entries. Only one worker runs at a time; others exit at once
+        because the running worker picks up new entries before it stops. An entry that
+        cannot be removed keeps its error in its record and is retried by the next worker.
+        """
+        lock = FileLock(os.path.join(Config.trash_root, ".worker.lock"))
+        failed = set()
+        while [entry for entry in Trash.list_entries() if entry not in failed]:
+            if not lock.acquire(blocking=False):
+                Utils.print_stderr(f"Another trash worker is running ({lock.holder()}).")
+                return
+            try:
+                for entry in Trash.list_entries():
+                    if entry in failed:
+                        continue
+                    try:
+                        Trash.remove_entry(entry)
+                    except OSError as e:
+                        failed.add(entry)
+                        record = Trash.read_record(entry)
+                        record.update(error=str(e), failed_at=time.strftime('%Y-%m-%d %H:%M:%S'))
+                        with contextlib.suppress(OSError):
+                            Trash.write_record(entry, record)
+                        Utils.print_stderr(f"❌ Cannot remove {Colorize.yellow(record.get('label', os.path.basename(entry)))} from trash: {e}")
+            finally:
+                lock.release()
+
+    @staticmethod
+    def make_writable(entry: str):
+        """chmod u+rwx the directories under entry (read-only conda, Go or cargo trees), like rmtree's onerror idiom."""
+        os.chmod(entry, stat.S_IMODE(os.lstat(entry).st_mode) | stat.S_IRWXU)
+        for root, dirs, _ in os.walk(entry):  # top-down: children are fixed before they are listed
+            for name in dirs:
+                path = os.path.join(root, name)
+                if not os.path.islink(path):
+                    os.chmod(path, stat.S_IMODE(os.lstat(path).st_mode) | stat.S_IRWXU)
+
+    @staticmethod
+    def remove_entry(entry: str, report_interval: float = 5.0):
+        """
+        Delete one trash entry bottom-up, recording progress in its record. If that fails (e.g. read-only
+        directories), the directories are made writable and it is tried once more; then errors are raised.
+        """
+        record = Trash.read_record(entry)
+        record.pop("error", None)
+        label = record.get("label", os.path.basename(entry))
+        Utils.print_stderr(f"🗑️  Removing {Colorize.yellow(label)} from trash...")
+        removed_files = record.get("removed_files", 0)  # continue the count of an interrupted worker
+        last_report = time.time()
+        def sweep():
+            nonlocal removed_files, last_report
+            for root, dirs, files in os.walk(entry, topdown=False):
+                for name in files:
+                    try:
+                        os.unlink(os.path.join(root, name))
+                    except FileNotFoundError:
+                        pass
+                    removed_files += 1
+                for name in dirs:
+                    path = os.path.join(root, name)
+                    try:
+                        if os.path.islink(path):
+                            os.unlink(path)
+                        else:
+                            os.rmdir(path)
+                    except FileNotFoundError:
+                        pass
+                if time.time() - last_report > report_interval:
+                    last_report = time.time()
+                    record.update(removed_files=removed_files, updated_at=time.strftime('%Y-%m-%d %H:%M:%S'))
+                    Trash.write_record(entry, record)
+                    Utils.print_stderr(f"  {Colorize.yellow(label)}: {removed_files} files removed")
+            os.rmdir(entry)
+        try:
+            sweep()
+        except OSError:
+            Trash.make_writable(entry)
+            sweep()
+        if os.path.exists(entry + ".json"):
+            os.remove(entry + ".json")
+        Utils.print_stderr(f"✅ Removed {Colorize.yellow(label)} ({removed_files} files).")
+
+    @staticmethod
+    def print_status():
+        entries = Trash.list_entries()
+        if not entries:
+            Utils.print_stderr("Trash is empty.")
+            return
+        lock = FileLock(os.path.join(Config.trash_root, ".worker.lock"))
+        worker = f"running ({lock.holder()})" if lock.is_held() else "not running"
+        print(f"Trash worker: {worker}")
+        for entry in entries:
+            record = Trash.read_record(entry)
+            progress = f"{record['removed_files']} files removed" if "removed_files" in record else "pending"
+            if "error" in record:
+                progress += f", failed at {record.get('failed_at', '?')}: {record['error']}"
+            print(f"{Colorize.yellow(record.get('label', os.path.basename(entry)))}: trashed {record.get('trashed_at', '?')}, {progress}")
+        if worker == "not running":
+            print(f"Run {Colorize.yellow('./manager.py --empty-trash')} to remove them.")
+
+class Bundle:
+    """
+    Portable archive of installed modules (apps/, ref/ and their modulefiles) to move them
+    between clusters. The tar stream is compressed with zstd (pigz/gzip if zstd is missing):
+      .bundle/header.json    modules, source modules root, database rows (first member)
+      <module files>         apps/..., ref/..., backup/conda-locks/...
+      <modulefiles>          written last on import, so a module only appears when complete
+      .bundle/manifest.json  size and sha256 of every file, computed while streaming (last member)
+    """
+    HEADER = ".bundle/header.json"
+    MANIFEST = ".bundle/manifest.json"
+    FORMAT = 1
+    SMALL_FILE = 8 << 20  # files up to this size are written by the worker threads from memory
+
+    @staticmethod
+    def module_paths(kind: str, package: str, version: str) -> List[str]:
+        """Paths of a module relative to the modules root."""
+        paths = [f"{kind}/{package}/{version}",
+                 f"{kind}_modulefiles/{package}/{version}",
+                 f"{kind}_modulefiles/{package}/{version}.lua"]
+        if kind == "apps":
+            paths.append(os.path.relpath(os.path.join(Config.conda_locks_root, package, version), Config.script_dir))
+        return paths
+
+    @staticmethod
+    def resolve_modules(patterns: List[str], modules_root: str = None) -> List[tuple[str, str, str]]:
+        """
+        Expand <app>/<version>, <assembly>/<data-type>/<version> or any prefix of them
+        (e.g. grch38, or "" for all) to the installed modules.
+        """
+        installed = Utils.list_installed_modules(modules_root)
+        selected = []
+        for pattern in patterns:
+            pattern = pattern.strip("/")
+            matches = [m for m in installed if not pattern or f"{m[1]}/{m[2]}" == pattern or f"{m[1]}/{m[2]}".startswith(pattern + "/")]
+            if not matches:
+                raise ValueError(f"No installed module matches {pattern}")
+            selected += [m for m in matches if m not in selected]
+        return selected
+
+    @staticmethod
+    def open_compressor(bundle_path: str):
+        """Return (process, output file) of the compressor writing bundle_path ('-' for stdout)."""
+        import subprocess
+        import shutil
+        if shutil.which("zstd"):
+            cmd = ["zstd", "-T0", "-3", "-q", "-c"]
+        elif shutil.which("pigz"):
+            Utils.print_stderr("⚠️ zstd not found, compressing with pigz.")
+            cmd = ["pigz", "-c"]
+        else:
+            Utils.print_stderr("⚠️ zstd not found, compressing with gzip (single-threaded).")
+            cmd = ["gzip", "-c"]
+        out = sys.stdout.buffer if bundle_path == "-" else open(bundle_path, "wb")
+        return subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=out), out
+
+    @staticmethod
+    def open_decompressor(bundle_path: str):
+        """Return the process decompressing bundle_path ('-' for stdin), format detected from its magic bytes."""
+        import subprocess
+        import shutil
+        import threading
+        src = sys.stdin.buffer if bundle_path == "-" else open(bundle_path, "rb")
+        head = src.read(4)
+        if head.startswith(b"\x28\xb5\x2f\xfd"):
+            cmd = ["zstd", "-d", "-q", "-c"]
+        elif head.startswith(b"\x1f\x8b"):
+            cmd = ["pigz", "-d", "-c"] if shutil.which("pigz") else ["gzip", "-d", "-c"]
+        else:
+            raise ValueError(f"{bundle_path} is not a zstd or gzip compressed bundle")
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+        def pump():
+            try:
+                proc.stdin.write(head)
+                shutil.copyfileobj(src, proc.stdin, 1 << 20)
+            except BrokenPipeError:
+                pass  # the reader stopped early (error), reported there
+            finally:
+                proc.stdin.close()
+                if src is not sys.stdin.buffer:
+                    src.close()
+        threading.Thread(target=pump, daemon=True).start()
+        return proc
+
+    class HashingReader:
+        """File wrapper computing sha256 of the bytes tarfile reads from it."""
+        def __init__(self, f):
+            import hashlib
+            self.f = f
+            self.sha256 = hashlib.sha256()
+
+        def read(self, size: int = -1) -> bytes:
+            data = self.f.read(size)
+            self.sha256.update(data)
+            return data
+
+    @staticmethod
+    def add_bytes(tar, name: str, data: bytes):
+        import io
+        import tarfile
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        tar.addfile(info, io.BytesIO(data))
+
+    @staticmethod
+    def export(bundle_path: str, patterns: List[str], pm: 'PackageManager') -> bool:
+        """
+        Pack the modules matching patterns into bundle_path ('-' streams to stdout).
+        """
+        import json
+        import socket
+        import tarfile
+        modules = Bundle.resolve_modules(patterns)
+        locks = []
+        for kind, package, version in modules:
+            lock = FileLock(Config.get_install_lock_path(package, version))
+            if not lock.acquire(blocking=False):
+                Utils.print_stderr(f"❌ {Colorize.yellow(package)}/{Colorize.yellow(version)} is being installed by another process ({lock.holder()}). Try again later.")
+                for held in locks:
+                    held.release()
+                return False
+            locks.append(lock)
+
+        header = {
+            "format": Bundle.FORMAT,
+            "created_at": time.strftime('%Y-%m-%d %H:%M:%S'),
+            "host": socket.gethostname(),
+            "modules_root": Config.script_dir,
+            "platform": Config.get_conda_platform(),
+            "modules": [{"kind": kind, "package": package, "version": version} for kind, package, version in modules],
+            "packages": {},
+        }
+        for kind, package, _ in modules:
+            pkg = pm.get_package(package)
+            if kind == "apps" and pkg is not None and not pkg.is_local():
+                header["packages"][package] = {"tags": pkg.tags, "whatis": pkg.whatis, "url": pkg.url, "source": pkg.source}
+
+        Utils.print_stderr(f"Exporting {len(modules)} modules to {Colorize.yellow(bundle_path)}...")
+        proc, out = Bundle.open_compressor(bundle_path)
+        files: Dict[str, dict] = {}
+        total_bytes = 0
+        last_report = time.time()
+        try:
+            with tarfile.open(fileobj=proc.stdin, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+                Bundle.add_bytes(tar, Bundle.HEADER, json.dumps(header, indent=2).encode())
+                for kind, package, version in modules:
+                    Utils.print_stderr(f"  {Colorize.yellow(package)}/{Colorize.yellow(version)}")
+                    for rel in Bundle.module_paths(kind, package, version):
+                        top = os.path.join(Config.script_dir, rel)
+                        if not os.path.lexists(top):
+                            continue
+                        walk = os.walk(top) if os.path.isdir(top) and not os.path.islink(top) else [(os.path.dirname(top), [], [os.path.basename(top)])]
+                        if os.path.isdir(top) and not os.path.islink(top):
+                            tar.addfile(tar.gettarinfo(top, arcname=rel))
+                        for root, dirs, names in walk:
+                            for name in sorted(dirs) + sorted(names):
+                                path = os.path.join(root, name)
+                                info = tar.gettarinfo(path, arcname=os.path.relpath(path, Config.script_dir))
+                                if not info.isreg():
+                                    tar.addfile(info)  # directories, symlinks, hardlinks to earlier files
+                                    if info.islnk() and info.linkname in files:
+                                        files[info.name] = dict(files[info.linkname])  # verified like the file
+                                    continue
+                                with open(path, "rb") as f:
+                                    reader = Bundle.HashingReader(f)
+                                    tar.addfile(info, reader)
+                                files[info.name] = {"size": info.size, "sha256": reader.sha256.hexdigest()}
+                                total_bytes += info.size
+                                if time.time() - last_report > 30:
+                                    last_report = time.time()
+                                    Utils.print_stderr(f"  {total_bytes / 1024**3:.1f} GB packed")
+                Bundle.add_bytes(tar, Bundle.MANIFEST, json.dumps({"files": files}).encode())
+            proc.stdin.close()
+            if proc.wait() != 0:
+                raise RuntimeError(f"compressor exited with code {proc.returncode}")
+        except BaseException:
+            proc.kill()
+            if bundle_path != "-" and os.path.exists(bundle_path):
+                os.remove(bundle_path)
+            raise
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+            for lock in locks:
+                lock.release()
+        Utils.print_stderr(f"✅ Exported {len(modules)} modules, {len(files)} files, {total_bytes / 1024**3:.2f} GB (uncompressed).")
+        return True
+
+    @staticmethod
+    def write_file(dest: str, data: bytes, mode: int, mtime: float) -> str:
+        """Write one extracted file (worker thread) and return its sha256."""
+        import hashlib
+        with open(dest, "wb") as f:
+            f.write(data)
+        os.chmod(dest, mode)
+        os.utime(dest, (mtime, mtime))
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def sha256_file(path: str) -> str:
+        import hashlib
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(1 << 20)
+                if not chunk:
+                    break
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    @staticmethod
+    def relocate_prefix(prefix: str, old_prefix: str, new_prefix: str) -> int:
+        """
+        Rewrite the install path embedded in a conda prefix, for the files conda-meta lists
+        with a prefix placeholder. Binary files are null-padded like conda does, which only
+        works if the new path is not longer than the old one. Return the number of files changed.
+        """
+        import json
+        meta_dir = os.path.join(prefix, "conda-meta")
+        if old_prefix == new_prefix or not os.path.isdir(meta_dir):
+            return 0
+        old, new = old_prefix.encode(), new_prefix.encode()
+        padded = re.compile(re.escape(old) + rb"([^\0]*?)\0")
+        changed = 0
+        for meta_name in os.listdir(meta_dir):
+            if not meta_name.endswith(".json"):
+                continue
+            with open(os.path.join(meta_dir, meta_name), "r", encoding="utf-8") as f:
+                record = json.load(f)
+            for entry in record.get("paths_data", {}).get("paths", []):
+                if not entry.get("prefix_placeholder"):
+                    continue
+                path = os.path.join(prefix, entry["_path"])
+                if os.path.islink(path) or not os.path.isfile(path):
+                    continue
+                with open(path, "rb") as f:
+                    data = f.read()
+                if old not in data:
+                    continue
+                if entry.get("file_mode") == "binary":
+                    if len(new) > len(old):
+                        Utils.print_stderr(f"⚠️ Cannot relocate binary {path}: new path is longer than {old_prefix}")
+                        continue
+                    data = padded.sub(lambda m: (new + m.group(1)).ljust(len(m.group(0)) - 1, b"\0") + b"\0", data)
+                else:
+                    data = data.replace(old, new)
+                st = os.stat(path)
+                with open(path, "wb") as f:
+                    f.write(data)
+                os.utime(path, (st.st_atime, st.st_mtime))
+                changed += 1
+        return changed
+
+    @staticmethod
+    def import_bundle(bundle_path: str, pm: 'PackageManager') -> bool:
+        """
+        Unpack a bundle ('-' reads stdin) into this modules root. Files are written by a
+        thread pool while the stream is decompressed, verified against the manifest, and
+        conda prefixes are relocated. Modules already installed here are skipped.
+        """
+        import json
+        import shutil
+        import hashlib
+        import tarfile
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+        proc = Bundle.open_decompressor(bundle_path)
+        locks: Dict[tuple, FileLock] = {}
+        failed = set()
+        try:
+            tar = tarfile.open(fileobj=proc.stdout, mode="r|")
+            first = tar.next()
+            if first is None or first.name != Bundle.HEADER:
+                raise ValueError(f"{bundle_path} has no {Bundle.HEADER}, not a module bundle")
+            header = json.load(tar.extractfile(first))
+            if header.get("format") != Bundle.FORMAT:
+                raise ValueError(f"Unsupported bundle format {header.get('format')}")
+            old_root = header["modules_root"]
+            if header.get("platform") != Config.get_conda_platform():
+                Utils.print_stderr(f"⚠️ Bundle was created on {header.get('platform')}, this is {Config.get_conda_platform()}.")
+
+            # Owner module of each archive path, for modules that are imported
+            owners: Dict[str, tuple] = {}
+            for m in header["modules"]:
+                key = (m["kind"], m["package"], m["version"])
+                label = f"{m['package']}/{m['version']}"
+                modulefile = os.path.join(Config.script_dir, f"{m['kind']}_modulefiles", m["package"], m["version"])
+                lock = FileLock(Config.get_install_lock_path(m["package"], m["version"]))
+                if not lock.acquire(blocking=False):
+                    Utils.print_stderr(f"⚠️ Skipping {Colorize.yellow(label)}: being installed by another process ({lock.holder()}).")
+                    continue
+                if os.path.exists(modulefile):
+                    Utils.print_stderr(f"Skipping {Colorize.yellow(label)}: already installed.")
+                    lock.release()
+                    continue
+                if os.path.exists(os.path.join(Config.script_dir, m["kind"], m["package"], m["version"])):
+                    pm.cleanup_failed_install(m["package"], m["version"])
+                locks[key] = lock
+                for rel in Bundle.module_paths(*key):
+                    owners[rel] = key
+            Utils.print_stderr(f"Importing {len(locks)} of {len(header['modules'])} modules from {Colorize.yellow(bundle_path)} (created on {header.get('host')} at {header.get('created_at')})...")
+
+            def owner_of(name: str) -> Optional[tuple]:
+                path = name
+                while path:
+                    if path in owners:
+                        return owners[path]
+                    path = os.path.dirname(path)
+                return None
+
+            hashes: Dict[str, object] = {}  # name -> sha256 or future
+            extracted = set()  # module files written in this run
+            deferred_links = []  # (member, dest) created after all files exist
+            deferred_files = []  # (member, data) modulefiles and lockfiles, written when verified
+            dir_times = []
+            manifest = None
+            with ThreadPoolExecutor(max_workers=Config.io_threads) as pool:
+                pending = set()
+                for member in tar:
+                    if member.name == Bundle.MANIFEST:
+                        manifest = json.load(tar.extractfile(member))
+                        continue
+                    if os.path.isabs(member.name) or ".." in member.name.split("/"):
+                        raise ValueError(f"Unsafe path in bundle: {member.name}")
+                    key = owner_of(member.name)
+                    if key is None:
+                        continue  # skipped module
+                    dest = os.path.join(Config.script_dir, member.name)
+                    if member.name.startswith(f"{key[0]}_modulefiles/") or not member.name.startswith(f"{key[0]}/"):
+                        if member.isreg():
+                            deferred_files.append((member, tar.extractfile(member).read()))
+                            hashes[member.name] = hashlib.sha256(deferred_files[-1][1]).hexdigest()
+                        continue
+                    if member.isdir():
+                        os.makedirs(dest, exist_ok=True)
+                        dir_times.append((dest, member))
+                    elif member.issym() or member.islnk():
+                        deferred_links.append((member, dest))
+                    elif member.isreg():
+                        os.makedirs(os.path.dirname(dest), exist_ok=True)
+                        extracted.add(member.name)
+                        f = tar.extractfile(member)
+                        if member.size <= Bundle.SMALL_FILE:
+                            future = pool.submit(Bundle.write_file, dest, f.read(), member.mode, member.mtime)
+                            hashes[member.name] = future
+                            pending.add(future)
+                            if len(pending) >= Config.io_threads * 4:
+                                _, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        else:
+                            sha256 = hashlib.sha256()
+                            with open(dest, "wb") as out:
+                                while True:
+                                    chunk = f.read(1 << 20)
+                                    if not chunk:
+                                        break
+                                    sha256.update(chunk)
+                                    out.write(chunk)
+                            os.chmod(dest, member.mode)
+                            os.utime(dest, (member.mtime, member.mtime))
+                            hashes[member.name] = sha256.hexdigest()
+                wait(pending)
+            if proc.wait() != 0:
+                raise RuntimeError(f"decompressor exited with code {proc.returncode}")
+            if manifest is None:
+                raise ValueError(f"{bundle_path} is truncated: {Bundle.MANIFEST} not found")
+
+            # Hardlinks: linked to a file of the same module extracted in this run, otherwise the data
+            # is copied (the target is in another module, or one skipped because it is installed here)
+            for member, dest in deferred_links:
+                key = owner_of(member.name)
+                if not member.islnk() or key in failed:
+                    continue
+                target = member.linkname
+                source = os.path.join(Config.script_dir, target)
+                in_bundle = any(target.startswith(f"{m['kind']}/{m['package']}/{m['version']}/") for m in header["modules"])
+                if os.path.isabs(target) or ".." in target.split("/") or not in_bundle:
+                    Utils.print_stderr(f"❌ {member.name}: unsafe hardlink target {target}")
+                    failed.add(key)
+                    continue
+                if os.path.lexists(dest):
+                    os.remove(dest)
+                try:
+                    if target in extracted and owner_of(target) == key:
+                        try:
+                            os.link(source, dest)
+                        except OSError:
+                            shutil.copy2(source, dest)
+                    else:
+                        shutil.copy2(source, dest)
+                    hashes[member.name] = Bundle.sha256_file(dest)
+                    if member.name not in manifest["files"] and target in manifest["files"]:
+                        manifest["files"][member.name] = manifest["files"][target]  # bundles listing only the target
+                except OSError as e:
+                    Utils.print_stderr(f"❌ {member.name}: cannot link or copy {target}: {e}")
+                    failed.add(key)
+
+            # Verify every file of the imported modules against the manifest
+            for name, expected in manifest["files"].items():
+                key = owner_of(name)
+                if key is None:
+                    continue
+                actual = hashes.get(name)
+                if hasattr(actual, "result"):
+                    actual = actual.result()
+                if actual != expected["sha256"]:
+                    Utils.print_stderr(f"❌ {name}: {'missing' if actual is None else 'checksum mismatch'}")
+                    failed.add(key)
+
+            for member, dest in deferred_links:
+                key = owner_of(member.name)
+                if key in failed or member.islnk():
+                    continue
+                if os.path.lexists(dest):
+                    os.remove(dest)
+                target = member.linkname
+                if target.startswith(old_root + "/"):
+                    target = Config.script_dir + target[len(old_root):]
+                os.symlink(target, dest)
+            for dest, member in reversed(dir_times):  # children first
+                os.chmod(dest, member.mode)
+                os.utime(dest, (member.mtime, member.mtime))
+
+            imported = 0
+            for key in locks:
+                kind, package, version = key
+                label = f"{package}/{version}"
+                if key in failed:
+                    Utils.print_stderr(f"❌ Failed to import {Colorize.red(label)}, removing it.")
+                    Trash.remove(os.path.join(Config.script_dir, kind, package, version), label)
+                    continue
+                if kind == "apps":
+                    n = Bundle.relocate_prefix(os.path.join(Config.apps_root, package, version),
+                                               os.path.join(old_root, "apps", package, version),
+                                               os.path.join(Config.apps_root, package, version))
+                    if n:
+                        Utils.print_stderr(f"  {Colorize.yellow(label)}: relocated {n} files")
+                    if package in header["packages"] and pm.get_package(package) is None:
+                        row = header["packages"][package]
+                        pkg = Package(package, row["tags"], row["whatis"], row["url"], row["source"])
+                        pm.update_package(pkg)
+                # Modulefiles last: the module is visible only when complete
+                for member, data in deferred_files:
+                    if owner_of(member.name) == key:
+                        dest = os.path.join(Config.script_dir, member.name)
+                        os.makedirs(os.path.dirname(dest), exist_ok=True)
+                        with open(dest, "wb") as f:
+                            f.write(data)
+                        os.chmod(dest, member.mode)
+                imported += 1
+            if pm.changed_packages:
+                pm.save_to_tsv()
+        except BaseException:
+            proc.kill()
+            for kind, package, version in locks:
+                if not os.path.exists(os.path.join(Config.script_dir, f"{kind}_modulefiles", package, version)):
+                    Trash.remove(os.path.join(Config.script_dir, kind, package, version), f"{package}/{version}")
+            raise
+        finally:
+            for lock in locks.values():
+                lock.release()
+        Utils.print_stderr(f"✅ Imported {imported} modules" + (f", {len(failed)} failed." if failed else "."))
+        return not failed
+
+class Manifest:
+    """
+    Per-module file manifest, cached in <module>/.manifest.json:
+      {"hash": "blake2b-128", "files": {relpath: {"size", "mtime_ns", "hash"} or {"link": target}}}
+    Hashes of files whose size and mtime did not change are reused from the cache.
+    """
+    NAME = ".manifest.json"
+    HASH = "blake2b-128"
+
+    @staticmethod
+    def hash_file(path: str) -> str:
+        import hashlib
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(4 << 20)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def read(module_dir: str) -> Dict[str, dict]:
+        import json
+        path = os.path.join(module_dir, Manifest.NAME)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return data.get("files", {}) if data.get("hash") == Manifest.HASH else {}
+
+    @staticmethod
+    def write(module_dir: str, files: Dict[str, dict]):
+        import json
+        path = os.path.join(module_dir, Manifest.NAME)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"hash": Manifest.HASH, "generated_at": time.strftime('%Y-%m-%d %H:%M:%S'), "files": files}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def build(module_dir: str, save: bool = True) -> Dict[str, dict]:
+        """
+        Return the manifest of module_dir, hashing new or changed files with Config.io_threads
+        threads. The result is saved back to the cache if save is True and the directory is writable.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        cached = Manifest.read(module_dir)
+        files: Dict[str, dict] = {}
+        to_hash = []
+        for root, dirs, names in os.walk(module_dir):
+            for name in dirs + names:
+                path = os.path.join(root, name)
+                rel = os.path.relpath(path, module_dir)
+                if rel.startswith(Manifest.NAME):
+                    continue
+                if os.path.islink(path):
+                    files[rel] = {"link": os.readlink(path)}
+                elif name in names:
+                    st = os.stat(path)
+                    entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+                    old = cached.get(rel, {})
+                    if old.get("size") == st.st_size and old.get("mtime_ns") == st.st_mtime_ns and "hash" in old:
+                        entry["hash"] = old["hash"]
+                    else:
+                        to_hash.append(rel)
+                    files[rel] = entry
+        if to_hash:
+            Utils.print_stderr(f"Hashing {len(to_hash)} files in {module_dir}...")
+            with ThreadPoolExecutor(max_workers=Config.io_threads) as pool:
+                for rel, digest in zip(to_hash, pool.map(lambda r: Manifest.hash_file(os.path.join(module_dir, r)), to_hash)):
+                    files[rel]["hash"] = digest
+        if save and (to_hash or len(files) != len(cached)) and os.access(module_dir, os.W_OK):
+            Manifest.write(module_dir, files)
+        return files
+
+    @staticmethod
+    def same(a: dict, b: dict) -> bool:
+        if "link" in a or "link" in b:
+            return a.get("link") == b.get("link")
+        return a.get("size") == b.get("size") and a.get("hash") == b.get("hash")
+
+class Sync:
+    """
+    Incremental pull of ref/ modules from a peer modules folder (e.g. another site mounted
+    with NFS or sshfs). Only missing or changed files, found by comparing the manifests
+    of both sides, are copied.
+    """
+    @staticmethod
+    def copy_file(src: str, dest: str) -> int:
+        """Copy one file with its mtime (keeps the manifest cache valid) and return its size."""
+        import shutil
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        partial = f"{dest}.{os.getpid()}.partial"
+        try:
+            shutil.copyfile(src, partial)
+            shutil.copystat(src, partial)
+            os.replace(partial, dest)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        return os.path.getsize(dest)
+
+    @staticmethod
+    def write_modulefile(package: str, version: str, peer_root: str):
+        """
+        Regenerate the modulefile with the local build script (-m), or copy the peer's modulefile
+        if there is no build script here.
+        """
+        import subprocess
+        import shutil
+        script_path = os.path.join(Config.build_scripts_root, package, version)
+        if os.path.exists(script_path):
+            env = dict(os.environ, MODULES_LOCK_HELD=f"{package}/{version}")
+            if subprocess.call(["bash", script_path, "-m"], cwd=Config.script_dir, env=env) == 0:
+                return
+            Utils.print_stderr(f"⚠️ Build script failed to write the modulefile of {Colorize.yellow(package)}/{Colorize.yellow(version)}, copying the peer's.")
+        dest = os.path.join(Config.ref_modulefiles_root, package, version)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        for suffix in ("", ".lua"):
+            src = os.path.join(peer_root, "ref_modulefiles", package, version) + suffix
+            if os.path.exists(src):
+                shutil.copyfile(src, dest + suffix)
+
+    @staticmethod
+    def pull(peer_root: str, patterns: List[str], dry_run: bool = False) -> bool:
+        """
+        Bring the local ref modules matching patterns (all if empty) up to date with peer_root.
+        """
+        import shutil
+        from concurrent.futures import ThreadPoolExecutor
+        peer_root = os.path.abspath(peer_root)
+        if peer_root == Config.script_dir:
+            raise ValueError("The peer is this modules folder")
+        modules = [m for m in Bundle.resolve_modules(patterns or [""], peer_root) if m[0] == "ref"]
+        if not modules:
+            Utils.print_stderr(f"No ref modules to sync in {peer_root}.")
+            return True
+
+        ok = True
+        total_files = total_bytes = 0
+        for _, package, version in modules:
+            label = f"{package}/{version}"
+            peer_dir = os.path.join(peer_root, "ref", package, version)
+            local_dir = os.path.join(Config.ref_root, package, version)
+            lock = FileLock(Config.get_install_lock_path(package, version))
+            if not lock.acquire(blocking=False):
+                Utils.print_stderr(f"⚠️ Skipping {Colorize.yellow(label)}: being installed by another process ({lock.holder()}).")
+                ok = False
+                continue
+            try:
+                peer = Manifest.build(peer_dir)
+                local = Manifest.build(local_dir) if os.path.isdir(local_dir) else {}
+                changed = sorted(rel for rel, entry in peer.items() if rel not in local or not Manifest.same(local[rel], entry))
+                extra = sorted((rel for rel in local if rel not in peer), reverse=True)  # children first
+                installed = os.path.exists(os.path.join(Config.ref_modulefiles_root, package, version))
+                if not changed and not extra and installed:
+                    Utils.print_stderr(f"{Colorize.yellow(label)} is up to date.")
+                    continue
+                size = sum(peer[rel].get("size", 0) for rel in changed)
+                Utils.print_stderr(f"{Colorize.yellow(label)}: {len(changed)} files to copy ({size / 1024**3:.2f} GB), {len(extra)} to remove.")
+                if dry_run:
+                    for rel in changed:
+                        print(f"+ ref/{label}/{rel}")
+                    for rel in extra:
+                        print(f"- ref/{label}/{rel}")
+                    continue
+
+                for rel in extra:
+                    path = os.path.join(local_dir, rel)
+                    if os.path.isdir(path) and not os.path.islink(path):
+                        shutil.rmtree(path)
+                    elif os.path.lexists(path):
+                        os.remove(path)
+                links = [rel for rel in changed if "link" in peer[rel]]
+                copies = [rel for rel in changed if "link" not in peer[rel]]
+                with ThreadPoolExecutor(max_workers=Config.io_threads) as pool:
+                    copied = sum(pool.map(lambda rel: Sync.copy_file(os.path.join(peer_dir, rel), os.path.join(local_dir, rel)), copies))
+                for rel in links:
+                    path = os.path.join(local_dir, rel)
+                    if os.path.lexists(path):
+                        shutil.rmtree(path) if os.path.isdir(path) and not os.path.islink(path) else os.remove(path)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.symlink(peer[rel]["link"], path)
+                Manifest.build(local_dir)  # copied files keep their mtime, the hashes are verified here
+                local = Manifest.read(local_dir)
+                bad = [rel for rel in copies if not Manifest.same(local.get(rel, {}), peer[rel])]
+                if bad:
+                    Utils.print_stderr(f"❌ {Colorize.red(label)}: {len(bad)} files differ after copy (e.g. {bad[0]}). Run the sync again.")
+                    ok = False
+                    continue
+                Sync.write_modulefile(package, version, peer_root)
+                total_files += len(copies)
+                total_bytes += copied
+                Utils.print_stderr(f"✅ Synced {Colorize.yellow(label)}.")
+            except Exception as e:
+                Utils.print_stderr(f"❌ Error syncing {Colorize.red(label)}: {e}")
+                ok = False
+            finally:
+                lock.release()
+        if not dry_run:
+            Utils.print_stderr(f"Copied {total_files} files, {total_bytes / 1024**3:.2f} GB.")
+        return ok
+
+class Dedup:
+    """
+    Replace byte-identical files across installed modules with reflinks (shared extents,
+    files stay independent) or hardlinks. Candidates are found by size, then the hash of
+    the first chunk, then the full hash; full hashes are cached in .cache/dedup-hashes.tsv
+    by path, size and mtime, so rescans only read new or changed files.
+    """
+    MIN_SIZE = 1 << 20   # smaller files are not worth a link
+    HEAD_SIZE = 64 << 10 # first chunk hashed to split size buckets
+    FICLONE = 0x40049409 # ioctl of Linux reflinks (btrfs, XFS, ...)
+
+    @staticmethod
+    def hash_head(path: str) -> str:
+        import hashlib
+        with open(path, "rb") as f:
+            return hashlib.blake2b(f.read(Dedup.HEAD_SIZE), digest_size=16).hexdigest()
+
+    @staticmethod
+    def read_cache() -> Dict[str, tuple]:
+        import csv
+        cache = {}
+        path = Config.get_dedup_cache_path()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for row in csv.DictReader(f, delimiter="\t"):
+                    cache[row["path"]] = (int(row["size"]), int(row["mtime_ns"]), row["hash"])
+        return cache
+
+    @staticmethod
+    def write_cache(cache: Dict[str, tuple]):
+        import csv
+        path = Config.get_dedup_cache_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f, delimiter="\t")
+            writer.writerow(["path", "size", "mtime_ns", "hash"])
+            for p, (size, mtime_ns, digest) in sorted(cache.items()):
+                writer.writerow([p, size, mtime_ns, digest])
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def reflink(src: str, dest: str):
+        """Create dest sharing the extents of src; raises OSError if the filesystem can't."""
+        with open(src, "rb") as f_src, open(dest, "wb") as f_dest:
+            fcntl.ioctl(f_dest.fileno(), Dedup.FICLONE, f_src.fileno())
+
+    @staticmethod
+    def replace(keeper: str, dup: str, link: str) -> str:
+        """
+        Replace dup with a reflink or hardlink of keeper (through a temporary name, then an
+        atomic rename). Return the link type used. Hardlinks share mode and owner, so they
+        are only made if those are the same.
+        """
+        st = os.stat(dup)
+        tmp_path = os.path.join(os.path.dirname(dup), f".{os.path.basename(dup)}.{os.getpid()}.dedup")
+        try:
+            if link in ("auto", "reflink"):
+                try:
+                    Dedup.reflink(keeper, tmp_path)
+                    os.chmod(tmp_path, stat.S_IMODE(st.st_mode))
+                    os.utime(tmp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+                    os.replace(tmp_path, dup)
+                    return "reflink"
+                except OSError:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    if link == "reflink":
+                        raise
+            keeper_st = os.stat(keeper)
+            if (st.st_mode, st.st_uid, st.st_gid) != (keeper_st.st_mode, keeper_st.st_uid, keeper_st.st_gid):
+                raise OSError(f"mode or owner differs from {keeper}, not hardlinked")
+            os.link(keeper, tmp_path)
+            os.replace(tmp_path, dup)
+            return "hardlink"
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @staticmethod
+    def run(patterns: List[str], dry_run: bool = False, link: str = "auto") -> bool:
+        """
+        Deduplicate the installed modules matching patterns (all if empty) and report reclaimed bytes.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        lock = FileLock(os.path.join(Config.lock_root, "dedup.lock"))
+        if not lock.acquire(blocking=False):
+            Utils.print_stderr(f"❌ Another dedup is running ({lock.holder()}).")
+            return False
+        try:
+            # 1. Collect regular files of installed modules that are not being installed
+            inodes: Dict[tuple, List[str]] = {}  # (dev, ino) -> paths (existing hardlinks)
+            stats: Dict[tuple, os.stat_result] = {}
+            for kind, package, version in Bundle.resolve_modules(patterns or [""]):
+                if FileLock(Config.get_install_lock_path(package, version)).is_held():
+                    Utils.print_stderr(f"Skipping {Colorize.yellow(package)}/{Colorize.yellow(version)}: being installed.")
+                    continue
+                for root, _, names in os.walk(os.path.join(Config.script_dir, kind, package, version)):
+                    for name in names:
+                        path = os.path.join(root, name)
+                        st = os.lstat(path)
+                        if not stat.S_ISREG(st.st_mode) or st.st_size < Dedup.MIN_SIZE:
+                            continue
+                        inodes.setdefault((st.st_dev, st.st_ino), []).append(path)
+                        stats[(st.st_dev, st.st_ino)] = st
+
+            # 2. Size buckets (per filesystem), one representative path per inode
+            buckets: Dict[tuple, List[tuple]] = {}
+            for key, st in stats.items():
+                buckets.setdefault((st.st_dev, st.st_size), []).append(key)
+            candidates = [keys for keys in buckets.values() if len(keys) > 1]
+            Utils.print_stderr(f"Scanned {len(stats)} files of at least {Dedup.MIN_SIZE >> 20} MB, {sum(len(k) for k in candidates)} share their size.")
+
+            cache = Dedup.read_cache()
+            with ThreadPoolExecutor(max_workers=Config.io_threads) as pool:
+                # 3. Split buckets by the hash of the first chunk
+                keys = [key for bucket in candidates for key in bucket]
+                heads = dict(zip(keys, pool.map(lambda k: Dedup.hash_head(inodes[k][0]), keys)))
+                groups: Dict[tuple, List[tuple]] = {}
+                for key in keys:
+                    st = stats[key]
+                    groups.setdefault((st.st_dev, st.st_size, heads[key]), []).append(key)
+                keys = [key for group in groups.values() if len(group) > 1 for key in group]
+
+                # 4. Full hash, cached by path, size and mtime
+                def full_hash(key: tuple) -> str:
+                    st, path = stats[key], inodes[key][0]
+                    cached = cache.get(path)
+                    if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+                        return cached[2]
+                    return Manifest.hash_file(path)
+                Utils.print_stderr(f"Hashing {len(keys)} candidates...")
+                digests = dict(zip(keys, pool.map(full_hash, keys)))
+            for key, digest in digests.items():
+                st = stats[key]
+                for path in inodes[key]:
+                    cache[path] = (st.st_size, st.st_mtime_ns, digest)
+
+            identical: Dict[tuple, List[tuple]] = {}
+            for key, digest in digests.items():
+                identical.setdefault((key[0], digest), []).append(key)
+
+            # 5. Keep the inode with most links (oldest first on ties), replace the others
+            reclaimed = replaced = 0
+            used = {}
+            for group in identical.values():
+                if len(group) < 2:
+                    continue
+                group.sort(key=lambda k: (-len(inodes[k]), stats[k].st_mtime_ns))
+                keeper_key, dups = group[0], group[1:]
+                keeper = inodes[keeper_key][0]
+                for key in dups:
+                    st = stats[key]
+                    done = 0
+                    for path in inodes[key]:
+                        if dry_run:
+                            print(f"{path} -> {keeper}")
+                            done += 1
+                            continue
+                        current = os.lstat(path)
+                        if (current.st_ino, current.st_size, current.st_mtime_ns) != (st.st_ino, st.st_size, st.st_mtime_ns):
+                            Utils.print_stderr(f"⚠️ {path} changed during the scan, skipped.")
+                            continue
+                        try:
+                            kind = Dedup.replace(keeper, path, link)
+                        except OSError as e:
+                            Utils.print_stderr(f"⚠️ Cannot link {path}: {e}")
+                            continue
+                        used[kind] = used.get(kind, 0) + 1
+                        new_st = os.stat(path)
+                        cache[path] = (new_st.st_size, new_st.st_mtime_ns, cache[keeper][2])
+                        done += 1
+                    replaced += done
+                    if done == st.st_nlink:
+                        reclaimed += st.st_size  # the space is only freed if no other link to the inode is left
+            if not dry_run:
+                Dedup.write_cache(cache)
+            verb = "Would reclaim" if dry_run else "Reclaimed"
+            links = ", ".join(f"{n} {kind}s" for kind, n in sorted(used.items()))
+            Utils.print_stderr(f"{verb} {reclaimed / 1024**3:.2f} GB from {replaced} duplicate files" + (f" ({links})." if links else "."))
+            return True
+        finally:
+            lock.release()
+
+class Usage:
+    """
+    Module usage from logs/usage/<user>.tsv (appended by the modulefile load hook of the
+    templates: <epoch seconds> TAB <module>), and quota-driven eviction of the least
+    recently used modules.
+    """
+    @staticmethod
+    def ensure_log_dir():
+        """Create logs/usage writable by everyone (sticky, like /tmp), so every user's loads are logged."""
+        path = Config.get_usage_dir()
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path, exist_ok=True)
+                os.chmod(path, 0o1777)
+            except OSError:
+                pass  # e.g. a read-only modules folder for this user
+
+    @staticmethod
+    def read_logs() -> Dict[str, dict]:
+        """Return {module: {"last_used", "loads", "users"}}."""
+        usage: Dict[str, dict] = {}
+        usage_dir = Config.get_usage_dir()
+        if not os.path.isdir(usage_dir):
+            return usage
+        for name in os.listdir(usage_dir):
+            if not name.endswith(".tsv"):
+                continue
+            user = name[:-len(".tsv")]
+            with open(os.path.join(usage_dir, name), "r", encoding="utf-8", errors="replace") as f:
+                for line in f:
+                    fields = line.rstrip("\n").split("\t")
+                    if len(fields) != 2 or not fields[0].isdigit():
+                        continue  # partial line of a concurrent append
+                    entry = usage.setdefault(fields[1], {"last_used": 0, "loads": 0, "users": set()})
+                    entry["last_used"] = max(entry["last_used"], int(fields[0]))
+                    entry["loads"] += 1
+                    entry["users"].add(user)
+        return usage
+
+    @staticmethod
+    def disk_usage(path: str) -> int:
+        """Allocated bytes under path, counting hardlinked files once."""
+        total = 0
+        seen = set()
+        for root, dirs, names in os.walk(path):
+            for name in dirs + names:
+                st = os.lstat(os.path.join(root, name))
+                if st.st_nlink > 1 and not stat.S_ISDIR(st.st_mode):
+                    if (st.st_dev, st.st_ino) in seen:
+                        continue
+                    seen.add((st.st_dev, st.st_ino))
+                total += st.st_blocks * 512
+        return total
+
+    @staticmethod
+    def collect() -> List[dict]:
+        """Size, install time and usage of every installed module."""
+        from concurrent.futures import ThreadPoolExecutor
+        usage = Usage.read_logs()
+        modules = Utils.list_installed_modules()
+        dirs = [os.path.join(Config.script_dir, kind, package, version) for kind, package, version in modules]
+        with ThreadPoolExecutor(max_workers=Config.io_threads) as pool:
+            sizes = list(pool.map(Usage.disk_usage, dirs))
+        rows = []
+        for (kind, package, version), size in zip(modules, sizes):
+            name = f"{package}/{version}"
+            modulefile = os.path.join(Config.script_dir, f"{kind}_modulefiles", package, version)
+            entry = usage.get(name, {"last_used": 0, "loads": 0, "users": set()})
+            rows.append({"kind": kind, "package": package, "version": version, "module": name, "size": size,
+                         "installed_at": os.path.getmtime(modulefile), "last_used": entry["last_used"],
+                         "loads": entry["loads"], "users": len(entry["users"])})
+        return rows
+
+    @staticmethod
+    def print_report():
+        rows = Usage.collect()
+        if not rows:
+            Utils.print_stderr("No installed modules found.")
+            return
+        def day(ts: float) -> str:
+            return time.strftime('%Y-%m-%d', time.localtime(ts)) if ts else "never"
+        header = ["module", "size GB", "installed", "last used", "loads", "users"]
+        lines = [[r["module"], f"{r['size'] / 1024**3:.2f}", day(r["installed_at"]), day(r["last_used"]), str(r["loads"]), str(r["users"])]
+                 for r in sorted(rows, key=lambda r: (r["last_used"] or r["installed_at"]))]
+        widths = [max(len(x) for x in col) for col in zip(header, *lines)]
+        print("  ".join(h.ljust(w) for h, w in zip(header, widths)).rstrip())
+        for line in lines:
+            print("  ".join(x.ljust(w) for x, w in zip(line, widths)).rstrip())
+        print(f"Total: {sum(r['size'] for r in rows) / 1024**3:.2f} GB in {len(rows)} modules")
+
+    @staticmethod
+    def read_pins() -> List[str]:
+        """Modules or prefixes (e.g. grch38/genome) that are never evicted, one per line in backup/pins.txt."""
+        path = Config.get_pins_path()
+        if not os.path.exists(path):
+            return []
+        with open(path, "r", encoding="utf-8") as f:
+            return [line.split("#", 1)[0].strip().strip("/") for line in f if line.split("#", 1)[0].strip()]
+
+    @staticmethod
+    def required_modules() -> set:
+        """
+        Modules loaded by installed apps (their modulefile dependencies). Ref dependencies are
+        only needed to build a module, so they do not protect anything.
+        """
+        required = set()
+        for kind, package, version in Utils.list_installed_modules():
+            if kind != "apps":
+                continue
+            with open(os.path.join(Config.apps_modulefiles_root, package, version), "r", encoding="utf-8") as f:
+                for line in f:
+                    match = re.match(r"^\s*(?:# Dependency:|module load)\s+(\S+)", line)
+                    if match:
+                        required.add(match.group(1))
+        return required
+
+    @staticmethod
+    def evict(pm: 'PackageManager', quota: int, dry_run: bool = False, yes: bool = False) -> bool:
+        """
+        Delete least recently used modules (never used: oldest installed first) until the installed
+        modules fit in quota bytes. Pinned modules, modules loaded by installed apps and modules
+        being installed are kept.
+        """
+        rows = Usage.collect()
+        total = sum(r["size"] for r in rows)
+        Utils.print_stderr(f"Installed modules use {total / 1024**3:.2f} GB, quota is {quota / 1024**3:.2f} GB.")
+        if total <= quota:
+            Utils.print_stderr("Nothing to evict.")
+            return True
+
+        pins = Usage.read_pins()
+        required = Usage.required_modules()
+        def protected(r: dict) -> Optional[str]:
+            if any(r["module"] == p or r["module"].startswith(p + "/") for p in pins):
+                return "pinned"
+            if r["module"] in required or (r["kind"] == "apps" and r["package"] in required):
+                return "loaded by an installed app"
+            if FileLock(Config.get_install_lock_path(r["package"], r["version"])).is_held():
+                return "being installed"
+            return None
+
+        selected = []
+        for r in sorted(rows, key=lambda r: (r["last_used"] or r["installed_at"])):
+            if total <= quota:
+                break
+            reason = protected(r)
+            if reason:
+                Utils.print_stderr(f"Keeping {Colorize.yellow(r['module'])}: {reason}")
+                continue
+            selected.append(r)
+            total -= r["size"]
+
+        for r in selected:
+            last = time.strftime('%Y-%m-%d', time.localtime(r["last_used"])) if r["last_used"] else "never"
+            print(f"{r['module']}\t{r['size'] / 1024**3:.2f} GB\tlast used: {last}")
+        freed = sum(r["size"] for r in selected)
+        if total > quota:
+            Utils.print_stderr(f"⚠️ Evicting all candidates frees {freed / 1024**3:.2f} GB, still {(total - quota) / 1024**3:.2f} GB over quota.")
+        if dry_run or not selected:
+            return total <= quota
+        if not yes:
+            ready = input(f"Delete these {len(selected)} modules ({freed / 1024**3:.2f} GB)? [y/N]: ")
+            if ready.lower() != 'y':
+                Utils.print_stderr("Eviction cancelled by user.")
+                return False
+
+        ok = True
+        for r in selected:
+            lock = FileLock(Config.get_install_lock_path(r["package"], r["version"]))
+            if not lock.acquire(blocking=False):
+                Utils.print_stderr(f"Skipping {Colorize.yellow(r['module'])}: being installed by another process ({lock.holder()}).")
+                continue
+            try:
+                ok = pm.delete(r["package"], r["version"]) and ok
+            finally:
+                lock.release()
+        Utils.print_stderr(f"Evicted {len(selected)} modules, {freed / 1024**3:.2f} GB.")
+        return ok and total <= quota
+
+class GC:
+    """
+    Find and remove leftovers of interrupted builds and downloads: temporary build
+    directories whose install lock is free, partial and temporary files, and micromamba
+    package cache entries that no installed prefix or lockfile refers to.
+    """
+    MIN_AGE = 24 * 3600  # temporary files younger than this may belong to a running process
+
+    @staticmethod
+    def module_dirs(root: str) -> List[tuple[str, str]]:
+        """(module, path) of the per-module directories under root (tmp/ or a staging root)."""
+        found = []
+        if not os.path.isdir(root):
+            return found
+        for first in sorted(os.listdir(root)):
+            for second in sorted(os.listdir(os.path.join(root, first))) if os.path.isdir(os.path.join(root, first)) else []:
+                path = os.path.join(root, first, second)
+                if not os.path.isdir(os.path.join(Config.build_scripts_root, first, second)) or not os.path.isdir(path):
+                    found.append((f"{first}/{second}", path))  # apps: tmp/<app>/<version>
+                    continue
+                for third in sorted(os.listdir(path)):  # ref: tmp/<assembly>/<data-type>/<version>
+                    found.append((f"{first}/{second}/{third}", os.path.join(path, third)))
+        return found
+
+    @staticmethod
+    def scratch_roots() -> List[str]:
+        """Staging directories of this user on the scratch candidates of this node."""
+        candidates = os.environ.get("MODULES_SCRATCH_DIRS") or f"{os.environ.get('TMPDIR', '')}:/local:/local/scratch:/tmp"
+        user = os.environ.get("USER", "")
+        roots = []
+        for candidate in candidates.split(":"):
+            root = os.path.join(candidate, f"modules-staging-{user}") if candidate else ""
+            if root and os.path.isdir(root) and os.path.realpath(root) not in roots:
+                roots.append(os.path.realpath(root))
+        return roots
+
+    @staticmethod
+    def stale_build_dirs() -> List[tuple[str, str]]:
+        """(description, path) of build directories not owned by a running install."""
+        stale = []
+        for root, where in [(Config.tmp_root, "tmp")] + [(r, "scratch") for r in GC.scratch_roots()]:
+            for module, path in GC.module_dirs(root):
+                package, version = module.split("/", 1)
+                if FileLock(Config.get_install_lock_path(package, version)).is_held():
+                    continue
+                checkpoints = os.path.join(path, ".checkpoints")
+                if where == "tmp" and os.path.isdir(checkpoints) and os.listdir(checkpoints):
+                    Utils.print_stderr(f"Keeping {path}: completed phases can be resumed (./manager.py -i {module} --resume)")
+                    continue
+                stale.append((f"{where} build directory", path))
+        # finalize_staging moves a staged target next to its final place before renaming it
+        if os.path.isdir(Config.ref_root):
+            for dirpath, dirs, _ in os.walk(Config.ref_root):
+                for name in list(dirs):
+                    if name.startswith(".") and ".staging." in name:
+                        dirs.remove(name)
+                        path = os.path.join(dirpath, name)
+                        if time.time() - os.path.getmtime(path) > GC.MIN_AGE:
+                            stale.append(("interrupted staging move", path))
+                if os.path.relpath(dirpath, Config.ref_root).count(os.sep) >= 1:
+                    dirs[:] = []  # staging moves are at ref/<assembly>/<data-type>/
+        return stale
+
+    @staticmethod
+    def stale_files() -> List[tuple[str, str]]:
+        """
+        (description, path) of old partial downloads and temporary files. In ref/ only the names this
+        tool writes count (<file>.<pid>.tmp/.partial, .<file>.<pid>.dedup), plus the .partial and .tmp
+        files of common.sh in modules that are not installed, so reference data is never matched.
+        """
+        stale = []
+        def old(path: str) -> bool:
+            return time.time() - os.path.getmtime(path) > GC.MIN_AGE
+        def generic_kind(name: str) -> Optional[str]:
+            if name.endswith(".partial"):
+                return "partial download"
+            if name.endswith(".tmp") or name.endswith(".bak") or name.endswith(".dedup"):
+                return "temporary file"
+            return None
+        places = [(Config.metadata_root, False), (Config.get_conda_pkgs_dir(), False), (Config.cache_root, False),
+                  (os.path.join(Config.cache_root, "inputs"), True), (Config.conda_locks_root, True)]
+        for root, recursive in places:
+            if not os.path.isdir(root):
+                continue
+            walk = os.walk(root) if recursive else [(root, [], os.listdir(root))]
+            for dirpath, _, names in walk:
+                for name in names:
+                    path = os.path.join(dirpath, name)
+                    if not os.path.isfile(path) or os.path.islink(path):
+                        continue
+                    kind = generic_kind(name)
+                    if kind and old(path):
+                        stale.append((kind, path))
+
+        if os.path.isdir(Config.ref_root):
+            installed = {os.path.join(Config.ref_root, package, version)
+                         for kind, package, version in Utils.list_installed_modules() if kind == "ref"}
+            own_name = re.compile(r"(\.\d+\.(tmp|partial)|^\..+\.\d+\.dedup)$")
+            for dirpath, _, names in os.walk(Config.ref_root):
+                parent = dirpath
+                while parent not in installed and parent != Config.ref_root and os.path.dirname(parent) != parent:
+                    parent = os.path.dirname(parent)
+                in_installed = parent in installed
+                for name in names:
+                    path = os.path.join(dirpath, name)
+                    if not os.path.isfile(path) or os.path.islink(path):
+                        continue
+                    written_here = own_name.search(name) or (not in_installed and name.endswith((".partial", ".tmp")))
+                    if written_here and old(path):
+                        stale.append((generic_kind(name), path))
+        return stale
+
+    @staticmethod
+    def used_inputs() -> List[tuple[str, str]]:
+        """(description, path) of inputs fetched by --fetch-only for modules that are installed now."""
+        installed = {f"{package}/{version}" for _, package, version in Utils.list_installed_modules()}
+        return [("fetched inputs of installed module", path)
+                for module, path in GC.module_dirs(os.path.join(Config.cache_root, "inputs")) if module in installed]
+
+    @staticmethod
+    def unreferenced_packages() -> List[tuple[str, str]]:
+        """(description, path) of micromamba cache entries not used by installed prefixes or lockfiles."""
+        pkgs_dir = Config.get_conda_pkgs_dir()
+        if not os.path.isdir(pkgs_dir):
+            return []
+        referenced = set()
+        if os.path.isdir(Config.apps_root):
+            for package in os.listdir(Config.apps_root):
+                for version in os.listdir(os.path.join(Config.apps_root, package)) if os.path.isdir(os.path.join(Config.apps_root, package)) else []:
+                    meta_dir = os.path.join(Config.apps_root, package, version, "conda-meta")
+                    if not os.path.isdir(meta_dir):
+                        continue
+                    for name in os.listdir(meta_dir):
+                        if name.endswith(".json"):
+                            referenced.add(name[:-len(".json")])
+        if os.path.isdir(Config.conda_locks_root):
+            for dirpath, _, names in os.walk(Config.conda_locks_root):
+                for name in names:
+                    if name.endswith(".txt"):
+                        for url, _ in PackageManager.read_conda_lock(os.path.join(dirpath, name)):
+                            referenced.add(url.rsplit("/", 1)[-1].removesuffix(".conda").removesuffix(".tar.bz2"))
+        unreferenced = []
+        for name in sorted(os.listdir(pkgs_dir)):
+            path = os.path.join(pkgs_dir, name)
+            if name.endswith(".conda") or name.endswith(".tar.bz2"):
+                dist = name.removesuffix(".conda").removesuffix(".tar.bz2")
+            elif os.path.isdir(os.path.join(path, "info")):
+                dist = name
+            else:
+                continue  # cache/, urls.txt, locks
+            if dist not in referenced:
+                unreferenced.append(("unused conda package", path))
+        return unreferenced
+
+    @staticmethod
+    def install_running() -> bool:
+        for dirpath, _, names in os.walk(Config.lock_root):
+            for name in names:
+                if name.endswith(".lock") and name != "dedup.lock" and FileLock(os.path.join(dirpath, name)).is_held():
+                    return True
+        return False
+
+    @staticmethod
+    def remove(path: str):
+        import shutil
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+    @staticmethod
+    def run(dry_run: bool = False) -> bool:
+        from concurrent.futures import ThreadPoolExecutor
+        found = GC.stale_build_dirs() + GC.stale_files()
+        if GC.install_running():
+            # micromamba may be writing to its package cache
+            Utils.print_stderr("An install is running, the conda package cache and fetched inputs are not collected.")
+        else:
+            found += GC.unreferenced_packages() + GC.used_inputs()
+        if not found:
+            Utils.print_stderr("Nothing to collect.")
+            return True
+
+        with ThreadPoolExecutor(max_workers=Config.io_threads) as pool:
+            sizes = list(pool.map(lambda item: Usage.disk_usage(item[1]) if os.path.isdir(item[1]) else os.lstat(item[1]).st_blocks * 512, found))
+        totals: Dict[str, list] = {}
+        for (kind, path), size in zip(found, sizes):
+            print(f"{size / 1024**2:10.1f} MB  {kind}: {path}")
+            totals.setdefault(kind, [0, 0])
+            totals[kind][0] += 1
+            totals[kind][1] += size
+        for kind, (count, size) in sorted(totals.items()):
+            Utils.print_stderr(f"{kind}: {count} ({size / 1024**3:.2f} GB)")
+        total = sum(sizes)
+        if dry_run:
+            Utils.print_stderr(f"Would free up to {total / 1024**3:.2f} GB.")
+            return True
+
+        errors = 0
+        with ThreadPoolExecutor(max_workers=Config.io_threads) as pool:
+            for (kind, path), future in zip(found, [pool.submit(GC.remove, path) for _, path in found]):
+                try:
+                    future.result()
+                except OSError as e:
+                    Utils.print_stderr(f"⚠️ Cannot remove {path}: {e}")
+                    errors += 1
+        # Empty parents of removed build directories
+        for kind, path in found:
+            if kind.endswith("build directory") or kind.startswith("fetched inputs"):
+                Utils.rmdir_until_not_empty(os.path.dirname(path))
+        Utils.print_stderr(f"Freed up to {total / 1024**3:.2f} GB (hardlinked files are only freed with their last link).")
+        return errors == 0
+
+class Plan:
+    """
+    Preview of an install (--plan): the dependency graph of the targets with installed modules
+    marked, and for the modules to install the download size (HEAD requests, cached in
+    .cache/download-sizes.json), disk use and duration (from logs/build-stats.tsv: the module,
+    else the latest build of another version), the total and the critical path.
+    """
+    @staticmethod
+    def graph(pm: 'PackageManager', targets: List[str]) -> tuple[List[str], Dict[str, dict]]:
+        """Return the target modules and {module: {package, version, kind, installed, deps}}."""
+        queue = []
+        for target in targets:
+            if os.path.isfile(target):
+                with open(target, "r", encoding="utf-8") as f:
+                    queue += [line.split("#", 1)[0].strip() for line in f if line.split("#", 1)[0].strip()]
+            else:
+                queue.append(target)
+        roots = []
+        nodes: Dict[str, dict] = {}
+        def visit(target: str) -> str:
+            package_name, version = pm.get_package_version(target)
+            module = f"{package_name}/{version}"
+            if module in nodes:
+                return module
+            pkg = pm.get_package(package_name)
+            modulefiles_root = Config.ref_modulefiles_root if pkg.is_ref() else Config.apps_modulefiles_root
+            installed = os.path.exists(os.path.join(modulefiles_root, package_name, version))
+            kind = "local" if pkg.is_local() else "pypi" if pkg.is_pypi() else "conda"
+            nodes[module] = {"package": package_name, "version": version, "kind": kind, "installed": installed, "deps": []}
+            if pkg.is_local() and not installed:
+                nodes[module]["deps"] = [visit(f"{dep}/{dep_version}" if dep_version else dep)
+                                         for dep, dep_version in pm.get_local_dependencies(package_name, version)]
+            return module
+        for target in queue:
+            module = visit(target)
+            if module not in roots:
+                roots.append(module)
+        return roots, nodes
+
+    @staticmethod
+    def downloads(pm: 'PackageManager', node: dict) -> Optional[List[str]]:
+        """URLs a module still has to download, or None if unknown (no #INPUT: lines or no lockfile)."""
+        package_name, version = node["package"], node["version"]
+        if node["kind"] == "local":
+            inputs = pm.get_local_inputs(package_name, version)
+            if not inputs:
+                with open(os.path.join(Config.build_scripts_root, package_name, version), "r", encoding="utf-8") as f:
+                    return None if re.search(r"\b(wget|curl)\b", f.read()) else []
+            inputs_dir = Config.get_inputs_dir(package_name, version)
+            return [url for name, url, _ in inputs if not os.path.exists(os.path.join(inputs_dir, name))]
+        if node["kind"] == "conda":
+            lock_path = Config.get_conda_lock_path(package_name, version)
+            if not os.path.exists(lock_path):
+                return None
+            return [url for url, _ in pm.uncached_conda_packages(pm.read_conda_lock(lock_path))]
+        return None
+
+    @staticmethod
+    def url_sizes(urls: List[str]) -> Dict[str, Optional[int]]:
+        """Content-Length of urls from the cache or HEAD requests (Config.download_threads at a time)."""
+        import json
+        from concurrent.futures import ThreadPoolExecutor
+        import urllib.request
+        cache_path = os.path.join(Config.cache_root, "download-sizes.json")
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+        def head(url: str) -> Optional[int]:
+            try:
+                request = urllib.request.Request(url, method="HEAD")
+                with urllib.request.urlopen(request, timeout=15) as resp:
+                    length = resp.headers.get("Content-Length")
+                    return int(length) if length else None
+            except (OSError, ValueError):
+                return None
+        missing = [url for url in dict.fromkeys(urls) if url not in cache]
+        if missing:
+            Utils.print_stderr(f"Checking the size of {len(missing)} downloads...")
+            with ThreadPoolExecutor(max_workers=Config.download_threads) as pool:
+                for url, size in zip(missing, pool.map(head, missing)):
+                    if size is not None:
+                        cache[url] = size
+            try:
+                os.makedirs(Config.cache_root, exist_ok=True)
+                tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(cache, f, indent=1, sort_keys=True)
+                os.replace(tmp_path, cache_path)
+            except OSError:
+                pass
+        return {url: cache.get(url) for url in urls}
+
+    @staticmethod
+    def history(rows: List[Dict[str, str]], node: dict) -> Optional[tuple[int, int, str]]:
+        """(elapsed seconds, target bytes, source) of the latest recorded install of the module or of its package."""
+        module = f"{node['package']}/{node['version']}"
+        same = [r for r in rows if r["module"] == module]
+        other = [r for r in rows if r["module"].rsplit("/", 1)[0] == node["package"]]
+        row = (same or other or [None])[-1]
+        if row is None:
+            return None
+        source = "history" if same else f"from {row['module'].rsplit('/', 1)[-1]}"
+        return int(row["elapsed_s"] or 0), int(row["target_bytes"] or 0), source
+
+    @staticmethod
+    def run(pm: 'PackageManager', targets: List[str]) -> bool:
+        try:
+            roots, nodes = Plan.graph(pm, targets)
+            todo = [module for module, node in nodes.items() if not node["installed"]]
+            urls = {module: Plan.downloads(pm, nodes[module]) for module in todo}
+        except (OSError, ValueError) as e:
+            Utils.print_stderr(f"❌ Error resolving targets: {e}")
+            return False
+        sizes = Plan.url_sizes([url for module_urls in urls.values() for url in module_urls or []])
+        rows = pm.read_build_stats()
+
+        estimates: Dict[str, dict] = {}
+        for module in todo:
+            found = Plan.history(rows, nodes[module])
+            download = None
+            if urls[module] is not None and all(sizes[url] is not None for url in urls[module]):
+                download = sum(sizes[url] for url in urls[module])
+            estimates[module] = {"download": download, "elapsed": found[0] if found else None,
+                                 "disk": found[1] if found else None, "source": found[2] if found else "no history"}
+
+        def gb(value: Optional[int]) -> str:
+            return "?" if value is None else f"{value / 1024**3:.2f}"
+        def hms(value: Optional[int]) -> str:
+            return "?" if value is None else f"{value // 3600}:{value % 3600 // 60:02d}:{value % 60:02d}"
+
+        header = ["module", "kind", "status", "download GB", "disk GB", "time", "estimate"]
+        lines = []
+        printed = set()
+        def show(module: str, depth: int):
+            node = nodes[module]
+            name = "  " * depth + module
+            if module in printed:
+                lines.append([name + " (see above)", "", "", "", "", "", ""])
+                return
+            printed.add(module)
+            if node["installed"]:
+                lines.append([name, node["kind"], "installed", "", "", "", ""])
+            else:
+                e = estimates[module]
+                lines.append([name, node["kind"], "install", gb(e["download"]), gb(e["disk"]), hms(e["elapsed"]), e["source"]])
+            for dep in node["deps"]:
+                show(dep, depth + 1)
+        for module in roots:
+            show(module, 0)
+        widths = [max(len(x) for x in col) for col in zip(header, *lines)]
+        print("  ".join(h.ljust(w) for h, w in zip(header, widths)).rstrip())
+        for line in lines:
+            print("  ".join(x.ljust(w) for x, w in zip(line, widths)).rstrip())
+
+        if not todo:
+            print("Everything is installed.")
+            return True
+        def total(key: str) -> str:
+            known = [estimates[m][key] for m in todo if estimates[m][key] is not None]
+            unknown = len(todo) - len(known)
+            if not known:
+                return "unknown"
+            text = hms(sum(known)) if key == "elapsed" else f"{gb(sum(known))} GB"
+            return text + (f" + {unknown} unknown" if unknown else "")
+
+        # Longest chain of modules to install (modules without an estimate count as 0)
+        chains: Dict[str, tuple[int, List[str]]] = {}
+        def chain(module: str) -> tuple[int, List[str]]:
+            if module not in chains:
+                deps = [chain(dep) for dep in nodes[module]["deps"] if not nodes[dep]["installed"]]
+                longest = max(deps, key=lambda item: item[0], default=(0, []))
+                chains[module] = (longest[0] + (estimates[module]["elapsed"] or 0), longest[1] + [module])
+            return chains[module]
+        critical = max((chain(module) for module in roots if module in estimates), key=lambda item: item[0])
+
+        print()
+        print(f"To install: {len(todo)} of {len(nodes)} modules")
+        print(f"Download:   {total('download')}")
+        print(f"Disk:       {total('disk')} (installed size, without build temporaries and caches)")
+        print(f"Time:       {total('elapsed')} one after another, as -i installs dependencies")
+        unknown = [module for module in critical[1] if estimates[module]["elapsed"] is None]
+        print(f"Critical path: {hms(critical[0])} ({' -> '.join(critical[1])}), if independent dependencies are installed in parallel")
+        if unknown:
+            Utils.print_stderr(Colorize.yellow(f"⚠️ No build history for {len(unknown)} modules on the critical path; their time is counted as 0."))
+        return True
+
+class RefInfo:
+    """
+    Machine-readable description of a ref module, written to ref/<module>/.module.json after
+    each build: exported variables (as in the modulefile, relative to $ref_root), files with
+    sizes, and provenance. Read by --print-ref-env without loading the package database.
+    """
+    NAME = ".module.json"
+    FORMAT = 1
+
+    @staticmethod
+    def env_home_name(module: str) -> str:
+        """Name of the <MODULE>_HOME variable set by ref-template."""
+        return re.sub(r"[-./]", "_", module).upper() + "_HOME"
+
+    @staticmethod
+    def parse_modulefile(path: str, module: str) -> Dict[str, str]:
+        """
+        Return {NAME: value} of the environment variables a Tcl ref modulefile sets, with paths
+        written as $ref_root/... Only top-level `set` and `setenv` lines are evaluated.
+        """
+        variables = {"ref_root": "$ref_root"}
+        env = {RefInfo.env_home_name(module): "$ref_root"}
+        def substitute(value: str) -> Optional[str]:
+            value = value.strip().strip('"')
+            if "[" in value:
+                return None  # Tcl command substitution
+            unresolved = False
+            def lookup(match):
+                nonlocal unresolved
+                name = match.group(1) or match.group(2)
+                if name not in variables:
+                    unresolved = True
+                    return match.group(0)
+                return variables[name]
+            value = re.sub(r"\$\{(\w+)\}|\$(\w+)", lookup, value.replace("\\$", "$"))
+            return None if unresolved else value
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                match = re.match(r"^(set|setenv)\s+(\S+)\s+(.+?)\s*$", line)
+                if not match:
+                    continue
+                command, name, value = match.groups()
+                if name.startswith("$") or name in ("ref_root",):
+                    continue
+                value = substitute(value)
+                if value is None:
+                    continue
+                if command == "set":
+                    variables[name] = value
+                else:
+                    env[name] = value
+        return env
+
+    @staticmethod
+    def write(pm: 'PackageManager', module: str):
+        """Write ref/<module>/.module.json from the installed modulefile and target directory."""
+        import subprocess
+        import json
+        import socket
+        import hashlib
+        package, version = module.split("/", 1)
+        target_dir = os.path.join(Config.ref_root, package, version)
+        modulefile = os.path.join(Config.ref_modulefiles_root, package, version)
+        script_path = os.path.join(Config.build_scripts_root, package, version)
+
+        files = {}
+        for root, _, names in os.walk(target_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                rel = os.path.relpath(path, target_dir)
+                if rel in (RefInfo.NAME, Manifest.NAME) or os.path.islink(path):
+                    continue
+                files[rel] = os.path.getsize(path)
+
+        provenance = {
+            "built_at": time.strftime('%Y-%m-%d %H:%M:%S'),
+            "host": socket.gethostname(),
+            "user": os.environ.get("USER", ""),
+        }
+        if os.path.exists(script_path):
+            with open(script_path, "rb") as f:
+                content = f.read()
+            provenance["build_script"] = os.path.relpath(script_path, Config.script_dir)
+            provenance["build_script_sha256"] = hashlib.sha256(content).hexdigest()
+            for key in ("WHATIS", "URL"):
+                match = re.search(rf"^#{key}:(.*)$", content.decode("utf-8", "replace"), re.MULTILINE)
+                if match:
+                    provenance[key.lower()] = match.group(1).strip()
+            try:
+                provenance["dependencies"] = [f"{name}/{ver}" for name, ver in pm.get_local_dependencies(package, version)]
+            except Exception:
+                pass
+        try:
+            provenance["git_commit"] = subprocess.run(["git", "-C", Config.script_dir, "rev-parse", "HEAD"],
+                                                      capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            pass
+
+        info = {
+            "format": RefInfo.FORMAT,
+            "module": module,
+            "variables": RefInfo.parse_modulefile(modulefile, module),
+            "files": files,
+            "total_size": sum(files.values()),
+            "provenance": provenance,
+        }
+        path = os.path.join(target_dir, RefInfo.NAME)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(info, f, indent=2)
+            f.write("\n")
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def read_env(module: str) -> Dict[str, str]:
+        """
+        Return the environment of an installed ref module with absolute paths, from its
+        .module.json (or its modulefile for modules built before .module.json existed).
+        """
+        import json
+        module = module.strip("/")
+        package, _, version = module.partition("/")
+        modulefile = os.path.join(Config.ref_modulefiles_root, package, version)
+        if not version or not os.path.isfile(modulefile):
+            raise ValueError(f"Ref module {module} is not installed")
+        ref_root = os.path.join(Config.ref_root, package, version)
+        local_dir = Stage.current_copy(module, ref_root)
+        try:
+            with open(os.path.join(ref_root, RefInfo.NAME), "r", encoding="utf-8") as f:
+                variables = json.load(f)["variables"]
+        except (OSError, ValueError, KeyError):
+            variables = RefInfo.parse_modulefile(modulefile, module)
+        if local_dir:
+            Stage.touch(local_dir)
+            ref_root = local_dir
+        return {name: value.replace("$ref_root", ref_root) for name, value in variables.items()}
+
+    @staticmethod
+    def print_env(modules: List[str], as_json: bool = False) -> bool:
+        """Print the variables of ref modules as shell exports (or one JSON object)."""
+        import json
+        import shlex
+        result = {}
+        ok = True
+        for module in modules:
+            try:
+                result[module] = RefInfo.read_env(module)
+            except ValueError as e:
+                Utils.print_stderr(f"❌ {e}")
+                ok = False
+        if as_json:
+            print(json.dumps(result, indent=2))
+        else:
+            for env in result.values():
+                for name, value in env.items():
+                    print(f"export {name}={shlex.quote(value)}")
+        return ok
+
+class Stage:
+    """
+    Node-local copies of ref modules (e.g. a 30 GB STAR index) in $MODULES_LOCAL_CACHE/ref/<module>,
+    so jobs on the same node read them from local disk instead of the shared filesystem.
+    A copy is used (by the modulefile and --print-ref-env) only if its .staged marker exists and
+    its .module.json equals the shared one, i.e. the module was not rebuilt since it was staged.
+    Least recently used copies are evicted to fit the cache size budget.
+    """
+    MARKER = ".staged"
+    LAST_USED = ".last_used"
+    MIN_IDLE = 6 * 3600  # copies used more recently may still be read by a running job
+
+    @staticmethod
+    def current_copy(module: str, shared_dir: str) -> Optional[str]:
+        """Return the node-local copy of module if it is complete and current, else None."""
+        local_dir = Config.get_local_ref_dir(module)
+        if not local_dir or not os.path.exists(os.path.join(local_dir, Stage.MARKER)):
+            return None
+        try:
+            with open(os.path.join(shared_dir, RefInfo.NAME), "rb") as shared, open(os.path.join(local_dir, RefInfo.NAME), "rb") as local:
+                if shared.read() != local.read():
+                    return None
+        except OSError:
+            return None
+        return local_dir
+
+    @staticmethod
+    def touch(local_dir: str):
+        """Record a use of a local copy (LRU order of the eviction)."""
+        try:
+            with open(os.path.join(local_dir, Stage.LAST_USED), "w", encoding="utf-8") as f:
+                f.write(f"{int(time.time())}\n")
+        except OSError:
+            pass
+
+    @staticmethod
+    def lock(name: str) -> FileLock:
+        return FileLock(os.path.join(Config.local_cache_root, ".locks", name + ".lock"))
+
+    @staticmethod
+    def source_files(shared_dir: str) -> Dict[str, dict]:
+        """Files of a shared ref module (without .module.json), with hashes from its .manifest.json cache if current."""
+        cached = Manifest.read(shared_dir)
+        files: Dict[str, dict] = {}
+        for root, dirs, names in os.walk(shared_dir):
+            for name in dirs + names:
+                path = os.path.join(root, name)
+                rel = os.path.relpath(path, shared_dir)
+                if rel.startswith(Manifest.NAME) or rel == RefInfo.NAME:
+                    continue
+                if os.path.islink(path):
+                    files[rel] = {"link": os.readlink(path)}
+                elif name in names:
+                    st = os.stat(path)
+                    entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+                    old = cached.get(rel, {})
+                    if old.get("size") == st.st_size and old.get("mtime_ns") == st.st_mtime_ns and "hash" in old:
+                        entry["hash"] = old["hash"]
+                    files[rel] = entry
+                else:
+                    files[rel] = {"dir": True}
+        return files
+
+    @staticmethod
+    def copy_file(src: str, dest: str, expected: dict) -> str:
+        """
+        Copy one file with its mtime, hashing the bytes on the way, and return the hash.
+        Raise ValueError if the size or the manifest hash does not match.
+        """
+        import shutil
+        import hashlib
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        partial = f"{dest}.{os.getpid()}.partial"
+        digest = hashlib.blake2b(digest_size=16)
+        size = 0
+        try:
+            with open(src, "rb") as fin, open(partial, "wb") as fout:
+                while True:
+                    chunk = fin.read(4 << 20)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    fout.write(chunk)
+                    size += len(chunk)
+            if size != expected["size"]:
+                raise ValueError(f"{src}: read {size} bytes, expected {expected['size']}")
+            if "hash" in expected and digest.hexdigest() != expected["hash"]:
+                raise ValueError(f"{src}: hash differs from .manifest.json")
+            shutil.copystat(src, partial)
+            os.replace(partial, dest)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        return digest.hexdigest()
+
+    @staticmethod
+    def entries() -> List[dict]:
+        """Local copies in the cache with their size and last use."""
+        ref_dir = os.path.join(Config.local_cache_root, "ref")
+        rows = []
+        if not os.path.isdir(ref_dir):
+            return rows
+        for assembly in sorted(os.listdir(ref_dir)):
+            for data_type in sorted(os.listdir(os.path.join(ref_dir, assembly))):
+                for version in sorted(os.listdir(os.path.join(ref_dir, assembly, data_type))):
+                    path = os.path.join(ref_dir, assembly, data_type, version)
+                    if not os.path.isdir(path):
+                        continue
+                    last_used = os.path.getmtime(path)
+                    for name in (Stage.MARKER, Stage.LAST_USED):
+                        if os.path.exists(os.path.join(path, name)):
+                            last_used = max(last_used, os.path.getmtime(os.path.join(path, name)))
+                    rows.append({"module": f"{assembly}/{data_type}/{version}", "path": path,
+                                 "size": Usage.disk_usage(path), "last_used": last_used})
+        return rows
 
-        mm_create_path = os.path.join(os.path.abspath(cls.executable_root), "mm-create")
-        with open(mm_create_path, "w", encoding="utf-8") as f:
-            f.write(f"#!/bin/bash\n")
-            f.write(f'"{os.path.abspath(micromamba_path)}" --root-prefix "{os.path.abspath(cls.micromamba_root)}" create -c conda-forge -c bioconda "$@"\n')
-        st = os.stat(mm_create_path)
-        os.chmod(mm_create_path, st.st_mode | stat.S_IEXEC)
+    @staticmethod
+    def remove(module: str, path: str):
+        """Remove a local copy: the marker first, so the modulefile stops using it at once."""
+        import shutil
+        marker = os.path.join(path, Stage.MARKER)
+        if os.path.exists(marker):
+            os.remove(marker)
+        shutil.rmtree(path, ignore_errors=True)
+        Utils.rmdir_until_not_empty(os.path.dirname(path))
 
-        mm_install_path = os.path.join(os.path.abspath(cls.executable_root), "mm-install")
-        with open(mm_install_path, "w", encoding="utf-8") as f:
-            f.write(f"#!/bin/bash\n")
-            f.write(f'"{os.path.abspath(micromamba_path)}" --root-prefix "{os.path.abspath(cls.micromamba_root)}" install -c conda-forge -c bioconda "$@"\n')
-        st = os.stat(mm_install_path)
-        os.chmod(mm_install_path, st.st_mode | stat.S_IEXEC)
-        Utils.print_stderr(f"Micromamba helper script created at {Colorize.blue(cls.executable_root)}/mm")
+    @staticmethod
+    def make_room(need: int, keep: str, quota: Optional[int]) -> bool:
+        """
+        Evict least recently used copies (except keep, and copies in use or being staged) until
+        need more bytes fit in the budget: quota, or else MODULES_LOCAL_CACHE_SIZE, or else the
+        free space of the cache filesystem minus 10%.
+        """
+        import shutil
+        if quota is None and Config.local_cache_size:
+            quota = Utils.parse_size(Config.local_cache_size)
+        with Stage.lock("cache"):
+            rows = [r for r in Stage.entries() if r["module"] != keep]
+            used = sum(r["size"] for r in rows)
+            def fits() -> bool:
+                disk = shutil.disk_usage(Config.local_cache_root)
+                if disk.free - need < disk.total // 10:
+                    return False
+                return quota is None or used + need <= quota
+            now = time.time()
+            for r in sorted(rows, key=lambda r: r["last_used"]):
+                if fits():
+                    break
+                if now - r["last_used"] < Stage.MIN_IDLE:
+                    continue
+                lock = Stage.lock(r["module"])
+                if not lock.acquire(blocking=False):
+                    continue
+                try:
+                    Utils.print_stderr(f"Evicting local copy of {Colorize.yellow(r['module'])} ({r['size'] / 1024**3:.2f} GB)")
+                    Stage.remove(r["module"], r["path"])
+                    used -= r["size"]
+                finally:
+                    lock.release()
+            return fits()
 
-        return micromamba_path
+    @staticmethod
+    def stage_one(module: str, quota: Optional[int]) -> bool:
+        import json
+        import shutil
+        import socket
+        shared_dir = os.path.join(Config.ref_root, module)
+        local_dir = Config.get_local_ref_dir(module)
+        if not os.path.exists(os.path.join(shared_dir, RefInfo.NAME)):
+            Utils.print_stderr(f"❌ {Colorize.red(module)} has no {RefInfo.NAME}. Run {Colorize.yellow(f'./build-scripts/{module} -m')} first.")
+            return False
+        # Blocks while another job on this node stages the same module, then reuses its copy
+        with Stage.lock(module):
+            if Stage.current_copy(module, shared_dir):
+                Stage.touch(local_dir)
+                Utils.print_stderr(f"{Colorize.yellow(module)} is staged in {local_dir}")
+                return True
+            with open(os.path.join(shared_dir, RefInfo.NAME), "r", encoding="utf-8") as f:
+                built = json.load(f).get("files", {})
+            files = Stage.source_files(shared_dir)
+            changed = [rel for rel, size in built.items() if files.get(rel, {}).get("size") != size]
+            if changed:
+                Utils.print_stderr(f"❌ {Colorize.red(module)} changed since it was built (e.g. {changed[0]}). Rebuild it or run {Colorize.yellow(f'./build-scripts/{module} -m')}.")
+                return False
 
-    @classmethod
-    def get_search_command(cls, package: str) -> List[str]:
-        return [
-            cls.get_micromamba_path(), "--root-prefix", os.path.abspath(cls.micromamba_root),
-            "search",
-            "-c", "conda-forge", "-c", "bioconda",
-            package,
-            "--json"
-        ]
+            marker = os.path.join(local_dir, Stage.MARKER)
+            if os.path.exists(marker):
+                os.remove(marker)  # stale copy: update it in place
+            to_copy = []
+            for rel, entry in files.items():
+                if "size" not in entry:
+                    continue
+                try:
+                    st = os.stat(os.path.join(local_dir, rel))
+                except OSError:
+                    to_copy.append(rel)
+                    continue
+                if st.st_size != entry["size"] or st.st_mtime_ns != entry["mtime_ns"]:
+                    to_copy.append(rel)  # copies are written only after verification, so equal size and mtime are trusted
+            need = sum(files[rel]["size"] for rel in to_copy)
+            if not Stage.make_room(need, module, quota):
+                Utils.print_stderr(f"❌ Not enough room in {Config.local_cache_root} for {Colorize.red(module)} ({need / 1024**3:.2f} GB). Jobs use the shared copy.")
+                return False
 
-    @classmethod
-    def get_create_command(cls, package: str, version: str) -> List[str]:
-        return [
-            cls.get_micromamba_path(), "--root-prefix", os.path.abspath(cls.micromamba_root), 
-            "create", "--prefix", os.path.join(cls.apps_root, package, version),
-            "-c", "conda-forge", "-c", "bioconda", 
-            f"{package}={version}", "-q", "-y"
-        ]
+            if os.path.isdir(local_dir):
+                for root, dirs, names in os.walk(local_dir, topdown=False):
+                    for name in names + dirs:
+                        path = os.path.join(root, name)
+                        rel = os.path.relpath(path, local_dir)
+                        if rel in files or rel in (RefInfo.NAME, Stage.LAST_USED):
+                            continue
+                        if os.path.isdir(path) and not os.path.islink(path):
+                            shutil.rmtree(path)
+                        else:
+                            os.remove(path)
+            Utils.print_stderr(f"Staging {Colorize.yellow(module)} to {local_dir}: {len(to_copy)} files, {need / 1024**3:.2f} GB")
+            from concurrent.futures import ThreadPoolExecutor
+            start = time.time()
+            with ThreadPoolExecutor(max_workers=Config.io_threads) as pool:
+                hashes = list(pool.map(lambda rel: Stage.copy_file(os.path.join(shared_dir, rel), os.path.join(local_dir, rel), files[rel]), to_copy))
+            for rel, entry in files.items():
+                path = os.path.join(local_dir, rel)
+                if "link" in entry and not os.path.islink(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.symlink(entry["link"], path)
+                elif "dir" in entry:
+                    os.makedirs(path, exist_ok=True)
 
-class Utils:
-    @staticmethod
-    def print_stderr(message: str):
-        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {message}", file=sys.stderr)
+            # Hashes of the bytes just read, so later stagings (and --sync) can verify against them
+            new_hashes = {rel: digest for rel, digest in zip(to_copy, hashes) if "hash" not in files[rel]}
+            if new_hashes and os.access(shared_dir, os.W_OK):
+                cached = Manifest.read(shared_dir)
+                for rel, digest in new_hashes.items():
+                    cached[rel] = {"size": files[rel]["size"], "mtime_ns": files[rel]["mtime_ns"], "hash": digest}
+                try:
+                    Manifest.write(shared_dir, cached)
+                except OSError:
+                    pass
+
+            Sync.copy_file(os.path.join(shared_dir, RefInfo.NAME), os.path.join(local_dir, RefInfo.NAME))
+            with open(f"{marker}.{os.getpid()}.tmp", "w", encoding="utf-8") as f:
+                json.dump({"module": module, "source": shared_dir, "staged_at": time.strftime('%Y-%m-%d %H:%M:%S'),
+                           "host": socket.gethostname(), "files": sum("size" in e for e in files.values()), "size": sum(e.get("size", 0) for e in files.values())}, f, indent=2)
+            os.replace(f"{marker}.{os.getpid()}.tmp", marker)
+            Stage.touch(local_dir)
+            elapsed = max(time.time() - start, 1e-3)
+            Utils.print_stderr(f"✅ Staged {Colorize.yellow(module)} in {elapsed:.0f}s ({need / 1024**2 / elapsed:.0f} MB/s).")
+            return True
 
     @staticmethod
-    def rmdir_until_not_empty(path: str):
-        """Remove directories up to the first non-empty one."""
-        current_path = path
-        while True:
+    def run(patterns: List[str], quota: Optional[int] = None) -> bool:
+        """Stage the installed ref modules matching patterns to $MODULES_LOCAL_CACHE."""
+        if not Config.local_cache_root:
+            Utils.print_stderr(f"❌ Set {Colorize.yellow('MODULES_LOCAL_CACHE')} to a node-local directory, e.g. /local/$USER/modules-cache")
+            return False
+        os.makedirs(Config.local_cache_root, exist_ok=True)
+        modules = [f"{package}/{version}" for kind, package, version in Bundle.resolve_modules(patterns) if kind == "ref"]
+        if not modules:
+            Utils.print_stderr(f"No installed ref modules match {' '.join(patterns)}.")
+            return False
+        ok = True
+        for module in modules:
             try:
-                os.rmdir(current_path)
-            except OSError:
-                break  # Directory not empty or other error
-            parent_path = os.path.dirname(current_path)
-            if parent_path == current_path:
-                break  # Reached root
-            current_path = parent_path
-    
+                ok = Stage.stage_one(module, quota) and ok
+            except Exception as e:
+                Utils.print_stderr(f"❌ Error staging {Colorize.red(module)}: {e}")
+                ok = False
+        return ok
 
 class Colorize:
     @staticmethod
@@ -310,11 +2861,83 @@ class Package:
         """Return True if package is from pypi"""
         return self.source.lower() == "pypi"
 
+    @staticmethod
+    def fetch_pypi_json(package: str, version: Optional[str] = None) -> dict:
+        """Return the PyPI JSON API document of a project (or of one of its releases)."""
+        import json
+        import urllib.request
+        url = f"https://pypi.org/pypi/{package}/{version}/json" if version else f"https://pypi.org/pypi/{package}/json"
+        with urllib.request.urlopen(url, timeout=30) as resp:
+            return json.load(resp)
+
+    def update_from_pypi(self) -> bool:
+        """Set source, versions (final releases with files), whatis and url from PyPI."""
+        try:
+            data = Package.fetch_pypi_json(self.package)
+        except (OSError, ValueError) as e:
+            Utils.print_stderr(f"Error fetching {Colorize.yellow(self.package)} from PyPI: {e}")
+            return False
+        versions = [v for v, files in data.get("releases", {}).items()
+                    if re.fullmatch(r"[\d.]+(\.post\d+)?", v) and any(not f.get("yanked") for f in files)]
+        if not versions:
+            return False
+        info = data.get("info", {})
+        self.source = "pypi"
+        self.versions = self.version_order(versions)
+        summary = (info.get("summary") or "").split("\n")[0].strip().replace("\t", " ").replace("\"", "").replace("'", "").strip(".")
+        if summary:
+            self.whatis = summary[0].upper() + summary[1:150] + ("..." if len(summary) > 150 else "")
+        urls = info.get("project_urls") or {}
+        self.url = info.get("home_page") or urls.get("Homepage") or urls.get("Source") or info.get("package_url") or ""
+        return True
+
+    @staticmethod
+    def fetch_anaconda_json(channel: str, package: str) -> dict:
+        """Return the Anaconda.org API document of a package in a channel (summary, home, license, files, ...)."""
+        import json
+        import urllib.request
+        url = f"https://api.anaconda.org/package/{channel}/{package}"
+        with Profile.stage("http: anaconda.org"):
+            with urllib.request.urlopen(url, timeout=30) as resp:
+                return json.load(resp)
+
+    def update_from_anaconda(self, versions: bool = True) -> bool:
+        """
+        Set versions (of files for this platform or noarch) and, if whatis is empty, whatis and url
+        from the Anaconda.org API. Returns False if the package cannot be fetched.
+        """
+        try:
+            data = Package.fetch_anaconda_json(self.source, self.package)
+        except (OSError, ValueError) as e:
+            Utils.print_stderr(f"Error fetching {Colorize.yellow(self.package)} from the Anaconda.org API: {e}")
+            return False
+        if versions:
+            subdirs = {Config.get_conda_platform(), "noarch"}
+            # Only the main label, like micromamba search (not broken, dev, rc, ...)
+            found = {f["version"] for f in data.get("files", [])
+                     if "version" in f and "main" in f.get("labels", ["main"])
+                     and (f.get("attrs", {}).get("subdir") or f.get("basename", "").split("/")[0]) in subdirs}
+            if not found:
+                return False
+            self.versions = self.version_order(list(found))
+        if self.whatis == "":
+            summary = (data.get("summary") or "").split("\n")[0].strip().replace("\t", " ").replace("\"", "").replace("'", "").strip(".")
+            if not summary:
+                return versions  # the versions are still good; only update_whatis_url falls back to the page
+            self.whatis = summary[0].upper() + summary[1:150] + ("..." if len(summary) > 150 else "")
+            self.url = (data.get("home") or data.get("dev_url") or data.get("doc_url")
+                        or f"https://anaconda.org/channels/{self.source}/packages/{self.package}/overview").strip()
+        return True
+
     def update_whatis_url(self, n_try: int = 3, delay: int = 2) -> bool:
-        """Fetch whatis and url from Anaconda.org if conda!=NA."""
+        """Fetch whatis and url from Anaconda.org if conda!=NA (API first, then the package page)."""
+        if self.is_pypi():
+            return self.update_from_pypi()
         if not self.is_conda():
             return True  # nothing to do
-        
+        if self.update_from_anaconda(versions=False):
+            return True
+
         try:
             import requests
             from bs4 import BeautifulSoup
@@ -331,7 +2954,8 @@ class Package:
                 Utils.print_stderr(f"Retrying in {delay} seconds...")
                 time.sleep(delay)
             try:
-                resp = requests.get(url_page)
+                with Profile.stage("http: anaconda.org"):
+                    resp = requests.get(url_page)
                 if resp.status_code != 200:
                     Utils.print_stderr(f"Attempt {attempt+1}: Failed to fetch package page for {Colorize.yellow(self.package)} from Anaconda.org (status code {resp.status_code})")
                     continue
@@ -369,6 +2993,11 @@ class Package:
 
     def update_versions(self, force: bool = False):
         """Query micromamba for package versions if source!=NA and store sorted."""
+        import subprocess
+        import json
+        if self.is_pypi():
+            self.update_from_pypi()
+            return
         if not force and not self.is_conda():
             return
 
@@ -404,10 +3033,17 @@ class PackageManager:
     """
     Stores and manages a collection of Package objects.
     """
-    def __init__(self, tsv_path: str):
+    def __init__(self, tsv_path: str, lazy: bool = False):
+        """With lazy, rows are read when get_package first asks for them (internal queries of build scripts)."""
         self.tsv_path = tsv_path
         self.packages: Dict[str, Package] = {}
-        if os.path.exists(tsv_path):
+        self.changed_packages: set = set()  # names updated by this process, merged on save
+        self.removed_packages: set = set()  # names removed by this process, merged on save
+        self.loaded_rows: Dict[str, dict] = {}  # rows as last read or written, to find packages edited in place
+        self.lazy = lazy and os.path.exists(tsv_path)
+        if self.lazy:
+            pass
+        elif os.path.exists(tsv_path):
             self.load_from_tsv()
         else:
             Utils.print_stderr(f"TSV file {tsv_path} not found. Starting with an empty package database.")
@@ -417,16 +3053,28 @@ class PackageManager:
         
     def update_package(self, pkg: Package):
         self.packages[pkg.package] = pkg
+        self.changed_packages.add(pkg.package)
+        self.removed_packages.discard(pkg.package)
+
+    def remove_package(self, package_name: str):
+        self.packages.pop(package_name, None)
+        self.changed_packages.discard(package_name)
+        self.removed_packages.add(package_name)
     
     def get_package(self, package_name: str) -> Optional[Package]:
         """
         Retrieve a package object by name
         """
+        if self.lazy and package_name not in self.packages:
+            with Profile.stage("tsv load"):
+                for name, pkg in self.read_tsv(self.tsv_path, only=package_name).items():
+                    self.packages[name] = pkg
+                    self.loaded_rows[name] = self.package_row(pkg)
         return self.packages.get(package_name, None)
 
-    def add_entry_from_name(self, name: str) -> bool:
+    def add_entry_from_name(self, name: str, pypi: bool = False) -> bool:
         """
-        Create a Package from <package> string, fetch its info, and add to the database.
+        Create a Package from <package> string, fetch its info (from PyPI if pypi is True), and add to the database.
         Returns True if successful, False otherwise.
         """
         if name in self.packages:
@@ -434,6 +3082,13 @@ class PackageManager:
             pkg = self.packages[name]
         else:
             pkg = Package.new_from_string(name)
+        if pypi:
+            Utils.print_stderr(f"Fetching information for package {Colorize.yellow(name)} from PyPI...")
+            if not pkg.update_from_pypi():
+                Utils.print_stderr(f"❌ Package {Colorize.yellow(name)} not found on PyPI.")
+                return False
+            self.update_package(pkg)
+            return True
         Utils.print_stderr(f"Fetching information for package {Colorize.yellow(name)} from Anaconda.org...")
         pkg.update_versions(force=True)
         if pkg.whatis == "":
@@ -450,8 +3105,32 @@ class PackageManager:
         Load packages from a TSV file.
         Expected columns: package, tags (comma-separated), whatis, url, source (channel), optional versions
         """
-        with open(self.tsv_path, "r", encoding="utf-8") as f:
-            reader = csv.DictReader(f, delimiter="\t")
+        with Profile.stage("tsv load"):
+            self.packages = self.read_tsv(self.tsv_path)
+        self.loaded_rows = {name: self.package_row(pkg) for name, pkg in self.packages.items()}
+
+    @staticmethod
+    def package_row(pkg: Package) -> Dict[str, str]:
+        """Return the packages TSV row of a package."""
+        return {
+            "package": pkg.package,
+            "tags": ",".join(pkg.tags),
+            "whatis": pkg.whatis,
+            "url": pkg.url,
+            "source": pkg.source,
+            "versions": ",".join(pkg.versions) if pkg.versions else ""
+        }
+
+    @staticmethod
+    def read_tsv(path: str, only: Optional[str] = None) -> Dict[str, Package]:
+        """
+        Read a packages TSV file into a {package: Package} dict (only the row of package only, if given).
+        """
+        import csv
+        packages: Dict[str, Package] = {}
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f if only is None else [line for i, line in enumerate(f) if i == 0 or line.startswith(only + "\t")]
+            reader = csv.DictReader(lines, delimiter="\t")
             for row in reader:
                 tags = [t.strip() for t in row.get("tags", "").split(",")] if row.get("tags") else []
                 versions = [v.strip() for v in row.get("versions","").split(",")] if row.get("versions") else None
@@ -463,44 +3142,81 @@ class PackageManager:
                     source=row.get("source", "NA")
                 )
                 pkg.versions = versions
-                self.update_package(pkg)
+                packages[pkg.package] = pkg
+        return packages
 
     def save_to_tsv(self, path: str = None):
         """
         Save the current package data back to a TSV file.
         Includes the versions as a comma-separated string in a 'versions' column.
-        Writes to a backup file first, then replaces the original.
+        Holds the database lock, merges the changes of this process into the latest
+        file on disk (other processes may have saved in between), writes a unique
+        temporary file, then atomically replaces the original.
         """
+        import csv
         if path is None:
             path = self.tsv_path
 
-        backup_path = path + ".bak"
         fieldnames = ["package", "tags", "whatis", "url", "source", "versions"]
 
-        # Write to backup first
-        with open(backup_path, "w", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, delimiter="\t", fieldnames=fieldnames)
-            writer.writeheader()
-            for pkg in self.packages.values():
-                writer.writerow({
-                    "package": pkg.package,
-                    "tags": ",".join(pkg.tags),
-                    "whatis": pkg.whatis,
-                    "url": pkg.url,
-                    "source": pkg.source,
-                    "versions": ",".join(pkg.versions) if pkg.versions else ""
-                })
-
-        # Replace the original TSV with backup
-        shutil.move(backup_path, path)
+        with Profile.stage("tsv save"), FileLock(Config.get_db_lock_path(path)):
+            mode = 0o664
+            if os.path.exists(path):
+                mode = stat.S_IMODE(os.stat(path).st_mode)
+                merged = self.read_tsv(path)
+                # Packages edited in place (e.g. by -U) count as changed too, not only those passed to update_package
+                changed = self.changed_packages | {name for name, pkg in self.packages.items()
+                                                   if self.loaded_rows.get(name) != self.package_row(pkg)}
+                for name in changed:
+                    merged[name] = self.packages[name]
+                for name in self.removed_packages:
+                    merged.pop(name, None)
+                if self.lazy:
+                    # Only some rows were read: keep the order on disk, new entries at the end
+                    self.packages = merged
+                    self.lazy = False
+                else:
+                    # Keep the order of this process (e.g. after sort_packages), new entries from disk at the end
+                    ordered = {name: merged[name] for name in self.packages if name in merged}
+                    ordered.update(merged)
+                    self.packages = ordered
+
+            # Write to a unique temporary file in the same directory first
+            import tempfile
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", newline="", encoding="utf-8") as f:
+                    writer = csv.DictWriter(f, delimiter="\t", fieldnames=fieldnames)
+                    writer.writeheader()
+                    for pkg in self.packages.values():
+                        writer.writerow(self.package_row(pkg))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.chmod(tmp_path, mode)
+                # Replace the original TSV atomically
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            self.changed_packages.clear()
+            self.removed_packages.clear()
+            self.loaded_rows = {name: self.package_row(pkg) for name, pkg in self.packages.items()}
 
     def fetch_all_online_versions(self):
         """
-        Call add_versions() on all packages in the database.
+        Fetch versions (and missing whatis/url) of all conda and PyPI packages in the database from
+        the Anaconda.org and PyPI JSON APIs, Config.download_threads at a time. Conda packages the API
+        fails for fall back to micromamba search and the package page, one by one.
         """
-        for pkg in self.packages.values():
-            if not pkg.is_local():
-                Utils.print_stderr(f"Fetching versions for {Colorize.yellow(pkg.package)}...")
+        from concurrent.futures import ThreadPoolExecutor
+        pkgs = [pkg for pkg in self.packages.values() if pkg.is_pypi() or pkg.is_conda()]
+        Utils.print_stderr(f"Fetching versions of {len(pkgs)} packages...")
+        with ThreadPoolExecutor(max_workers=Config.download_threads) as pool:
+            results = list(pool.map(lambda pkg: pkg.update_from_pypi() if pkg.is_pypi() else pkg.update_from_anaconda(), pkgs))
+        for pkg, ok in zip(pkgs, results):
+            if not ok and pkg.is_conda():
+                Utils.print_stderr(f"Fetching versions for {Colorize.yellow(pkg.package)} with micromamba...")
                 pkg.update_versions()
                 if pkg.whatis == "":
                     pkg.update_whatis_url()
@@ -540,7 +3256,7 @@ class PackageManager:
                 assembly_data_version = []
                 for assembly_data in versions:
                     data_version = os.listdir(os.path.join(script_relative_path, assembly_data))
-                    data_version = [v for v in data_version if not v.startswith("template")]
+                    data_version = [v for v in data_version if not (v.startswith("template") or v.endswith("_data"))]
                     for dv in data_version:
                         assembly_data_version.append(f"{assembly_data}/{dv}")
                 if len(assembly_data_version) == 0:
@@ -578,12 +3294,16 @@ class PackageManager:
         existing_local_packages = set(self.get_local_package_names())
         for pkg_name in existing_local_packages - updated_packages:
             Utils.print_stderr(f"Removing local package {Colorize.yellow(pkg_name)} from database as it is no longer present in build-scripts.")
-            del self.packages[pkg_name]
+            self.remove_package(pkg_name)
 
-    def install_conda(self, package_name: str, version: str) -> bool:
+    def install_conda(self, package_name: str, version: str, use_lock: bool = True, offline: bool = False) -> bool:
         """
         Install the package at the specified version using micromamba.
+        If a lockfile was recorded by a previous install (and use_lock is True), the environment
+        is created from it without solving; otherwise the solved environment is recorded as lockfile.
+        If offline is True, the lockfile and packages written by --prefetch are used without network.
         """
+        import subprocess
         pkg = self.get_package(package_name)
         if pkg is None:
             Utils.print_stderr(f"❌ Package {Colorize.yellow(package_name)} not found in database.")
@@ -592,18 +3312,56 @@ class PackageManager:
             Utils.print_stderr(f"❌ Version {Colorize.yellow(version)} of package {Colorize.yellow(package_name)} not found in database.")
             return False
     
-        Utils.print_stderr(f"Installing {Colorize.yellow(package_name)}/{Colorize.yellow(version)} via micromamba...")
-        cmd = Config.get_create_command(package_name, version)
+        lock_path = Config.get_conda_lock_path(package_name, version)
+        from_lock = use_lock and os.path.exists(lock_path)
+        if offline:
+            if not from_lock:
+                Utils.print_stderr(f"❌ No lockfile for {Colorize.yellow(package_name)}/{Colorize.yellow(version)} to install offline.")
+                Utils.print_stderr(f"Run {Colorize.yellow(f'./manager.py --prefetch {package_name}/{version}')} on a node with network first.")
+                return False
+            missing = self.uncached_conda_packages(self.read_conda_lock(lock_path))
+            if missing:
+                Utils.print_stderr(f"❌ {len(missing)} packages of {Colorize.yellow(package_name)}/{Colorize.yellow(version)} are not in {Config.get_conda_pkgs_dir()}, e.g. {missing[0][0]}")
+                Utils.print_stderr(f"Run {Colorize.yellow(f'./manager.py --prefetch {package_name}/{version}')} on a node with network first.")
+                return False
 
         try:
+            if offline:
+                Utils.print_stderr(f"Installing {Colorize.yellow(package_name)}/{Colorize.yellow(version)} offline from lockfile {lock_path} and the package cache...")
+                cmd = Config.get_create_from_lock_command(package_name, version, lock_path, offline=True)
+            elif from_lock:
+                Utils.print_stderr(f"Installing {Colorize.yellow(package_name)}/{Colorize.yellow(version)} from lockfile {lock_path} (no solve)...")
+                self.prefetch_conda_packages(self.read_conda_lock(lock_path))
+                cmd = Config.get_create_from_lock_command(package_name, version, lock_path)
+            else:
+                Utils.print_stderr(f"Installing {Colorize.yellow(package_name)}/{Colorize.yellow(version)} via micromamba...")
+                cmd = Config.get_create_command(package_name, version)
             subprocess.run(cmd, check=True)
             Utils.print_stderr(f"✅ Package {Colorize.yellow(package_name)} version {Colorize.yellow(version)} installed successfully via micromamba.")
+            if not from_lock:
+                self.write_conda_lock(package_name, version)
+
+            self.write_app_modulefile(pkg, version)
+            return True
+        except subprocess.CalledProcessError as e:
+            Utils.print_stderr(f"❌ Error installing {package_name} version {version} via micromamba: {e.stderr}")
+            return False
+        except (OSError, ValueError) as e:
+            Utils.print_stderr(f"❌ Error fetching packages for {package_name} version {version}: {e}")
+            return False
 
+    def write_app_modulefile(self, pkg: Package, version: str, dependencies: Optional[List[str]] = None):
+        """
+        Write apps_modulefiles/<package>/<version>[.lua] from apps-template[.lua], filling in
+        whatis and help. dependencies (e.g. python/3.11.14 of a venv) are recorded as
+        "Dependency:" comments, so --evict keeps them, without loading them.
+        """
+        with Profile.stage("modulefile write"):
             template_path = os.path.join(Config.build_scripts_root, "apps-template")
             template_lua_path = template_path + ".lua"
 
             # Cat module files to modulefiles/<package>/<version>
-            modulefile_dir = os.path.join(Config.apps_modulefiles_root, package_name)
+            modulefile_dir = os.path.join(Config.apps_modulefiles_root, pkg.package)
             os.makedirs(modulefile_dir, exist_ok=True)
             modulefile_path = os.path.join(modulefile_dir, version)
             modulefile_lua_path = modulefile_path + ".lua"
@@ -617,6 +3375,8 @@ class PackageManager:
                 help_text = f"WEBSITE: {pkg.url}" if pkg.url else "No additional information available."
                 template_content = template_content.replace("${HELP}", help_text)
                 f_out.write(template_content)
+                for dep in dependencies or []:
+                    f_out.write(f"# Dependency: {dep}\n")
             with open(template_lua_path, "r", encoding="utf-8") as f_in, \
                     open(modulefile_lua_path, "w", encoding="utf-8") as f_out:
                 template_content = f_in.read()
@@ -626,12 +3386,372 @@ class PackageManager:
                 help_text = f"WEBSITE: {pkg.url}" if pkg.url else "No additional information available."
                 template_content = template_content.replace("${HELP}", help_text)
                 f_out.write(template_content)
+                for dep in dependencies or []:
+                    f_out.write(f"-- Dependency: {dep}\n")
 
             Utils.print_stderr(f"📜 Module files created at {modulefile_path} and {modulefile_lua_path}")
+
+    def find_python(self, requires_python: Optional[str] = None, preferred: Optional[str] = None) -> Optional[str]:
+        """
+        Return the version of the newest installed python/<version> module that satisfies
+        requires_python (preferred, e.g. from a lockfile or MODULES_PYPI_PYTHON, if installed).
+        """
+        installed = [v for kind, package, v in Utils.list_installed_modules()
+                     if kind == "apps" and package == "python" and os.path.exists(os.path.join(Config.apps_root, "python", v, "bin", "python3"))]
+        preferred = preferred or os.environ.get("MODULES_PYPI_PYTHON")
+        if preferred:
+            matched = [v for v in installed if v == preferred or v.startswith(preferred + ".")]
+            if matched:
+                return Package.version_order(matched)[0]
+        for v in Package.version_order(installed):
+            if Utils.version_matches(v, requires_python):
+                return v
+        return None
+
+    def prefetch_wheels(self, venv_python: str, requirements: List[str]) -> List[str]:
+        """
+        Resolve requirements with pip (--dry-run --report, metadata only) and download the
+        distributions into the shared wheel cache in parallel, verifying their sha256.
+        Return the pinned name==version list, or [] if this pip cannot report.
+        """
+        import subprocess
+        import json
+        from concurrent.futures import ThreadPoolExecutor
+        wheel_dir = Config.get_wheel_cache_dir()
+        os.makedirs(wheel_dir, exist_ok=True)
+        report_path = os.path.join(wheel_dir, f".report.{os.getpid()}.json")
+        try:
+            subprocess.run([venv_python, "-m", "pip", "install", "--dry-run", "--ignore-installed", "--quiet",
+                            "--report", report_path] + requirements, check=True)
+            with open(report_path, "r", encoding="utf-8") as f:
+                report = json.load(f)
+        except (subprocess.CalledProcessError, OSError, ValueError):
+            return []
+        finally:
+            if os.path.exists(report_path):
+                os.remove(report_path)
+
+        pinned, missing = [], []
+        for item in report.get("install", []):
+            meta = item.get("metadata", {})
+            pinned.append(f"{meta.get('name')}=={meta.get('version')}")
+            info = item.get("download_info", {})
+            url = info.get("url", "")
+            dest = os.path.join(wheel_dir, url.rsplit("/", 1)[-1])
+            if url.startswith("http") and not os.path.exists(dest):
+                missing.append((url, dest, info.get("archive_info", {}).get("hashes", {}).get("sha256")))
+        if missing:
+            Utils.print_stderr(f"Downloading {len(missing)} of {len(pinned)} distributions with {Config.download_threads} threads...")
+            with ThreadPoolExecutor(max_workers=Config.download_threads) as pool:
+                futures = [pool.submit(Utils.download, url, dest, sha256=sha256) for url, dest, sha256 in missing]
+                for future in futures:
+                    future.result()  # re-raise download errors
+        return pinned
+
+    def install_pypi(self, package_name: str, version: str, use_lock: bool = True) -> bool:
+        """
+        Install a PyPI package into a venv at apps/<package>/<version> on top of an installed
+        python/<version> module. uv is used if available (shared cache in .cache/uv, files
+        hardlinked into the venv), else pip with wheels downloaded in parallel to .cache/wheels.
+        Like install_conda, a recorded lockfile (pinned requirements) is reused if use_lock is True.
+        """
+        import subprocess
+        import shutil
+        pkg = self.get_package(package_name)
+        if pkg is None:
+            Utils.print_stderr(f"❌ Package {Colorize.yellow(package_name)} not found in database.")
+            return False
+        if pkg.versions is None or version not in pkg.versions:
+            Utils.print_stderr(f"❌ Version {Colorize.yellow(version)} of package {Colorize.yellow(package_name)} not found in database.")
+            return False
+
+        prefix = os.path.join(Config.apps_root, package_name, version)
+        venv_python = os.path.join(prefix, "bin", "python")
+        lock_path = Config.get_pypi_lock_path(package_name, version)
+        from_lock = use_lock and os.path.exists(lock_path)
+        try:
+            locked_python = None
+            if from_lock:
+                with open(lock_path, "r", encoding="utf-8") as f:
+                    match = re.search(r"^# python: (\S+)", f.read(), re.MULTILINE)
+                    locked_python = match.group(1) if match else None
+                requires_python = None
+                requirements = ["--no-deps", "-r", lock_path]
+            else:
+                requires_python = Package.fetch_pypi_json(package_name, version).get("info", {}).get("requires_python")
+                requirements = [f"{package_name}=={version}"]
+            python_version = self.find_python(requires_python, locked_python)
+            if python_version is None:
+                Utils.print_stderr(f"❌ No installed python module satisfies {Colorize.yellow(requires_python or 'any')} for {Colorize.yellow(package_name)}/{Colorize.yellow(version)}.")
+                Utils.print_stderr(f"Install one first, e.g. {Colorize.yellow('./manager.py -i python/3.12')}")
+                return False
+            python = os.path.join(Config.apps_root, "python", python_version, "bin", "python3")
+
+            uv = shutil.which("uv")
+            Utils.print_stderr(f"Installing {Colorize.yellow(package_name)}/{Colorize.yellow(version)} into a venv on python/{python_version} with {'uv' if uv else 'pip'}"
+                               + (f" from lockfile {lock_path}" if from_lock else "") + "...")
+            if uv:
+                env = dict(os.environ, UV_CACHE_DIR=os.path.join(Config.cache_root, "uv"), UV_LINK_MODE="hardlink",
+                           UV_CONCURRENT_DOWNLOADS=str(Config.download_threads), UV_PYTHON_DOWNLOADS="never")
+                subprocess.run([uv, "venv", "--quiet", "--python", python, prefix], check=True, env=env)
+                subprocess.run([uv, "pip", "install", "--quiet", "--python", venv_python] + requirements, check=True, env=env)
+                freeze = subprocess.run([uv, "pip", "freeze", "--python", venv_python], capture_output=True, text=True, check=True, env=env).stdout
+            else:
+                subprocess.run([python, "-m", "venv", prefix], check=True)
+                pinned = self.prefetch_wheels(venv_python, requirements)
+                offline = ["--no-index", "--find-links", Config.get_wheel_cache_dir()]
+                if not pinned or subprocess.run([venv_python, "-m", "pip", "install", "--quiet", "--no-deps"] + offline + pinned).returncode != 0:
+                    subprocess.run([venv_python, "-m", "pip", "install", "--quiet", "--find-links", Config.get_wheel_cache_dir()] + requirements, check=True)
+                freeze = subprocess.run([venv_python, "-m", "pip", "freeze"], capture_output=True, text=True, check=True).stdout
+            Utils.print_stderr(f"✅ Package {Colorize.yellow(package_name)} version {Colorize.yellow(version)} installed successfully from PyPI.")
+
+            if not from_lock:
+                os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+                tmp_path = lock_path + f".{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(f"# Lockfile of {package_name}/{version} written by manager.py on {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+                    f.write(f"# python: {python_version}\n")
+                    f.write(freeze)
+                os.replace(tmp_path, lock_path)
+                Utils.print_stderr(f"🔒 Lockfile written to {lock_path}")
+
+            self.write_app_modulefile(pkg, version, dependencies=[f"python/{python_version}"])
             return True
         except subprocess.CalledProcessError as e:
-            Utils.print_stderr(f"❌ Error installing {package_name} version {version} via micromamba: {e.stderr}")
+            Utils.print_stderr(f"❌ Error installing {package_name} version {version} from PyPI: {e}")
+            return False
+        except (OSError, ValueError) as e:
+            Utils.print_stderr(f"❌ Error fetching packages for {package_name} version {version}: {e}")
+            return False
+
+    def write_conda_lock(self, package_name: str, version: str, solved: Optional[List[dict]] = None) -> Optional[str]:
+        """
+        Record the exact packages of apps/<package>/<version> as an explicit lockfile
+        (URL#md5 per package, dependencies first), read from the prefix's conda-meta,
+        or from solved (package records of a dry-run solve) before the prefix exists.
+        """
+        import json
+        records = {}
+        if solved is not None:
+            records = {record["name"]: record for record in solved if record.get("url") and record.get("name")}
+        else:
+            meta_dir = os.path.join(Config.apps_root, package_name, version, "conda-meta")
+            if not os.path.isdir(meta_dir):
+                return None
+            for name in os.listdir(meta_dir):
+                if name.endswith(".json"):
+                    with open(os.path.join(meta_dir, name), "r", encoding="utf-8") as f:
+                        record = json.load(f)
+                    if record.get("url") and record.get("name"):
+                        records[record["name"]] = record
+
+        ordered: List[dict] = []
+        visited = set()
+        def visit(name: str):
+            if name in visited or name not in records:
+                return
+            visited.add(name)
+            for dep in records[name].get("depends", []):
+                visit(dep.split()[0])
+            ordered.append(records[name])
+        for name in sorted(records):
+            visit(name)
+
+        lock_path = Config.get_conda_lock_path(package_name, version)
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        lines = [
+            f"# Lockfile of {package_name}/{version} written by manager.py on {time.strftime('%Y-%m-%d %H:%M:%S')}",
+            f"# platform: {Config.get_conda_platform()}",
+            "@EXPLICIT",
+        ]
+        lines += [f"{r['url']}#{r['md5']}" if r.get("md5") else r["url"] for r in ordered]
+        tmp_path = lock_path + f".{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, lock_path)
+        Utils.print_stderr(f"🔒 Lockfile written to {lock_path}")
+        return lock_path
+
+    @staticmethod
+    def read_conda_lock(lock_path: str) -> List[tuple[str, Optional[str]]]:
+        """
+        Return (url, md5) entries of an explicit lockfile.
+        """
+        entries = []
+        with open(lock_path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#") or line.startswith("@"):
+                    continue
+                url, _, md5 = line.partition("#")
+                entries.append((url, md5 or None))
+        return entries
+
+    @staticmethod
+    def uncached_conda_packages(entries: List[tuple[str, Optional[str]]]) -> List[tuple[str, Optional[str]]]:
+        """Entries of a lockfile that are in the package cache neither as tarball nor extracted."""
+        pkgs_dir = Config.get_conda_pkgs_dir()
+        def is_cached(filename: str) -> bool:
+            extracted = filename.removesuffix(".conda").removesuffix(".tar.bz2")
+            return os.path.exists(os.path.join(pkgs_dir, filename)) or \
+                os.path.exists(os.path.join(pkgs_dir, extracted, "info", "repodata_record.json"))
+        return [(url, md5) for url, md5 in entries if not is_cached(url.rsplit("/", 1)[-1])]
+
+    def prefetch_conda_packages(self, entries: List[tuple[str, Optional[str]]]) -> int:
+        """
+        Download package tarballs into the shared micromamba package cache in parallel,
+        skipping packages already cached (as tarball or extracted). Return the number downloaded.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        pkgs_dir = Config.get_conda_pkgs_dir()
+        os.makedirs(pkgs_dir, exist_ok=True)
+
+        missing = self.uncached_conda_packages(entries)
+        if not missing:
+            return 0
+        Utils.print_stderr(f"Downloading {len(missing)} of {len(entries)} packages with {Config.download_threads} threads...")
+        with ThreadPoolExecutor(max_workers=Config.download_threads) as pool:
+            futures = [pool.submit(Utils.download, url, os.path.join(pkgs_dir, url.rsplit("/", 1)[-1]), md5) for url, md5 in missing]
+            for future in futures:
+                future.result()  # re-raise download errors
+        return len(missing)
+
+    def expand_targets(self, targets: List[str]) -> List[tuple[str, str]]:
+        """
+        (package, version) of targets (<package>[/<version>] or files listing one target per line)
+        and everything they depend on through the #DEPENDENCY: lines of local build scripts.
+        Installed modules and their dependencies are skipped.
+        """
+        queue = []
+        for target in targets:
+            if os.path.isfile(target):
+                with open(target, "r", encoding="utf-8") as f:
+                    queue += [line.split("#", 1)[0].strip() for line in f if line.split("#", 1)[0].strip()]
+            else:
+                queue.append(target)
+        found: List[tuple[str, str]] = []
+        seen = set()
+        while queue:
+            package_name, version = self.get_package_version(queue.pop(0))
+            if (package_name, version) in seen:
+                continue
+            seen.add((package_name, version))
+            pkg = self.get_package(package_name)
+            modulefiles_root = Config.ref_modulefiles_root if pkg.is_ref() else Config.apps_modulefiles_root
+            if os.path.exists(os.path.join(modulefiles_root, package_name, version)):
+                continue
+            found.append((package_name, version))
+            if pkg.is_local():
+                queue += [f"{dep}/{dep_version}" if dep_version else dep for dep, dep_version in self.get_local_dependencies(package_name, version)]
+        return found
+
+    def prefetch(self, targets: List[str], use_lock: bool = True) -> bool:
+        """
+        Download every conda package of targets into the shared package cache, for installs with
+        --offline on nodes without network. Targets without a lockfile are solved (dry run) and
+        their lockfile is written; then all packages are downloaded concurrently.
+        """
+        import subprocess
+        import json
+        try:
+            found = [(package_name, version) for package_name, version in self.expand_targets(targets) if self.get_package(package_name).is_conda()]
+        except (OSError, ValueError) as e:
+            Utils.print_stderr(f"❌ Error resolving targets: {e}")
+            return False
+        if not found:
+            Utils.print_stderr("Nothing to prefetch: no conda packages that are not installed.")
+            return True
+
+        entries: Dict[str, Optional[str]] = {}
+        failed = []
+        for package_name, version in found:
+            lock_path = Config.get_conda_lock_path(package_name, version)
+            if not use_lock or not os.path.exists(lock_path):
+                Utils.print_stderr(f"Solving {Colorize.yellow(package_name)}/{Colorize.yellow(version)}...")
+                try:
+                    result = subprocess.run(Config.get_solve_command(package_name, version), capture_output=True, text=True, check=True)
+                    solved = json.loads(result.stdout).get("actions", {}).get("LINK", [])
+                except (subprocess.CalledProcessError, ValueError) as e:
+                    Utils.print_stderr(f"❌ Could not solve {Colorize.yellow(package_name)}/{Colorize.yellow(version)}: {getattr(e, 'stderr', '') or e}")
+                    failed.append(f"{package_name}/{version}")
+                    continue
+                self.write_conda_lock(package_name, version, solved=solved)
+            for url, md5 in self.read_conda_lock(lock_path):
+                entries[url] = md5
+
+        try:
+            downloaded = self.prefetch_conda_packages(list(entries.items()))
+        except (OSError, ValueError) as e:
+            Utils.print_stderr(f"❌ Error downloading packages: {e}")
+            return False
+        Utils.print_stderr(f"✅ {len(found) - len(failed)} conda modules ready for --offline: {len(entries)} packages, {downloaded} downloaded, {len(entries) - downloaded} already cached.")
+        for target in failed:
+            Utils.print_stderr(f"❌ {Colorize.red(target)} was not prefetched.")
+        return not failed
+
+    def get_local_inputs(self, package_name: str, version: str) -> List[tuple[str, str, Optional[str]]]:
+        """
+        Parse the #INPUT:<name> <url> [sha256:<hex>] lines of a local build script.
+        Returns a list of (name, url, sha256) tuples.
+        """
+        inputs = []
+        script_path = os.path.join(Config.build_scripts_root, package_name, version)
+        with open(script_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("#INPUT:"):
+                    fields = line[len("#INPUT:"):].split()
+                    if len(fields) < 2 or "/" in fields[0]:
+                        raise ValueError(f"Invalid input line in {script_path}: {line.strip()}")
+                    sha256 = fields[2].removeprefix("sha256:") if len(fields) > 2 else None
+                    inputs.append((fields[0], fields[1], sha256))
+        return inputs
+
+    def fetch_only(self, targets: List[str], use_lock: bool = True) -> bool:
+        """
+        Download everything targets and their dependencies need to be built without network:
+        the #INPUT: files of local build scripts into .cache/inputs/<module>/ (all at once,
+        Config.download_threads at a time) and the conda packages (see prefetch).
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        try:
+            found = self.expand_targets(targets)
+            jobs = []
+            for package_name, version in found:
+                if not self.get_package(package_name).is_local():
+                    continue
+                inputs_dir = Config.get_inputs_dir(package_name, version)
+                for name, url, sha256 in self.get_local_inputs(package_name, version):
+                    if not os.path.exists(os.path.join(inputs_dir, name)):
+                        jobs.append((f"{package_name}/{version}", url, os.path.join(inputs_dir, name), sha256))
+        except (OSError, ValueError) as e:
+            Utils.print_stderr(f"❌ Error resolving targets: {e}")
+            return False
+
+        failed = []
+        if jobs:
+            Utils.print_stderr(f"Downloading {len(jobs)} inputs of {len({module for module, _, _, _ in jobs})} modules with {Config.download_threads} threads...")
+            def fetch(job: tuple):
+                module, url, dest, sha256 = job
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                Utils.download(url, dest, sha256=sha256)
+                Utils.print_stderr(f"Fetched {Colorize.yellow(module)}: {os.path.basename(dest)}")
+            with ThreadPoolExecutor(max_workers=Config.download_threads) as pool:
+                for job, future in zip(jobs, [pool.submit(fetch, job) for job in jobs]):
+                    try:
+                        future.result()
+                    except (OSError, ValueError) as e:
+                        Utils.print_stderr(f"❌ {Colorize.red(job[0])}: cannot fetch {job[1]}: {e}")
+                        failed.append(job)
+        else:
+            Utils.print_stderr("All inputs of local build scripts are already fetched.")
+
+        if any(self.get_package(package_name).is_conda() for package_name, _ in found):
+            if not self.prefetch(targets, use_lock=use_lock):
+                return False
+        if failed:
             return False
+        Utils.print_stderr(f"✅ {len(found)} modules can be installed with {Colorize.yellow('-i ... --offline')}.")
+        return True
 
     def get_local_dependencies(self, package_name: str, version: str) -> List[tuple[str, Optional[str]]]:
         """
@@ -651,10 +3771,12 @@ class PackageManager:
                 dependencies.append((dep_name, dep_version))
         return dependencies
 
-    def install_local(self, package_name: str, version: str) -> bool:
+    def install_local(self, package_name: str, version: str, resume: bool = False, use_lock: bool = True, offline: bool = False) -> bool:
         """
         Install the package from local build-scripts.
+        If resume is True, completed phases of an interrupted build are skipped.
         """
+        import subprocess
         script_path = os.path.join(Config.build_scripts_root, package_name, version)
         if not os.path.exists(script_path):
             Utils.print_stderr(f"Local build script for {Colorize.yellow(package_name)}/{Colorize.yellow(version)} not found.")
@@ -670,13 +3792,17 @@ class PackageManager:
 
         for dep_name, dep_version in dependencies:
             Utils.print_stderr(f"Installing dependency {Colorize.yellow(dep_name)}/{Colorize.yellow(dep_version if dep_version else 'latest')} for {Colorize.yellow(package_name)}/{Colorize.yellow(version)}...")
-            success = self.install_package(dep_name, dep_version, yes=True)
+            success = self.install_package(dep_name, dep_version, yes=True, resume=resume, use_lock=use_lock, offline=offline)
             if not success:
                 Utils.print_stderr(f"❌ Failed to install dependency {Colorize.yellow(dep_name)}/{Colorize.yellow(dep_version if dep_version else 'latest')} for {Colorize.yellow(package_name)}/{Colorize.yellow(version)}.")
                 return False
 
-        subprocess_cmd = ["bash", script_path, "-i"]
-        exit_code = subprocess.call(subprocess_cmd)
+        subprocess_cmd = ["bash", script_path, "-r" if resume else "-i"]
+        # The install lock is already held by this process, tell common.sh not to take it again
+        env = dict(os.environ, MODULES_LOCK_HELD=f"{package_name}/{version}")
+        if offline:
+            env["MODULES_OFFLINE"] = "1"  # fetch_input only uses inputs fetched by --fetch-only
+        exit_code = subprocess.call(subprocess_cmd, env=env)
         if exit_code == 0:
             Utils.print_stderr(f"✅ Package {package_name} version {version} installed successfully from local build script.")
             return True
@@ -684,9 +3810,12 @@ class PackageManager:
             Utils.print_stderr(f"❌ Error installing {package_name} version {version} from local build script.")
             return False
 
-    def install_package(self, package_name: str, version: Optional[str], yes: bool = False) -> bool:
+    def install_package(self, package_name: str, version: Optional[str], yes: bool = False, resume: bool = False, use_lock: bool = True, offline: bool = False) -> bool:
         """
-        Install the package at the specified version using micromamba.
+        Install the package at the specified version using micromamba or the local build script.
+        If resume is True, an interrupted local build continues from its completed phases.
+        If use_lock is False, conda packages are solved again instead of installed from their lockfile.
+        If offline is True, conda packages are installed from the lockfiles and package cache filled by --prefetch.
         """
         pkg = self.get_package(package_name)
         if pkg is None or pkg.versions is None:
@@ -717,31 +3846,86 @@ class PackageManager:
                 else:
                     Utils.print_stderr(f"❌ No versions found matching prefix {Colorize.yellow(prefix)}* for package {Colorize.yellow(package_name)}.")
                     return False
-    
-        if os.path.exists(os.path.join(Config.apps_root, package_name, version)):
-            Utils.print_stderr(f"Package {Colorize.yellow(package_name)}/{Colorize.yellow(version)} is already installed.")
-            return True
-        
+
         if not yes:
             ready = input(f"Are you sure you want to install {Colorize.yellow(package_name)}/{Colorize.yellow(version)}? [Y/n]: ")
             if ready.lower() == 'n':
                 Utils.print_stderr("Installation cancelled by user.")
                 return False
 
-        if pkg.is_local():
-            result = self.install_local(package_name, version)
-        elif pkg.is_conda():
-            result = self.install_conda(package_name, version)
-        else:
+        if not pkg.is_local() and not pkg.is_conda() and not pkg.is_pypi():
             Utils.print_stderr(f"❌ Unknown package type for {Colorize.yellow(package_name)}.")
             return False
 
-        if not result:
-            self.delete(package_name, version)
-            return False
+        lock = self.acquire_install_lock(package_name, version)
+        try:
+            if os.path.exists(modulefile_path):
+                # Another process finished the same installation while we were waiting
+                Utils.print_stderr(f"🔗 {Colorize.yellow(package_name)}/{Colorize.yellow(version)} was installed by another process.")
+                return True
+            # Decided under the lock: before it, the target and checkpoints may belong to a running install
+            if self.has_checkpoints(package_name, version):
+                if not resume:
+                    Utils.print_stderr(f"❌ {Colorize.yellow(package_name)}/{Colorize.yellow(version)} has an interrupted build.")
+                    Utils.print_stderr(f"Rerun with {Colorize.yellow('--resume')} to continue it, or {Colorize.yellow('-d')} to remove it.")
+                    return False
+            elif os.path.exists(os.path.join(Config.ref_root if pkg.is_ref() else Config.apps_root, package_name, version)):
+                # No modulefile and nobody installing it: the remains of a failed install
+                Utils.print_stderr(f"⚠️ Removing an incomplete install of {Colorize.yellow(package_name)}/{Colorize.yellow(version)}.")
+                self.delete(package_name, version)
+
+            try:
+                if pkg.is_local():
+                    result = self.install_local(package_name, version, resume=resume, use_lock=use_lock, offline=offline)
+                elif pkg.is_pypi():
+                    started = time.time()
+                    result = self.install_pypi(package_name, version, use_lock=use_lock)
+                else:
+                    started = time.time()
+                    result = self.install_conda(package_name, version, use_lock=use_lock, offline=offline)
+                if result and not pkg.is_local():
+                    self.record_install_stats(package_name, version, "pypi" if pkg.is_pypi() else "conda", time.time() - started)
+            except BaseException:
+                # Clean up while still holding the lock, so we never remove another process's installation
+                self.cleanup_failed_install(package_name, version)
+                raise
+
+            if not result:
+                self.cleanup_failed_install(package_name, version)
+                return False
+        finally:
+            lock.release()
         
         return True
 
+    def has_checkpoints(self, package_name: str, version: str) -> bool:
+        """
+        Return True if an interrupted local build left completed phases behind.
+        """
+        checkpoint_dir = Config.get_checkpoint_dir(package_name, version)
+        return os.path.isdir(checkpoint_dir) and any(f.endswith(".done") for f in os.listdir(checkpoint_dir))
+
+    def cleanup_failed_install(self, package_name: str, version: str):
+        """
+        Remove a failed installation, unless it has completed phases that can be resumed.
+        """
+        if self.has_checkpoints(package_name, version):
+            Utils.print_stderr(f"Keeping completed phases of {Colorize.yellow(package_name)}/{Colorize.yellow(version)}.")
+            Utils.print_stderr(f"Resume with {Colorize.yellow(f'./manager.py -i {package_name}/{version} --resume')}")
+            return
+        self.delete(package_name, version)
+
+    def acquire_install_lock(self, package_name: str, version: str) -> FileLock:
+        """
+        Acquire the per-module install lock. If another process is installing the
+        same module, wait for it to finish (the caller then joins its result).
+        """
+        lock = FileLock(Config.get_install_lock_path(package_name, version))
+        if not lock.acquire(blocking=False):
+            Utils.print_stderr(f"⏳ {Colorize.yellow(package_name)}/{Colorize.yellow(version)} is being installed by another process ({lock.holder()}). Waiting...")
+            lock.acquire()
+        return lock
+
     def delete(self, package_name: str, version: str) -> bool:
         """
         Remove the installed package at the specified version.
@@ -767,8 +3951,8 @@ class PackageManager:
         modulefile_lua_path = modulefile_path + ".lua"
         try:
             Utils.print_stderr(f"Removing {Colorize.yellow(package_name)}/{Colorize.yellow(version)}...")
-            if os.path.exists(install_path):
-                shutil.rmtree(install_path)
+            # The rename into the trash is instant; the files are removed in the background
+            Trash.remove(install_path, f"{package_name}/{version}")
             Utils.rmdir_until_not_empty(os.path.dirname(install_path))
 
             if os.path.exists(modulefile_path):
@@ -777,9 +3961,15 @@ class PackageManager:
                 os.remove(modulefile_lua_path)
             Utils.rmdir_until_not_empty(modulefile_package_path)
 
+            # Temporary directory and phase markers of an interrupted build
+            tmp_path = os.path.join(Config.tmp_root, package_name, version)
+            if os.path.exists(tmp_path):
+                Trash.remove(tmp_path, f"tmp/{package_name}/{version}")
+                Utils.rmdir_until_not_empty(os.path.dirname(tmp_path))
+
             return True
         except Exception as e:
-            Utils.print_stderr(f"❌ Error cleaning package {Colorize.yellow(self.package)}/{Colorize.yellow(version)}: {e}")
+            Utils.print_stderr(f"❌ Error cleaning package {Colorize.yellow(package_name)}/{Colorize.yellow(version)}: {e}")
             return False
 
     def is_package_installed(self, package_name: str, version: str) -> bool:
@@ -835,40 +4025,41 @@ class PackageManager:
         Given <package>/<version> or <package>, return the matched package/version.
         Raise ValueError on failure.
         """
-        if "/" in input_str:
-            package_name, version = input_str.split("/", 1)
-        else:
-            package_name = input_str
-            version = None
+        with Profile.stage("resolve"):
+            if "/" in input_str:
+                package_name, version = input_str.split("/", 1)
+            else:
+                package_name = input_str
+                version = None
         
-        pkg = self.get_package(package_name)
-        if pkg is None:
-            pkg = Package.new_from_string(package_name)
-            pkg.update_versions(force=True)
-            pkg.update_whatis_url()
-            if pkg.source == "NA":
-                raise ValueError(f"Package {package_name} not found.")
-            self.update_package(pkg)
-            self.save_to_tsv()
+            pkg = self.get_package(package_name)
+            if pkg is None:
+                pkg = Package.new_from_string(package_name)
+                pkg.update_versions(force=True)
+                pkg.update_whatis_url()
+                if pkg.source == "NA":
+                    raise ValueError(f"Package {package_name} not found.")
+                self.update_package(pkg)
+                self.save_to_tsv()
 
-        if version is None:
-            latest_version = pkg.get_latest_version()
-            if latest_version is None:
-                raise ValueError(f"No versions found for package {package_name}.")
-            return package_name, latest_version
-        else:
-            if version in pkg.versions:
-                return package_name, version
-            elif version.endswith("*"):
-                prefix = version[:-1]
-                matched_versions = [v for v in pkg.versions if v.startswith(prefix)]
-                if matched_versions:
-                    matched_version = matched_versions[0]
-                    return package_name, matched_version
-                else:
-                    raise ValueError(f"No versions found for package {package_name} with prefix {prefix}.")
+            if version is None:
+                latest_version = pkg.get_latest_version()
+                if latest_version is None:
+                    raise ValueError(f"No versions found for package {package_name}.")
+                return package_name, latest_version
             else:
-                raise ValueError(f"Version {version} not found for package {package_name}.")
+                if version in pkg.versions:
+                    return package_name, version
+                elif version.endswith("*"):
+                    prefix = version[:-1]
+                    matched_versions = [v for v in pkg.versions if v.startswith(prefix)]
+                    if matched_versions:
+                        matched_version = matched_versions[0]
+                        return package_name, matched_version
+                    else:
+                        raise ValueError(f"No versions found for package {package_name} with prefix {prefix}.")
+                else:
+                    raise ValueError(f"Version {version} not found for package {package_name}.")
     
     def print_package_version(self, input_str: str):
         """
@@ -908,6 +4099,64 @@ class PackageManager:
             Utils.print_stderr(f"You may need to run {Colorize.yellow('./manager.py -u')} to update the local package database.")
             sys.exit(1)
 
+    def read_build_stats(self) -> List[Dict[str, str]]:
+        """
+        Read logs/build-stats.tsv written by common.sh (one row per completed local build).
+        """
+        import csv
+        path = Config.get_build_stats_path()
+        if not os.path.exists(path):
+            return []
+        with open(path, "r", encoding="utf-8") as f:
+            return list(csv.DictReader(f, delimiter="\t"))
+
+    def record_install_stats(self, package_name: str, version: str, mode: str, elapsed: float):
+        """
+        Append a conda or PyPI install to logs/build-stats.tsv (local builds are recorded by common.sh),
+        so --plan can estimate it. I/O counters are not measured (0).
+        """
+        import socket
+        path = Config.get_build_stats_path()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            new = not os.path.exists(path)
+            with open(path, "a", encoding="utf-8") as f:
+                if new:
+                    f.write("date\tmodule\tmode\tscratch\telapsed_s\trchar\twchar\tread_bytes\twrite_bytes\ttarget_bytes\tncpu\thost\n")
+                target_bytes = Usage.disk_usage(os.path.join(Config.apps_root, package_name, version))
+                f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')}\t{package_name}/{version}\t{mode}\tNA\t{int(elapsed)}\t0\t0\t0\t0\t{target_bytes}\t{Config.download_threads}\t{socket.gethostname()}\n")
+        except OSError as e:
+            Utils.print_stderr(f"⚠️ Cannot record install statistics in {path}: {e}")
+
+    def print_build_stats(self):
+        """
+        Print the latest build of each module per staging mode, so shared and scratch builds can be compared.
+        """
+        rows = self.read_build_stats()
+        if not rows:
+            Utils.print_stderr(f"No build statistics found at {Config.get_build_stats_path()}.")
+            return
+
+        latest: Dict[tuple, Dict[str, str]] = {}
+        for row in rows:
+            latest[(row["module"], row["mode"])] = row  # later rows win
+
+        def gb(value: str) -> str:
+            return f"{int(value or 0) / 1024**3:.2f}"
+
+        header = ["module", "mode", "elapsed", "read GB", "written GB", "target GB", "shared written GB"]
+        lines = []
+        for (module, mode), row in sorted(latest.items()):
+            # On scratch, only the final move of the target hits the shared filesystem
+            shared_written = row["target_bytes"] if mode == "scratch" else row["write_bytes"]
+            elapsed = int(row["elapsed_s"] or 0)
+            lines.append([module, mode, f"{elapsed // 3600}:{elapsed % 3600 // 60:02d}:{elapsed % 60:02d}",
+                          gb(row["read_bytes"]), gb(row["write_bytes"]), gb(row["target_bytes"]), gb(shared_written)])
+        widths = [max(len(str(x)) for x in col) for col in zip(header, *lines)]
+        print("  ".join(h.ljust(w) for h, w in zip(header, widths)).rstrip())
+        for line in lines:
+            print("  ".join(str(x).ljust(w) for x, w in zip(line, widths)).rstrip())
+
     def sort_packages(self):
         """
         Sort the internal package dictionary by package name.
@@ -928,6 +4177,7 @@ class PackageManager:
         """
         List all packages in the database.
         """
+        import shutil
         self.sort_packages()
         name_max_len = max(len(pkg.package) for pkg in self.packages.values()) if self.packages else 10
         screen_width = shutil.get_terminal_size().columns